@@ -0,0 +1,230 @@
+"""
+Structured answer-stream protocol for POST /chat/stream.
+
+The client picks the wire format with its Accept header:
+- text/event-stream      -> SSE (`event: <type>` + JSON `data:`)
+- application/x-ndjson   -> one JSON event per line
+- anything else          -> text/plain, answer text only (the original protocol)
+
+Event types: `ack` (localized "checking…" line sent right after routing), `status`
+(routing / planning / answering), `tool_start` and `tool_end`
+(tool name, duration, result summary), `text`, `error`, and a final `done` that carries
+the request's token usage. Text deltas are coalesced until STREAM_COALESCE_BYTES are
+buffered or STREAM_COALESCE_MS have passed since the first buffered delta, so the
+client gets a few larger writes instead of one frame per token.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+
+STREAM_COALESCE_SECONDS = float(os.getenv("STREAM_COALESCE_MS", "20")) / 1000
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "256"))
+
+MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+    "text": "text/plain",
+}
+
+
+class RequestEvents:
+    """
+    Side-channel events (status, tool activity) and token usage of one chat request.
+    Producers append (on the event loop); the stream encoder drains before every write
+    and is woken by new events while it waits for the next answer chunk.
+    """
+
+    __slots__ = ("pending", "usage", "started", "_tool_seq", "_waiter")
+
+    def __init__(self):
+        self.pending = []
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.started = time.perf_counter()
+        self._tool_seq = 0
+        self._waiter = None
+
+    def emit(self, event_type: str, **data):
+        self.pending.append({"type": event_type, **data})
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def waiter(self):
+        """
+        Future that resolves on the next emit() (reused until it does).
+        """
+        if self._waiter is None or self._waiter.done():
+            self._waiter = asyncio.get_running_loop().create_future()
+        return self._waiter
+
+    def add_usage(self, usage):
+        if usage is None:
+            return
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        self.usage["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.usage["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+
+    def next_tool_id(self) -> int:
+        self._tool_seq += 1
+        return self._tool_seq
+
+    def drain(self):
+        events, self.pending = self.pending, []
+        return events
+
+
+current_events = contextvars.ContextVar("current_events", default=None)
+
+
+def emit(event_type: str, **data):
+    """
+    Add an event to the current request's stream (no-op outside a chat request).
+    """
+    events = current_events.get()
+    if events is not None:
+        events.emit(event_type, **data)
+
+
+def record_usage(usage):
+    events = current_events.get()
+    if events is not None:
+        events.add_usage(usage)
+
+
+@contextmanager
+def tool_events(name: str):
+    """
+    Emit tool_start / tool_end around a tool call. The block may set `info["summary"]`.
+    """
+    events = current_events.get()
+    info = {}
+    if events is None:
+        yield info
+        return
+    tool_id = events.next_tool_id()
+    events.emit("tool_start", id=tool_id, tool=name)
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield info
+        ok = True
+    finally:
+        events.emit(
+            "tool_end", id=tool_id, tool=name, ok=ok,
+            ms=round((time.perf_counter() - started) * 1000, 1), **info,
+        )
+
+
+def negotiate(accept: str) -> str:
+    accept = (accept or "").lower()
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return "text"
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _frame(event: dict, fmt: str) -> str:
+    if fmt == "sse":
+        return sse(event["type"], event)
+    if fmt == "ndjson":
+        return json.dumps(event, ensure_ascii=False) + "\n"
+    if event["type"] == "ack":
+        # Plain-text clients get the acknowledgement as its own paragraph before the answer.
+        return event["text"] + "\n\n" if event["text"] else ""
+    return event["text"] if event["type"] == "text" else ""
+
+
+def frame(event_type: str, fmt: str, **data) -> str:
+    """
+    One event on its own in the given wire format (e.g. a response that is nothing but an error).
+    """
+    return _frame({"type": event_type, **data}, fmt)
+
+
+async def encode(answer, events: RequestEvents, fmt: str):
+    """
+    Turn an answer text stream plus the request's side-channel events into wire frames.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = []
+    size = 0
+    deadline = 0.0
+    iterator = answer.__aiter__()
+    pending = None
+
+    def flush() -> str:
+        nonlocal size
+        if not buffer:
+            return ""
+        text = "".join(buffer)
+        buffer.clear()
+        size = 0
+        return _frame({"type": "text", "text": text}, fmt)
+
+    def side_events() -> str:
+        drained = events.drain()
+        if not drained:
+            return ""
+        # Keep ordering: text buffered so far goes out before the event that followed it.
+        return flush() + "".join(_frame(e, fmt) for e in drained)
+
+    try:
+        while True:
+            out = side_events()
+            if out:
+                yield out
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            # Planning and tool calls run inside the answer stream, so their events are
+            # sent as they happen rather than with the next text chunk.
+            done, _ = await asyncio.wait(
+                {pending, events.waiter()}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if pending not in done:
+                if not done:
+                    out = flush()
+                    if out:
+                        yield out
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            # Events raised while this chunk was produced precede it.
+            out = side_events()
+            if out:
+                yield out
+            if not buffer:
+                deadline = loop.time() + STREAM_COALESCE_SECONDS
+            buffer.append(chunk)
+            size += len(chunk.encode("utf-8"))
+            if size >= STREAM_COALESCE_BYTES:
+                yield flush()
+    except Exception as e:
+        if fmt == "text":
+            raise
+        events.emit("error", message="The answer could not be completed.", detail=type(e).__name__)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    out = flush() + side_events()
+    events.emit(
+        "done",
+        usage=events.usage,
+        elapsed_ms=round((time.perf_counter() - events.started) * 1000, 1),
+    )
+    out += side_events()
+    if out:
+        yield out
@@ -0,0 +1,129 @@
+"""
+History compaction and token accounting for the stateless chat protocol.
+
+The client resends the whole conversation every turn; these helpers decide what
+actually goes to the model. Every call starts with the same system prompt (and
+the same TOOLS list), so the provider can cache that prefix across calls/turns.
+"""
+import functools
+import os
+import threading
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+EXTRACTION_USER_TURNS = int(os.getenv("EXTRACTION_USER_TURNS", "3"))
+
+SUMMARY_MAX_ITEMS = 5
+SUMMARY_ITEM_CHARS = 80
+
+
+@functools.lru_cache(maxsize=1024)
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate: ~4 chars per token for Latin text, ~2 for Hebrew/other scripts.
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii // 2 + 1
+
+
+def message_tokens(message: dict) -> int:
+    # ~4 tokens of per-message overhead (role, separators)
+    return estimate_tokens(message.get("content") or "") + 4
+
+
+def _clean(messages):
+    return [
+        {"role": m["role"], "content": m.get("content") or ""}
+        for m in messages
+        if isinstance(m, dict) and m.get("role") in ("user", "assistant")
+    ]
+
+
+def _summarize(dropped):
+    """
+    Local (no model call) note about turns that no longer fit the budget:
+    the most recent user requests among them, truncated.
+    """
+    requests = [m["content"] for m in dropped if m["role"] == "user" and m["content"]]
+    if not requests:
+        return None
+    items = [
+        text if len(text) <= SUMMARY_ITEM_CHARS else text[:SUMMARY_ITEM_CHARS] + "…"
+        for text in requests[-SUMMARY_MAX_ITEMS:]
+    ]
+    return (
+        f"Earlier in this conversation ({len(dropped)} older messages omitted) the user asked:\n"
+        + "\n".join(f"- {item}" for item in items)
+    )
+
+
+def build_messages(system_prompt: str, messages, budget: int = HISTORY_TOKEN_BUDGET):
+    """
+    System prompt first, then the most recent turns that fit into `budget` tokens.
+    Older turns are replaced by a short summary note; the last user message is always kept.
+    """
+    history = _clean(messages)
+    used = estimate_tokens(system_prompt)
+
+    kept = []
+    for m in reversed(history):
+        cost = message_tokens(m)
+        if kept and used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+
+    result = [{"role": "system", "content": system_prompt}]
+    summary = _summarize(history[: len(history) - len(kept)])
+    if summary:
+        result.append({"role": "system", "content": summary})
+    return result + kept
+
+
+def build_extraction_messages(system_prompt: str, messages, user_turns: int = EXTRACTION_USER_TURNS):
+    """
+    Messages for forced-tool-choice extraction calls: only the last few user messages
+    (an earlier turn may hold the phone/email); assistant answers are not needed.
+    """
+    users = [m for m in _clean(messages) if m["role"] == "user"]
+    return [{"role": "system", "content": system_prompt}] + users[-user_turns:]
+
+
+class TokenLedger:
+    """
+    Per-stage counters of what was sent to the model: estimated prompt tokens plus
+    the provider-reported prompt/cached/completion/reasoning tokens when usage is returned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage: str, messages, usage=None):
+        estimated = sum(message_tokens(m) for m in messages)
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        reasoning = getattr(getattr(usage, "completion_tokens_details", None), "reasoning_tokens", 0) or 0
+        with self._lock:
+            s = self._stages.setdefault(
+                stage,
+                {"calls": 0, "estimated_prompt_tokens": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                 "reasoning_tokens": 0},
+            )
+            s["calls"] += 1
+            s["estimated_prompt_tokens"] += estimated
+            s["prompt_tokens"] += prompt
+            s["cached_tokens"] += cached
+            s["completion_tokens"] += completion
+            s["reasoning_tokens"] += reasoning
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {stage: dict(s) for stage, s in self._stages.items()}
+
+
+token_ledger = TokenLedger()
@@ -0,0 +1,99 @@
+"""
+Keyword intent router for the chat flows (stock / rx / refill), English and Hebrew.
+
+The keyword tables are compiled once, at import, into a single regex automaton.
+`route_intents()` scans the message once and returns every matching intent with a
+confidence score, so compound requests ("is X in stock and can I refill it")
+can be served in the same turn.
+"""
+import re
+
+from services.extractor import normalize_hebrew
+
+# intent -> [(keyword, weight)]; weight ~ how unambiguous the keyword is on its own.
+INTENT_KEYWORDS = {
+    "stock": {
+        "en": [("in stock", 1.0), ("check stock", 1.0), ("stock", 0.9), ("availability", 0.9), ("available", 0.7)],
+        "he": [("מלאי", 1.0), ("זמינות", 0.9), ("זמין", 0.7), ("יש לכם", 0.5)],
+    },
+    "rx": {
+        "en": [("check prescriptions", 1.0), ("prescriptions", 0.9), ("prescription", 0.8), ("rx", 0.6)],
+        "he": [("תבדוק מרשמים", 1.0), ("בדוק מרשמים", 1.0), ("מרשמים", 0.9), ("מרשם", 0.8)],
+    },
+    "refill": {
+        "en": [("request refill", 1.0), ("refill", 1.0), ("renewal", 0.9), ("renew", 0.9)],
+        "he": [("בקשת חידוש", 1.0), ("חידוש", 0.9), ("לחדש", 0.9), ("ריפיל", 1.0)],
+    },
+}
+
+# Tie-break order (also the order compound answers are streamed in).
+INTENT_ORDER = ("stock", "rx", "refill")
+
+# Secondary intents below this score are ignored.
+MIN_CONFIDENCE = 0.5
+
+# A refill already looks up the user's prescriptions, so it absorbs an rx match
+# ("refill my prescription for X" is one request, not two).
+ABSORBS = {"refill": ("rx",)}
+
+EN_SUFFIX = r"(?:s|es|ed|ing)?"
+HE_PREFIXES = "[והבלמשכ]{0,2}"
+HE_LETTER = "א-ת"
+
+
+def _normalize(text: str) -> str:
+    return " ".join(normalize_hebrew(text).lower().split())
+
+
+def _compile():
+    """
+    One alternation over every keyword, longest first, each in its own named group
+    so a match maps straight back to (intent, weight).
+    """
+    parts = []
+    groups = {}
+    keywords = [
+        (intent, lang, keyword, weight)
+        for intent, by_lang in INTENT_KEYWORDS.items()
+        for lang, items in by_lang.items()
+        for keyword, weight in items
+    ]
+    keywords.sort(key=lambda k: len(k[2]), reverse=True)
+
+    for i, (intent, lang, keyword, weight) in enumerate(keywords):
+        name = f"k{i}"
+        groups[name] = (intent, weight)
+        body = r"\s+".join(re.escape(w) for w in _normalize(keyword).split())
+        if lang == "en":
+            # Whole words only: "rx" must not fire inside another word.
+            parts.append(rf"(?P<{name}>\b{body}{EN_SUFFIX}\b)")
+        else:
+            # Hebrew: word start after optional attached prefixes; inflected endings allowed.
+            parts.append(rf"(?P<{name}>(?<![{HE_LETTER}]){HE_PREFIXES}{body})")
+    return re.compile("|".join(parts)), groups
+
+
+_PATTERN, _GROUPS = _compile()
+
+
+def route_intents(text: str):
+    """
+    Return [(intent, confidence)] for `text`, best first; empty if no flow applies.
+    Confidence combines every keyword hit for an intent (noisy-OR of their weights).
+    """
+    misses = {}
+    for m in _PATTERN.finditer(_normalize(text)):
+        intent, weight = _GROUPS[m.lastgroup]
+        misses[intent] = misses.get(intent, 1.0) * (1.0 - weight)
+
+    scores = {intent: round(1.0 - miss, 3) for intent, miss in misses.items()}
+    for intent, absorbed in ABSORBS.items():
+        if intent in scores:
+            for other in absorbed:
+                scores.pop(other, None)
+
+    ranked = sorted(scores.items(), key=lambda kv: (-kv[1], INTENT_ORDER.index(kv[0])))
+    if not ranked:
+        return []
+    top = ranked[0]
+    return [top] + [(intent, score) for intent, score in ranked[1:] if score >= MIN_CONFIDENCE]
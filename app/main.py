@@ -1,26 +1,184 @@
+import time
+
+# Import-to-ready time (GET /readyz, /metrics) is measured from here.
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import hmac
 import json
+import asyncio
+import threading
+import contextvars
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from openai import OpenAI
+from starlette.background import BackgroundTask
 
+from app.events import (
+    MEDIA_TYPES,
+    RequestEvents,
+    current_events,
+    emit,
+    encode,
+    frame,
+    negotiate,
+    record_usage,
+    sse,
+    tool_events,
+)
+from app.history import build_extraction_messages, build_messages, token_ledger
+from app.intents import route_intents
+from app.model_routing import ModelRouter, observe_latency, observe_tokens
+from app.render import render_nearest_stock_answer, render_prescriptions_answer, render_stock_answer
+from app.startup import Startup
+from app.telemetry import (
+    ADMISSION_WAIT_SECONDS,
+    ERRORS,
+    REQUESTS,
+    current_flow,
+    instrument_stream,
+    log,
+    register_collector,
+    render_metrics,
+    span,
+    stats_lines,
+    summarize_result,
+)
 from services.db import (
+    catalog_store,
+    check_inventory_many,
+    get_medications_by_names,
     get_medication_by_name,
     check_inventory,
     get_user_by_contact,
     list_user_prescriptions,
+    pool_stats,
+    warm_pool,
 )
+from services.admission import AdmissionController, AdmissionRejected
+from services.cache import cache_stats, table_versions
+from services.extractor import extract_contact, extract_medication_name, get_matcher
+from services.geo import CITY_NAMES_HE, extract_city, find_nearest_branches, get_branch_index
+from services.inventory_feed import inventory_feed, update_inventory
+from services.migrations import migrate
+from services.refills import refill_writer, submit_refill_async
+from services.search import best_medication_match, ensure_medication_search, search_medications
+from services.singleflight import SingleFlight, singleflight_stats
+from services.upstream import call_upstream, start_request_budget, stream_upstream, upstream_stats
 
 load_dotenv()
 
-OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Per-stage routing (see app/model_routing.py), e.g. extraction on a small fast model:
+# OPENAI_MODEL_ROUTES="extract=gpt-5-nano", OPENAI_REASONING_EFFORT="extract=minimal".
+model_router = ModelRouter(
+    OPENAI_MODEL,
+    os.getenv("OPENAI_MODEL_ROUTES", ""),
+    os.getenv("OPENAI_MAX_TOKENS", ""),
+    os.getenv("OPENAI_REASONING_EFFORT", ""),
+)
+
+# Per-flow answer rendering: "llm" streams a final model answer, "template" renders the DB facts locally.
+STOCK_RENDER_MODE = os.getenv("STOCK_RENDER_MODE", "llm")
+RX_RENDER_MODE = os.getenv("RX_RENDER_MODE", "llm")
+
+# Stock answers list at most this many branches: the nearest ones when the user names a city,
+# otherwise the ones with the most units.
+STOCK_NEAREST_K = int(os.getenv("STOCK_NEAREST_K", "3"))
+STOCK_MIN_QUANTITY = int(os.getenv("STOCK_MIN_QUANTITY", "1"))
+STOCK_MAX_BRANCHES = int(os.getenv("STOCK_MAX_BRANCHES", "5"))
+
+# Bearer token required by POST /inventory/deltas; unset disables the endpoint.
+INVENTORY_API_TOKEN = os.getenv("INVENTORY_API_TOKEN", "")
+
+# Client-supplied key for the current chat turn; a retried turn reuses it so a refill is submitted once.
+idempotency_key = contextvars.ContextVar("idempotency_key", default=None)
+
+# Keep-alive pool to the model endpoint; OPENAI_WARM_CONNECTIONS of them are opened during warm-up.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_KEEPALIVE_S = float(os.getenv("OPENAI_KEEPALIVE_S", "60"))
+OPENAI_WARM_CONNECTIONS = int(os.getenv("OPENAI_WARM_CONNECTIONS", "4"))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The shared AsyncOpenAI client. The openai package is imported here rather than at
+    module import (it is the slowest import); warm-up builds it on a worker thread.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not OPENAI_API_KEY:
+                    raise RuntimeError("OPENAI_API_KEY is not set")
+                import httpx
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+                limits = httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_S,
+                )
+                # Deadlines and retries are handled per stage by services/upstream.py.
+                _client = AsyncOpenAI(
+                    api_key=OPENAI_API_KEY,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=limits),
+                )
+    return _client
+
+
+async def _warm_model_pool():
+    """
+    Open keep-alive connections (TCP + TLS) to the model endpoint with a few
+    concurrent lightweight requests, so the first chats don't pay the handshakes.
+    """
+    warm = get_client().with_options(max_retries=0, timeout=10)
+    # Spread over the routed models, which also checks early that each one exists.
+    models = sorted(model_router.models_in_use())
+    await asyncio.gather(
+        *(warm.models.retrieve(models[i % len(models)]) for i in range(max(OPENAI_WARM_CONNECTIONS, len(models))))
+    )
+
+
+startup = Startup(IMPORT_STARTED)
+
+
+async def _warm_up():
+    steps = [
+        startup.run("openai_client", get_client),
+        startup.run("medication_search", ensure_medication_search),
+        startup.run("db_pool", warm_pool),
+        startup.run("medication_matcher", get_matcher),
+        startup.run("branch_index", get_branch_index),
+    ]
+    if catalog_store.enabled:
+        steps.append(startup.run("catalog_snapshot", catalog_store.build))
+    await asyncio.gather(*steps, return_exceptions=True)
+    if not startup.failed and OPENAI_WARM_CONNECTIONS > 0:
+        await startup.run("model_pool", _warm_model_pool, required=False)
+    startup.finish()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # The schema must be current before the first request; the rest warms up in the background.
+    await startup.run("migrate", migrate)
+    warm_up = asyncio.create_task(_warm_up())
+    yield
+    warm_up.cancel()
+    if _client is not None:
+        await _client.close()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/web", StaticFiles(directory="web", html=True), name="web")
 
 SYSTEM_PROMPT = """You are an AI pharmacist assistant for a retail pharmacy.
@@ -36,8 +194,10 @@ Hard rules:
 
 Tool / data rules (critical):
 - For ANY question about a specific medication (info, active ingredient, dosage/usage instructions, prescription requirement),
-  you MUST call get_medication_by_name first.
-- For ANY question about stock/availability, you MUST call get_medication_by_name first, then check_inventory.
+  you MUST call get_medication_by_name first. If it returns None (misspelled or partial name, or the user named an
+  active ingredient), call search_medications and use the top candidate only if it is clearly the one meant.
+- For ANY question about stock/availability, you MUST call get_medication_by_name first, then check_inventory
+  (or find_nearest_branches when the user gives a city or location).
 - For ANY question about prescriptions/refills, you MUST call get_user_by_contact first, then list_user_prescriptions.
 - You may ONLY use facts returned by tools/DB for medication details (ingredient, dosage, warnings, prescription requirement, stock, prescriptions).
 - If a tool returns None (not found), ask a short clarifying question.
@@ -56,7 +216,7 @@ Prescription response format (when user asks about prescriptions/refills):
 - End with a short question asking if they want to request a refill for an ACTIVE prescription
 
 Refill request behavior:
-- This is a simulated request submission.
+- Submissions are real: each one is recorded and uses up one of the prescription's remaining refills.
 - Only allow refill submission if: prescription exists for that medication, status is active, and refills_left > 0.
 - Otherwise, explain why it can't be submitted (no prescription / expired / no refills left).
 """
@@ -74,14 +234,71 @@ TOOLS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_medications_by_names",
+            "description": "Lookup several medications at once by English or Hebrew name; returns details (or null) per name.",
+            "parameters": {
+                "type": "object",
+                "properties": {"names": {"type": "array", "items": {"type": "string"}}},
+                "required": ["names"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_medications",
+            "description": (
+                "Fuzzy search by (possibly misspelled or partial) English/Hebrew name or active ingredient; "
+                "returns ranked candidates with a 0-1 score."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"},
+                    "limit": {"type": "integer"},
+                },
+                "required": ["query"],
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
             "name": "check_inventory",
-            "description": "Check stock availability for a medication across pharmacy branches.",
+            "description": (
+                "Check stock availability across pharmacy branches for one medication (medication_id) "
+                "or several at once (medication_ids)."
+            ),
             "parameters": {
                 "type": "object",
-                "properties": {"medication_id": {"type": "integer"}},
+                "properties": {
+                    "medication_id": {"type": "integer"},
+                    "medication_ids": {"type": "array", "items": {"type": "integer"}},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_nearest_branches",
+            "description": (
+                "Find the k branches nearest to a city (English or Hebrew name) or to coordinates "
+                "that have at least min_quantity units of a medication, nearest first."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "medication_id": {"type": "integer"},
+                    "city": {"type": "string"},
+                    "latitude": {"type": "number"},
+                    "longitude": {"type": "number"},
+                    "min_quantity": {"type": "integer"},
+                    "k": {"type": "integer"},
+                },
                 "required": ["medication_id"],
             },
         },
@@ -112,12 +329,44 @@ TOOLS = [
     },
 ]
 
+# The static part of every model request, built once. Passed as extra_body, the tool
+# schemas go straight into the JSON body instead of through the SDK's per-call
+# TypedDict transform (a few ms of CPU per call).
+_ANSWER_BODY = {"tools": TOOLS, "tool_choice": "none"}
+_AUTO_PLAN_BODY = {"tools": TOOLS, "tool_choice": "auto"}
+_FORCED_PLAN_BODIES = {
+    tool["function"]["name"]: {
+        "tools": TOOLS,
+        "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+    }
+    for tool in TOOLS
+}
+
 
 def run_tool(name: str, args: dict):
     if name == "get_medication_by_name":
         return get_medication_by_name(args["name"])
+    if name == "get_medications_by_names":
+        return get_medications_by_names(args["names"])
+    if name == "search_medications":
+        return search_medications(args["query"], int(args.get("limit", 5)))
     if name == "check_inventory":
+        if "medication_ids" in args:
+            ids = args["medication_ids"]
+            return [
+                {"medication_id": int(medication_id), "branches": branches}
+                for medication_id, branches in zip(ids, check_inventory_many(ids))
+            ]
         return check_inventory(int(args["medication_id"]))
+    if name == "find_nearest_branches":
+        return find_nearest_branches(
+            int(args["medication_id"]),
+            city=args.get("city"),
+            latitude=args.get("latitude"),
+            longitude=args.get("longitude"),
+            min_quantity=int(args.get("min_quantity", 1)),
+            k=int(args.get("k", 3)),
+        )
     if name == "get_user_by_contact":
         return get_user_by_contact(args["contact"])
     if name == "list_user_prescriptions":
@@ -125,287 +374,507 @@ def run_tool(name: str, args: dict):
     return {"error": f"Unknown tool: {name}"}
 
 
+# Identical concurrent work shares one in-flight call (see services/singleflight.py):
+# DB tool calls, planning calls, answer completions, and whole stock flows.
+tool_flights = SingleFlight("tool")
+plan_flights = SingleFlight("plan")
+answer_flights = SingleFlight("answer")
+flow_flights = SingleFlight("flow")
+
+# Concurrency limits and the wait queue for chat requests (see services/admission.py).
+admission = AdmissionController()
+
+
+def _messages_key(messages) -> str:
+    # The system prompt opens nearly every message list; it is keyed by a marker, not re-encoded.
+    if messages and messages[0].get("content") == SYSTEM_PROMPT:
+        return "system+" + json.dumps(messages[1:], ensure_ascii=False, sort_keys=True)
+    return json.dumps(messages, ensure_ascii=False, sort_keys=True)
+
+
+async def run_tool_async(name: str, args: dict):
+    """
+    Run a (blocking) DB tool on a worker thread so the event loop stays free.
+    Concurrent identical calls (same args, same data versions) share one query.
+    """
+    key = (name, json.dumps(args, sort_keys=True, default=str), table_versions())
+    with span(f"tool:{name}"), tool_events(name) as info:
+        result = await tool_flights.do(key, asyncio.to_thread, run_tool, name, args)
+        info["summary"] = summarize_result(result)
+    # Arguments stay out of the log: they can carry a customer's phone number or email.
+    log.info("tool %s result=%s", name, info["summary"])
+    return result
+
+
+def _record_usage(stage: str, messages, usage):
+    token_ledger.record(stage, messages, usage)
+    record_usage(usage)
+
+
 def _looks_like_hebrew(text: str) -> bool:
     return any("\u0590" <= ch <= "\u05FF" for ch in text)
 
 
-@app.post("/chat/stream")
-def chat_stream(payload: dict):
-    messages = payload.get("messages", [])
-    if not isinstance(messages, list):
-        messages = []
+def _stream_completion(stage: str, messages, **kwargs):
+    """
+    Stream the text deltas of a chat completion as they arrive.
+    Concurrent requests with identical messages share one upstream stream.
+    """
+    emit("status", stage=stage)
+    route = model_router.route(stage, current_flow.get())
+    key = (stage, route.model, _messages_key(messages), json.dumps(kwargs, sort_keys=True))
+    return answer_flights.stream(key, _completion_deltas, stage, route, messages, kwargs)
 
-    full_messages = [{"role": "system", "content": SYSTEM_PROMPT}] + messages
 
-    # ---- Get last user text for intent routing ----
-    last_user = ""
-    for m in reversed(messages):
-        if isinstance(m, dict) and m.get("role") == "user":
-            last_user = (m.get("content") or "").strip()
-            break
+async def _completion_deltas(stage: str, route, messages, kwargs):
+    """
+    Every answer call sends the same TOOLS (with tool_choice="none") so the
+    system prompt + tool schemas form a stable, cacheable prompt prefix.
+    """
+    body = route.body(_ANSWER_BODY)
+
+    def open_stream():
+        return get_client().chat.completions.create(
+            model=route.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_body=body,
+            **kwargs,
+        )
 
-    stock_keywords = ["in stock", "stock", "availability", "available", "check stock"]
-    stock_keywords_he = ["מלאי", "זמין", "זמינות", "יש לכם"]
+    started = time.perf_counter()
+    first = True
+    async for chunk in stream_upstream(stage, open_stream):
+        if first:
+            observe_latency(stage, route, time.perf_counter() - started)
+            first = False
+        if chunk.usage is not None:
+            _record_usage(stage, messages, chunk.usage)
+            observe_tokens(stage, route, chunk.usage)
+        if not chunk.choices:
+            continue
+        text = getattr(chunk.choices[0].delta, "content", None)
+        if text:
+            yield text
 
-    rx_keywords = ["prescription", "prescriptions", "rx", "check prescriptions"]
-    rx_keywords_he = ["מרשם", "מרשמים", "תבדוק מרשמים", "בדוק מרשמים"]
 
-    refill_keywords = ["refill", "renew", "renewal", "request refill"]
-    refill_keywords_he = ["חידוש", "לחדש", "בקשת חידוש", "ריפיל"]
+async def _plan_tool_args(extract_messages, tool_name: str):
+    """
+    Force the model to call `tool_name` and return the arguments it chose (or None).
+    """
+    emit("status", stage=f"plan:{tool_name}")
+    route = model_router.route(f"extract:{tool_name}", current_flow.get())
+    with span(f"plan:{tool_name}"):
+        planning = await plan_flights.do(
+            (tool_name, route.model, _messages_key(extract_messages)), _forced_planning, extract_messages, tool_name, route
+        )
+    tool_calls = getattr(planning.choices[0].message, "tool_calls", None)
+    if not tool_calls:
+        return None
+    return json.loads(tool_calls[0].function.arguments or "{}")
 
-    is_stock_intent = any(k in last_user.lower() for k in stock_keywords) or any(
-        k in last_user for k in stock_keywords_he
-    )
-    is_rx_intent = any(k in last_user.lower() for k in rx_keywords) or any(
-        k in last_user for k in rx_keywords_he
-    )
-    is_refill_intent = any(k in last_user.lower() for k in refill_keywords) or any(
-        k in last_user for k in refill_keywords_he
+
+async def _forced_planning(extract_messages, tool_name: str, route):
+    stage = f"extract:{tool_name}"
+    body = route.body(_FORCED_PLAN_BODIES[tool_name])
+    started = time.perf_counter()
+    planning = await call_upstream(
+        stage,
+        lambda: get_client().chat.completions.create(
+            model=route.model,
+            messages=extract_messages,
+            stream=False,
+            extra_body=body,
+        ),
+        hedge=True,
     )
+    observe_latency(stage, route, time.perf_counter() - started)
+    _record_usage(stage, extract_messages, planning.usage)
+    observe_tokens(stage, route, planning.usage)
+    return planning
 
-    # =========================
-    # FLOW 1: STOCK AVAILABILITY
-    # =========================
-    if is_stock_intent:
-        planning_med = client.chat.completions.create(
-            model=OPENAI_MODEL,
+
+async def _auto_planning(full_messages, route):
+    body = route.body(_AUTO_PLAN_BODY)
+    started = time.perf_counter()
+    planning = await call_upstream(
+        "plan:default",
+        lambda: get_client().chat.completions.create(
+            model=route.model,
             messages=full_messages,
-            tools=TOOLS,
-            tool_choice={"type": "function", "function": {"name": "get_medication_by_name"}},
             stream=False,
-        )
+            extra_body=body,
+        ),
+        hedge=True,
+    )
+    observe_latency("plan:default", route, time.perf_counter() - started)
+    _record_usage("plan:default", full_messages, planning.usage)
+    observe_tokens("plan:default", route, planning.usage)
+    return planning
 
-        assistant_msg = planning_med.choices[0].message
-        tool_calls = getattr(assistant_msg, "tool_calls", None)
 
-        med = None
-        if tool_calls:
-            tc = tool_calls[0]
-            tool_args = json.loads(tc.function.arguments or "{}")
-            med = run_tool("get_medication_by_name", tool_args)
-            print(f"[TOOL] get_medication_by_name args={tool_args} result={med}")
+async def _resolve_with_tool(extract_messages, last_user: str, tool_name: str):
+    """
+    Look up the medication/user the last message refers to.
+    The local extractor handles the common case; the forced-tool-choice LLM call
+    only runs when it finds nothing or the message is ambiguous.
+    """
+    if tool_name == "get_medication_by_name":
+        value = extract_medication_name(last_user)
+        tool_args = {"name": value} if value else None
+    else:
+        value = extract_contact(last_user)
+        tool_args = {"contact": value} if value else None
 
-        if not med:
-            def event_generator_not_found():
-                if _looks_like_hebrew(last_user):
-                    yield "לא מצאתי את התרופה במערכת. אפשר לרשום את השם המדויק (עברית/אנגלית) כדי שאבדוק מלאי?"
-                else:
-                    yield "I couldn't find that medication in our catalog. Please provide the exact name (English or Hebrew) so I can check stock."
-            return StreamingResponse(event_generator_not_found(), media_type="text/plain")
+    if tool_args is None:
+        tool_args = await _plan_tool_args(extract_messages, tool_name)
+        if tool_args is None:
+            return None
 
-        inv = check_inventory(int(med["id"]))
-        print(f"[TOOL] check_inventory args={{'medication_id': {med['id']}}} result={inv}")
+    result = await run_tool_async(tool_name, tool_args)
+    if result is None and tool_name == "get_medication_by_name" and tool_args.get("name"):
+        # Misspelled/partial names and ingredients: a confident fuzzy hit saves a clarification turn.
+        hit = await asyncio.to_thread(best_medication_match, tool_args["name"])
+        if hit is not None:
+            result = await run_tool_async(tool_name, {"name": hit["name_en"]})
+    return result
 
-        full_messages.append(
-            {
-                "role": "system",
-                "content": (
-                    "Use ONLY the following internal DB facts to answer. "
-                    "Do not add external medical information.\n"
-                    f"Medication: {json.dumps(med, ensure_ascii=False)}\n"
-                    f"Inventory: {json.dumps(inv, ensure_ascii=False)}\n"
-                    "Now answer the user's stock question. "
-                    "Format: summary line, then branches sorted by quantity with branch_name, city, hours, quantity."
-                ),
-            }
-        )
 
-        def event_generator():
-            stream = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=full_messages,
-                stream=True,
-            )
-            for chunk in stream:
-                delta = chunk.choices[0].delta
-                text = getattr(delta, "content", None)
-                if text:
-                    yield text
-
-        return StreamingResponse(event_generator(), media_type="text/plain")
-
-    # =========================
-    # FLOW 2: PRESCRIPTION LOOKUP
-    # =========================
-    if is_rx_intent:
-        planning_user = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=full_messages,
-            tools=TOOLS,
-            tool_choice={"type": "function", "function": {"name": "get_user_by_contact"}},
-            stream=False,
-        )
+def _text_stream(text: str):
+    """
+    Stream a single, locally rendered reply.
+    """
+    async def event_generator():
+        yield text
 
-        assistant_msg = planning_user.choices[0].message
-        tool_calls = getattr(assistant_msg, "tool_calls", None)
+    return event_generator()
 
-        user = None
-        if tool_calls:
-            tc = tool_calls[0]
-            tool_args = json.loads(tc.function.arguments or "{}")
-            user = run_tool("get_user_by_contact", tool_args)
-            print(f"[TOOL] get_user_by_contact args={tool_args} result={user}")
 
-        if not user:
-            def event_generator_user_not_found():
-                if _looks_like_hebrew(last_user):
-                    yield "לא מצאתי משתמש/ת עם הפרטים האלה. אפשר לשלוח מספר טלפון או אימייל כפי שמופיע במערכת?"
-                else:
-                    yield "I couldn’t find a user with that contact. Please provide the phone number or email exactly as stored in the system."
-            return StreamingResponse(event_generator_user_not_found(), media_type="text/plain")
+def _acknowledgement(intents, last_user: str) -> str:
+    """
+    Short localized "working on it" line sent as soon as the request is routed,
+    before any planning call or DB lookup. Uses only local extraction.
+    """
+    hebrew = _looks_like_hebrew(last_user)
+    parts = []
+    for intent, _ in intents:
+        if intent == "stock":
+            name = extract_medication_name(last_user)
+            if hebrew:
+                parts.append(f"בודק/ת מלאי עבור {name}…" if name else "בודק/ת מלאי…")
+            else:
+                parts.append(f"Checking stock for {name}…" if name else "Checking stock…")
+        elif intent == "rx":
+            parts.append("מחפש/ת את המרשמים שלך…" if hebrew else "Looking up your prescriptions…")
+        elif intent == "refill":
+            parts.append("מכין/ה את בקשת החידוש…" if hebrew else "Preparing your refill request…")
+    return " ".join(parts)
 
-        presc = list_user_prescriptions(int(user["id"]))
-        print(f"[TOOL] list_user_prescriptions args={{'user_id': {user['id']}}} result={presc}")
 
-        full_messages.append(
-            {
-                "role": "system",
-                "content": (
-                    "Use ONLY the following internal DB facts to answer. Do not add external medical information.\n"
-                    f"User: {json.dumps(user, ensure_ascii=False)}\n"
-                    f"Prescriptions: {json.dumps(presc, ensure_ascii=False)}\n"
-                    "Now answer the user's prescription question.\n"
-                    "Format:\n"
-                    "- Start with the user's name.\n"
-                    "- List prescriptions with medication name (match language), status, refills_left.\n"
-                    "- If none exist, say so.\n"
-                    "- End with a short question: whether they want to request a refill for an active prescription.\n"
-                ),
-            }
-        )
+async def _deferred(flow, *args):
+    """
+    Run a flow's planning and tool calls inside the response stream, then stream its answer,
+    so the response opens (and the acknowledgement goes out) before any model round trip.
+    """
+    answer = await flow(*args)
+    async for text in answer:
+        yield text
 
-        def event_generator():
-            stream = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=full_messages,
-                stream=True,
-            )
-            for chunk in stream:
-                delta = chunk.choices[0].delta
-                text = getattr(delta, "content", None)
-                if text:
-                    yield text
-
-        return StreamingResponse(event_generator(), media_type="text/plain")
-
-    # =========================
-    # FLOW 3: REFILL REQUEST
-    # =========================
-    if is_refill_intent:
-        # Extract user contact
-        planning_user = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=full_messages,
-            tools=TOOLS,
-            tool_choice={"type": "function", "function": {"name": "get_user_by_contact"}},
-            stream=False,
+
+def _shared_flow_key(intent: str, full_messages, last_user: str):
+    """
+    Key under which concurrent requests can share a whole flow: (intent, entity,
+    language, data version). Only stock answers qualify, and only when the medication
+    is recognized locally. Template answers are built from catalog and inventory facts
+    alone; LLM answers also read the conversation, so they are shared only between
+    identical conversations.
+    """
+    if intent != "stock":
+        return None
+    name = extract_medication_name(last_user)
+    if not name:
+        return None
+    key = (
+        intent, name, extract_city(last_user), _looks_like_hebrew(last_user),
+        table_versions("medications", "branches", "inventory"),
+    )
+    if STOCK_RENDER_MODE != "template":
+        key += (_messages_key(full_messages),)
+    return key
+
+
+async def _run_flow(intent: str, full_messages, extract_messages, last_user: str):
+    key = _shared_flow_key(intent, full_messages, last_user)
+    if key is None:
+        return await FLOWS[intent](full_messages, extract_messages, last_user)
+    return flow_flights.stream(key, _deferred, FLOWS[intent], full_messages, extract_messages, last_user)
+
+
+# How a failed part of a compound request is named in its error line.
+_FLOW_LABELS = {
+    "stock": ("the stock check", "בדיקת המלאי"),
+    "rx": ("the prescription lookup", "בדיקת המרשמים"),
+    "refill": ("the refill request", "בקשת החידוש"),
+}
+
+
+def _flow_failed_text(intent: str, hebrew: bool) -> str:
+    label_en, label_he = _FLOW_LABELS.get(intent, ("this part of your request", "החלק הזה של הבקשה"))
+    if hebrew:
+        return f"לא הצלחתי להשלים כרגע את {label_he}. אפשר לשאול על זה שוב בעוד רגע?"
+    return f"I couldn't complete {label_en} right now. Could you ask about it again in a moment?"
+
+
+async def _run_flows(intents, full_messages, extract_messages, last_user: str):
+    # Compound requests ("is X in stock and can I refill it") run every matched flow
+    # concurrently and stream their answers back to back in one turn.
+    names = [intent for intent, _ in intents]
+    if len(names) == 1:
+        return await _run_flow(names[0], full_messages, extract_messages, last_user)
+    # One failing flow must not hide the others' answers: a refill may already be committed.
+    answers = await asyncio.gather(
+        *(_run_flow(intent, full_messages, extract_messages, last_user) for intent in names),
+        return_exceptions=True,
+    )
+    return _chain(names, answers, _looks_like_hebrew(last_user))
+
+
+async def _chain(names, answers, hebrew: bool, separator: str = "\n\n"):
+    """
+    Stream several flow answers one after another (compound requests). A flow that
+    failed, before or while streaming, is replaced by a short error line.
+    """
+    for i, (intent, answer) in enumerate(zip(names, answers)):
+        if i:
+            yield separator
+        if isinstance(answer, Exception):
+            ERRORS.inc(flow=intent, stage="flow")
+            log.warning("%s flow failed: %r", intent, answer)
+            yield _flow_failed_text(intent, hebrew)
+            continue
+        streamed = False
+        try:
+            async for text in answer:
+                streamed = True
+                yield text
+        except Exception as e:
+            ERRORS.inc(flow=intent, stage="stream")
+            log.warning("%s flow answer failed: %r", intent, e)
+            yield (separator if streamed else "") + _flow_failed_text(intent, hebrew)
+
+
+# =========================
+# FLOW 1: STOCK AVAILABILITY
+# =========================
+async def _stock_flow(full_messages, extract_messages, last_user: str):
+    current_flow.set("stock")
+    med = await _resolve_with_tool(extract_messages, last_user, "get_medication_by_name")
+
+    if not med:
+        if _looks_like_hebrew(last_user):
+            return _text_stream("לא מצאתי את התרופה במערכת. אפשר לרשום את השם המדויק (עברית/אנגלית) כדי שאבדוק מלאי?")
+        return _text_stream("I couldn't find that medication in our catalog. Please provide the exact name (English or Hebrew) so I can check stock.")
+
+    hebrew = _looks_like_hebrew(last_user)
+    city = extract_city(last_user)
+    if city:
+        nearest = await run_tool_async(
+            "find_nearest_branches",
+            {"medication_id": int(med["id"]), "city": city, "min_quantity": STOCK_MIN_QUANTITY, "k": STOCK_NEAREST_K},
+        )
+        if STOCK_RENDER_MODE == "template":
+            city_label = CITY_NAMES_HE.get(city, city) if hebrew else city
+            return _text_stream(render_nearest_stock_answer(med, nearest, city_label, hebrew))
+        facts = (
+            f"Nearest branches to {city} with at least {STOCK_MIN_QUANTITY} units: "
+            f"{json.dumps(nearest, ensure_ascii=False)}\n"
+            "Now answer the user's stock question. "
+            "Format: summary line, then these branches nearest first with branch_name, city, hours, quantity, distance_km. "
+            "If the list is empty, say it is not in stock near that city."
         )
+    else:
+        inv = await run_tool_async("check_inventory", {"medication_id": int(med["id"])})
+        if STOCK_RENDER_MODE == "template":
+            return _text_stream(render_stock_answer(med, inv, hebrew, limit=STOCK_MAX_BRANCHES))
+        in_stock = [r for r in inv if r["quantity"] > 0]
+        summary = {
+            "branches_in_stock": len(in_stock),
+            "branches_total": len(inv),
+            "total_units": sum(r["quantity"] for r in in_stock),
+        }
+        facts = (
+            f"Stock summary: {json.dumps(summary)}\n"
+            f"Branches with the most units: {json.dumps(inv[:STOCK_MAX_BRANCHES], ensure_ascii=False)}\n"
+            "Now answer the user's stock question. "
+            "Format: summary line, then these branches sorted by quantity with branch_name, city, hours, quantity."
+        )
+
+    answer_messages = full_messages + [
+        {
+            "role": "system",
+            "content": (
+                "Use ONLY the following internal DB facts to answer. "
+                "Do not add external medical information.\n"
+                f"Medication: {json.dumps(med, ensure_ascii=False)}\n" + facts
+            ),
+        }
+    ]
+    return _stream_completion("answer:stock", answer_messages)
+
+
+# =========================
+# FLOW 2: PRESCRIPTION LOOKUP
+# =========================
+async def _rx_flow(full_messages, extract_messages, last_user: str):
+    current_flow.set("rx")
+    user = await _resolve_with_tool(extract_messages, last_user, "get_user_by_contact")
+
+    if not user:
+        if _looks_like_hebrew(last_user):
+            return _text_stream("לא מצאתי משתמש/ת עם הפרטים האלה. אפשר לשלוח מספר טלפון או אימייל כפי שמופיע במערכת?")
+        return _text_stream("I couldn’t find a user with that contact. Please provide the phone number or email exactly as stored in the system.")
+
+    presc = await run_tool_async("list_user_prescriptions", {"user_id": int(user["id"])})
 
-        assistant_msg = planning_user.choices[0].message
-        tool_calls = getattr(assistant_msg, "tool_calls", None)
+    if RX_RENDER_MODE == "template":
+        return _text_stream(render_prescriptions_answer(user, presc, _looks_like_hebrew(last_user)))
 
-        user = None
-        if tool_calls:
-            tc = tool_calls[0]
-            tool_args = json.loads(tc.function.arguments or "{}")
-            user = run_tool("get_user_by_contact", tool_args)
-            print(f"[TOOL] get_user_by_contact args={tool_args} result={user}")
+    answer_messages = full_messages + [
+        {
+            "role": "system",
+            "content": (
+                "Use ONLY the following internal DB facts to answer. Do not add external medical information.\n"
+                f"User: {json.dumps(user, ensure_ascii=False)}\n"
+                f"Prescriptions: {json.dumps(presc, ensure_ascii=False)}\n"
+                "Now answer the user's prescription question.\n"
+                "Format:\n"
+                "- Start with the user's name.\n"
+                "- List prescriptions with medication name (match language), status, refills_left.\n"
+                "- If none exist, say so.\n"
+                "- End with a short question: whether they want to request a refill for an active prescription.\n"
+            ),
+        }
+    ]
+    return _stream_completion("answer:rx", answer_messages)
 
+
+# =========================
+# FLOW 3: REFILL REQUEST
+# =========================
+async def _refill_flow(full_messages, extract_messages, last_user: str):
+    current_flow.set("refill")
+    # User -> prescriptions and the requested medication don't depend on each other,
+    # so both branches (planning call + DB lookups) run concurrently.
+    async def resolve_user_prescriptions():
+        user = await _resolve_with_tool(extract_messages, last_user, "get_user_by_contact")
         if not user:
-            def event_generator_need_contact():
-                if _looks_like_hebrew(last_user):
-                    yield "כדי להגיש בקשת חידוש, אני צריך/ה מספר טלפון או אימייל כפי שמופיע במערכת."
-                else:
-                    yield "To submit a refill request, I need the phone number or email exactly as stored in the system."
-            return StreamingResponse(event_generator_need_contact(), media_type="text/plain")
-
-        presc = list_user_prescriptions(int(user["id"]))
-        print(f"[TOOL] list_user_prescriptions args={{'user_id': {user['id']}}} result={presc}")
-
-        # Extract requested medication name
-        planning_med = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=full_messages,
-            tools=TOOLS,
-            tool_choice={"type": "function", "function": {"name": "get_medication_by_name"}},
-            stream=False,
-        )
+            return None, []
+        presc = await run_tool_async("list_user_prescriptions", {"user_id": int(user["id"])})
+        return user, presc
 
-        med_msg = planning_med.choices[0].message
-        med_calls = getattr(med_msg, "tool_calls", None)
-
-        requested_med = None
-        if med_calls:
-            tc2 = med_calls[0]
-            med_args = json.loads(tc2.function.arguments or "{}")
-            requested_med = run_tool("get_medication_by_name", med_args)
-            print(f"[TOOL] get_medication_by_name args={med_args} result={requested_med}")
-
-        if not requested_med:
-            def event_generator_need_med():
-                if _looks_like_hebrew(last_user):
-                    yield "לא הצלחתי לזהות איזו תרופה תרצה/י לחדש. אפשר לכתוב את שם התרופה (עברית/אנגלית) + מספר טלפון/אימייל?"
-                else:
-                    yield "I couldn’t identify which medication you want to refill. Please provide the medication name (English/Hebrew) plus your phone/email."
-            return StreamingResponse(event_generator_need_med(), media_type="text/plain")
-
-        # Find matching prescription
-        match = None
-        for p in presc:
-            if int(p["medication_id"]) == int(requested_med["id"]):
-                match = p
-                break
-
-        def event_generator():
-            if not match:
-                if _looks_like_hebrew(last_user):
-                    yield f"לא מצאתי במערכת מרשם עבור {requested_med['name_he']} תחת המשתמש/ת הזה/זו. האם תרצה/י שאציג מרשמים קיימים?"
-                else:
-                    yield f"I couldn’t find a prescription for {requested_med['name_en']} under this user. Would you like me to list existing prescriptions?"
-                return
-
-            status = (match.get("status") or "").lower()
-            refills_left = int(match.get("refills_left", 0))
-
-            if _looks_like_hebrew(last_user):
-                med_name = requested_med["name_he"]
-                if status != "active":
-                    yield f"לא ניתן להגיש בקשת חידוש: המרשם עבור {med_name} אינו פעיל (סטטוס: {match.get('status')}). האם תרצה/י לבדוק מרשמים אחרים?"
-                    return
-                if refills_left <= 0:
-                    yield f"לא ניתן להגיש בקשת חידוש: אין יתרת חידושים למרשם עבור {med_name}. האם תרצה/י לראות את סטטוס המרשמים במערכת?"
-                    return
-                yield (
-                    f"בקשת חידוש נשלחה עבור {med_name} (משתמש/ת: {user['full_name']}). "
-                    f"יתרת חידושים לאחר הבקשה: {refills_left - 1}.\n"
-                    "האם תרצה/י שאציג גם שעות פתיחה של הסניפים לאיסוף?"
-                )
-            else:
-                med_name = requested_med["name_en"]
-                if status != "active":
-                    yield f"Unable to submit a refill request: the prescription for {med_name} is not active (status: {match.get('status')}). Would you like me to list existing prescriptions?"
-                    return
-                if refills_left <= 0:
-                    yield f"Unable to submit a refill request: no refills left for {med_name}. Would you like me to check your prescription statuses?"
-                    return
-                yield (
-                    f"Refill request submitted for {med_name} (user: {user['full_name']}). "
-                    f"Refills remaining after this request: {refills_left - 1}.\n"
-                    "Would you like pickup hours for the branches?"
+    user_result, med_result = await asyncio.gather(
+        resolve_user_prescriptions(),
+        _resolve_with_tool(extract_messages, last_user, "get_medication_by_name"),
+        return_exceptions=True,
+    )
+
+    # A failed branch is treated like "not found" so the user still gets a clarification.
+    if isinstance(user_result, Exception):
+        log.warning("refill user lookup failed: %r", user_result)
+        user_result = (None, [])
+    if isinstance(med_result, Exception):
+        log.warning("refill medication lookup failed: %r", med_result)
+        med_result = None
+
+    user, presc = user_result
+    requested_med = med_result
+
+    if not user:
+        if _looks_like_hebrew(last_user):
+            return _text_stream("כדי להגיש בקשת חידוש, אני צריך/ה מספר טלפון או אימייל כפי שמופיע במערכת.")
+        return _text_stream("To submit a refill request, I need the phone number or email exactly as stored in the system.")
+
+    if not requested_med:
+        if _looks_like_hebrew(last_user):
+            return _text_stream("לא הצלחתי לזהות איזו תרופה תרצה/י לחדש. אפשר לכתוב את שם התרופה (עברית/אנגלית) + מספר טלפון/אימייל?")
+        return _text_stream("I couldn’t identify which medication you want to refill. Please provide the medication name (English/Hebrew) plus your phone/email.")
+
+    # Find matching prescription
+    match = None
+    for p in presc:
+        if int(p["medication_id"]) == int(requested_med["id"]):
+            match = p
+            break
+
+    hebrew = _looks_like_hebrew(last_user)
+    if not match:
+        outcome = "not_found"
+    elif (match.get("status") or "").lower() != "active":
+        outcome = "inactive"
+    elif int(match.get("refills_left", 0)) <= 0:
+        outcome = "no_refills"
+    else:
+        # The cached prescription list may be stale; the writer's conditional decrement decides.
+        try:
+            with span("refill:submit"):
+                result = await submit_refill_async(
+                    int(user["id"]), int(match["prescription_id"]), idempotency_key.get()
                 )
+            outcome = result.get("reason") or "submitted"
+            refills_after = result.get("refills_left")
+        except Exception as e:
+            log.warning("refill submission failed: %r", e)
+            outcome = "failed"
 
-        return StreamingResponse(event_generator(), media_type="text/plain")
-
-    # =========================
-    # DEFAULT PATH: tool-based Q&A
-    # =========================
-    planning = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=full_messages,
-        tools=TOOLS,
-        tool_choice="auto",
-        stream=False,
-    )
+    med_name = requested_med["name_he"] if hebrew else requested_med["name_en"]
+    status = match.get("status") if match else None
+
+    if outcome == "submitted":
+        if hebrew:
+            return _text_stream(
+                f"בקשת חידוש נשלחה עבור {med_name} (משתמש/ת: {user['full_name']}). "
+                f"יתרת חידושים לאחר הבקשה: {refills_after}.\n"
+                "האם תרצה/י שאציג גם שעות פתיחה של הסניפים לאיסוף?"
+            )
+        return _text_stream(
+            f"Refill request submitted for {med_name} (user: {user['full_name']}). "
+            f"Refills remaining after this request: {refills_after}.\n"
+            "Would you like pickup hours for the branches?"
+        )
+    if outcome == "not_found":
+        if hebrew:
+            return _text_stream(f"לא מצאתי במערכת מרשם עבור {med_name} תחת המשתמש/ת הזה/זו. האם תרצה/י שאציג מרשמים קיימים?")
+        return _text_stream(f"I couldn’t find a prescription for {med_name} under this user. Would you like me to list existing prescriptions?")
+    if outcome == "inactive":
+        if hebrew:
+            return _text_stream(f"לא ניתן להגיש בקשת חידוש: המרשם עבור {med_name} אינו פעיל (סטטוס: {status}). האם תרצה/י לבדוק מרשמים אחרים?")
+        return _text_stream(f"Unable to submit a refill request: the prescription for {med_name} is not active (status: {status}). Would you like me to list existing prescriptions?")
+    if outcome == "no_refills":
+        if hebrew:
+            return _text_stream(f"לא ניתן להגיש בקשת חידוש: אין יתרת חידושים למרשם עבור {med_name}. האם תרצה/י לראות את סטטוס המרשמים במערכת?")
+        return _text_stream(f"Unable to submit a refill request: no refills left for {med_name}. Would you like me to check your prescription statuses?")
+    if outcome == "key_reused":
+        # The request's idempotency key already submitted a different refill; resending it can't succeed.
+        if hebrew:
+            return _text_stream(f"הבקשה הזו כבר שימשה להגשת חידוש אחר, ולכן לא הגשתי חידוש עבור {med_name}. אפשר לשלוח את בקשת החידוש שוב כהודעה חדשה?")
+        return _text_stream(f"This request was already used to submit a different refill, so I didn't submit one for {med_name}. Could you send the refill request again as a new message?")
+    if hebrew:
+        return _text_stream(f"לא הצלחתי להגיש כרגע את בקשת החידוש עבור {med_name}. אפשר לנסות שוב בעוד רגע?")
+    return _text_stream(f"I couldn't submit the refill request for {med_name} right now. Could you try again in a moment?")
+
+
+# =========================
+# DEFAULT PATH: tool-based Q&A
+# =========================
+async def _default_flow(full_messages):
+    current_flow.set("default")
+    emit("status", stage="plan:auto")
+    route = model_router.route("plan:default", current_flow.get())
+    with span("plan:auto"):
+        planning = await plan_flights.do(
+            ("auto", route.model, _messages_key(full_messages)), _auto_planning, full_messages, route
+        )
 
     assistant_msg = planning.choices[0].message
     tool_calls = getattr(assistant_msg, "tool_calls", None)
@@ -420,16 +889,20 @@ def chat_stream(payload: dict):
             }
             for tc in tool_calls
         ]
-    full_messages.append(assistant_dict)
+    answer_messages = full_messages + [assistant_dict]
 
     if tool_calls:
-        for tc in tool_calls:
-            tool_name = tc.function.name
-            tool_args = json.loads(tc.function.arguments or "{}")
-            result = run_tool(tool_name, tool_args)
-            print(f"[TOOL] {tool_name} args={tool_args} result={result}")
-
-            full_messages.append(
+        # Independent tool calls from one assistant message run concurrently;
+        # gather keeps results in tool_call order.
+        results = await asyncio.gather(
+            *(run_tool_async(tc.function.name, json.loads(tc.function.arguments or "{}")) for tc in tool_calls),
+            return_exceptions=True,
+        )
+        for tc, result in zip(tool_calls, results):
+            if isinstance(result, Exception):
+                log.warning("tool %s failed: %r", tc.function.name, result)
+                result = {"error": f"Tool {tc.function.name} failed"}
+            answer_messages.append(
                 {
                     "role": "tool",
                     "tool_call_id": tc.id,
@@ -437,18 +910,216 @@ def chat_stream(payload: dict):
                 }
             )
 
-    def event_generator():
-        stream = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=full_messages,
-            tools=TOOLS,
-            tool_choice="none",
-            stream=True,
-        )
-        for chunk in stream:
-            delta = chunk.choices[0].delta
-            text = getattr(delta, "content", None)
-            if text:
-                yield text
+    return _stream_completion("answer:default", answer_messages)
+
+
+FLOWS = {
+    "stock": _stock_flow,
+    "rx": _rx_flow,
+    "refill": _refill_flow,
+}
+
+
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness: the process serves requests (503 only if a required warm-up step failed).
+    """
+    if startup.failed:
+        return JSONResponse({"status": "failed", "errors": startup.errors}, status_code=503)
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness: 200 once the startup warm-up has finished, 503 until then.
+    """
+    return JSONResponse(startup.stats(), status_code=200 if startup.ready else 503)
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "startup": startup.stats(),
+        "db_pool": pool_stats(),
+        "catalog_snapshot": catalog_store.stats(),
+        "tool_cache": cache_stats(),
+        "tokens": token_ledger.stats(),
+        "inventory_feed": inventory_feed.stats(),
+        "refill_writer": refill_writer.stats(),
+        "singleflight": singleflight_stats(),
+        "admission": {**admission.stats(), "flows": admission.flow_stats()},
+        "upstream": upstream_stats(),
+        "models": model_router.stats(),
+    }
+
+
+def _stats_metrics():
+    yield from stats_lines("pharmacy_startup", startup.stats())
+    yield from stats_lines(
+        "pharmacy_startup_step", {name: {"ms": ms} for name, ms in startup.steps.items()}, label="step"
+    )
+    yield from stats_lines("pharmacy_db_pool", pool_stats())
+    yield from stats_lines("pharmacy_catalog_snapshot", catalog_store.stats())
+    yield from stats_lines("pharmacy_tool_cache", cache_stats(), label="tool")
+    yield from stats_lines("pharmacy_tokens", token_ledger.stats(), label="stage")
+    yield from stats_lines("pharmacy_inventory_feed", inventory_feed.stats())
+    yield from stats_lines("pharmacy_refill_writer", refill_writer.stats())
+    yield from stats_lines("pharmacy_singleflight", singleflight_stats(), label="group")
+    yield from stats_lines("pharmacy_admission", admission.stats())
+    yield from stats_lines("pharmacy_admission_flow", admission.flow_stats(), label="flow")
+    yield from stats_lines("pharmacy_upstream", upstream_stats(), label="stage")
+
+
+register_collector(_stats_metrics)
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/inventory/deltas")
+async def inventory_deltas(request: Request, payload: dict):
+    """
+    Apply stock deltas ({"deltas": [{"branch_id", "medication_id", "delta"}, ...]})
+    and push the new quantities to /inventory/{medication_id}/stream watchers.
+    Requires `Authorization: Bearer <INVENTORY_API_TOKEN>`.
+    """
+    if not INVENTORY_API_TOKEN:
+        return JSONResponse({"error": "Inventory updates are disabled (INVENTORY_API_TOKEN is not set)."}, status_code=403)
+    supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), INVENTORY_API_TOKEN.encode()):
+        return JSONResponse({"error": "Invalid or missing inventory API token."}, status_code=401)
+    try:
+        deltas = [(int(d["branch_id"]), int(d["medication_id"]), int(d["delta"])) for d in payload["deltas"]]
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse({"error": "Expected {\"deltas\": [{\"branch_id\", \"medication_id\", \"delta\"}]}"}, status_code=400)
+    try:
+        changes = await asyncio.to_thread(update_inventory, deltas)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {
+        "changes": [
+            {"medication_id": medication_id, "branch_id": branch_id, "quantity": quantity}
+            for medication_id, branch_id, quantity in changes
+        ]
+    }
+
+
+@app.get("/inventory/{medication_id}/stream")
+async def inventory_stream(medication_id: int):
+    """
+    Server-sent events for one medication: a `snapshot` of every branch, then
+    coalesced `update` events ({branch_id, quantity} changes) as stock moves.
+    """
+    if inventory_feed.full():
+        return JSONResponse({"error": "Too many stock watchers, try again later."}, status_code=503)
+
+    async def events():
+        sub = inventory_feed.subscribe(medication_id)
+        updates = inventory_feed.updates(sub)
+        try:
+            # Subscribed before the snapshot is read, so no change falls in between.
+            snapshot = await asyncio.to_thread(check_inventory, medication_id)
+            yield sse("snapshot", {"medication_id": medication_id, "branches": snapshot})
+            async for changes in updates:
+                if changes is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse(
+                    "update",
+                    {
+                        "medication_id": medication_id,
+                        "changes": [{"branch_id": b, "quantity": q} for b, q in changes.items()],
+                    },
+                )
+        finally:
+            await updates.aclose()
+            inventory_feed.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def _holding(body, permit):
+    """
+    Keep the admission permit until the response body has been sent (or abandoned).
+    """
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        permit.release()
+
+
+def _respond(answer, flow: str, started: float, events: RequestEvents, fmt: str, permit):
+    body = _holding(encode(instrument_stream(answer, flow, started), events, fmt), permit)
+    headers = {"Cache-Control": "no-cache"} if fmt != "text" else None
+    # The background task covers a client that disconnects before the body is started.
+    return StreamingResponse(
+        body, media_type=MEDIA_TYPES[fmt], headers=headers, background=BackgroundTask(permit.release)
+    )
+
+
+def _busy(hebrew: bool, fmt: str):
+    """
+    Fast 503 for a request that was not admitted, in the client's wire format.
+    """
+    if hebrew:
+        text = "יש כרגע עומס פניות. אפשר לנסות שוב בעוד כמה שניות?"
+    else:
+        text = "We're handling a lot of requests right now. Please try again in a few seconds."
+    content = text if fmt == "text" else frame("error", fmt, code="busy", message=text)
+    return Response(content, status_code=503, media_type=MEDIA_TYPES[fmt], headers={"Retry-After": "2"})
+
+
+@app.post("/chat/stream")
+async def chat_stream(payload: dict, request: Request):
+    started = time.perf_counter()
+    fmt = negotiate(request.headers.get("accept"))
+    events = RequestEvents()
+    current_events.set(events)
+    start_request_budget()
+    messages = payload.get("messages", [])
+    if not isinstance(messages, list):
+        messages = []
+    idempotency_key.set(payload.get("idempotency_key"))
+
+    # Answer calls get the budgeted history; extraction calls only need recent user messages.
+    full_messages = build_messages(SYSTEM_PROMPT, messages)
+    extract_messages = build_extraction_messages(SYSTEM_PROMPT, messages)
+
+    # ---- Get last user text for intent routing ----
+    last_user = ""
+    for m in reversed(messages):
+        if isinstance(m, dict) and m.get("role") == "user":
+            last_user = (m.get("content") or "").strip()
+            break
+
+    with span("route", flow="router"):
+        intents = route_intents(last_user)
+    label = "+".join(intent for intent, _ in intents) or "default"
+    current_flow.set(label)
+    REQUESTS.inc(flow=label)
 
-    return StreamingResponse(event_generator(), media_type="text/plain")
+    # Compound requests are admitted under their primary flow.
+    flow_class = intents[0][0] if intents else "default"
+    try:
+        permit = await admission.acquire(flow_class)
+    except AdmissionRejected as e:
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, flow=flow_class, outcome=e.reason)
+        log.info("chat request rejected: %s", e)
+        return _busy(_looks_like_hebrew(last_user), fmt)
+    ADMISSION_WAIT_SECONDS.observe(permit.waited, flow=flow_class, outcome="admitted")
+    try:
+        emit("status", stage="routed", flow=label)
+        if not intents:
+            answer = _deferred(_default_flow, full_messages)
+        else:
+            emit("ack", text=_acknowledgement(intents, last_user))
+            answer = _deferred(_run_flows, intents, full_messages, extract_messages, last_user)
+    except BaseException:
+        permit.release()
+        raise
+    return _respond(answer, label, started, events, fmt, permit)
@@ -0,0 +1,133 @@
+"""
+Per-stage model routing: which model, token cap and reasoning effort each model call uses.
+
+Model calls are named by stage: "extract:<tool>" (forced tool-choice argument
+extraction), "plan:default" (tool planning on the default path) and
+"answer:<flow>" (the streamed final answer). A route spec maps keys to values,
+e.g. OPENAI_MODEL_ROUTES="extract=gpt-5-nano,plan=gpt-5-mini,answer:stock=gpt-5-mini".
+For a call the most specific key wins:
+
+    full stage ("extract:get_user_by_contact")  >  kind:flow ("extract:refill")  >  kind ("extract")
+
+Calls without a matching model route use OPENAI_MODEL; calls without a cap or
+effort send none (the provider default).
+"""
+import threading
+
+from app.telemetry import Counter, Histogram, register
+
+MODEL_CALL_SECONDS = register(Histogram(
+    "pharmacy_model_call_seconds",
+    "Model call latency by stage and model, to the first chunk for streamed answers (retries included).",
+    ("stage", "model"),
+))
+MODEL_TOKENS = register(Counter(
+    "pharmacy_model_tokens_total",
+    "Provider-reported tokens by stage, model and kind (prompt, cached, completion, reasoning).",
+    ("stage", "model", "kind"),
+))
+
+
+def parse_routes(spec: str, cast=str) -> dict:
+    """
+    "extract=gpt-5-nano, answer:stock=gpt-5-mini" -> {"extract": "gpt-5-nano", "answer:stock": "gpt-5-mini"}
+    """
+    routes = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            if value.strip():
+                routes[key.strip()] = cast(value.strip())
+    return routes
+
+
+class StageRoute:
+    __slots__ = ("model", "max_tokens", "reasoning_effort", "extra")
+
+    def __init__(self, model: str, max_tokens: int = None, reasoning_effort: str = None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.reasoning_effort = reasoning_effort
+        # Sent through extra_body, next to the static tools payload.
+        self.extra = {}
+        if max_tokens:
+            # Reasoning models count their reasoning tokens against this cap too.
+            self.extra["max_completion_tokens"] = max_tokens
+        if reasoning_effort:
+            self.extra["reasoning_effort"] = reasoning_effort
+
+    def body(self, base: dict) -> dict:
+        return {**base, **self.extra} if self.extra else base
+
+    def stats(self) -> dict:
+        return {"model": self.model, "max_tokens": self.max_tokens or 0, "reasoning_effort": self.reasoning_effort or ""}
+
+
+class ModelRouter:
+    """
+    Resolves stage (and flow) to a StageRoute; resolutions are cached.
+    """
+
+    def __init__(self, default_model: str, models: str = "", max_tokens: str = "", reasoning_effort: str = ""):
+        self.default_model = default_model
+        self.models = parse_routes(models)
+        self.max_tokens = parse_routes(max_tokens, int)
+        self.reasoning_effort = parse_routes(reasoning_effort)
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _lookup(table: dict, keys):
+        for key in keys:
+            if key in table:
+                return table[key]
+        return None
+
+    def route(self, stage: str, flow: str = None) -> StageRoute:
+        route = self._routes.get((stage, flow))
+        if route is not None:
+            return route
+        kind = stage.split(":", 1)[0]
+        keys = [stage, f"{kind}:{flow}", kind] if flow else [stage, kind]
+        route = StageRoute(
+            self._lookup(self.models, keys) or self.default_model,
+            self._lookup(self.max_tokens, keys),
+            self._lookup(self.reasoning_effort, keys),
+        )
+        with self._lock:
+            return self._routes.setdefault((stage, flow), route)
+
+    def models_in_use(self) -> set:
+        return {self.default_model, *self.models.values()}
+
+    def stats(self) -> dict:
+        """
+        The routes resolved so far, keyed "stage" or "stage@flow".
+        """
+        with self._lock:
+            items = list(self._routes.items())
+        return {
+            (stage if not flow or stage.endswith(f":{flow}") else f"{stage}@{flow}"): route.stats()
+            for (stage, flow), route in sorted(items, key=lambda kv: (kv[0][0], kv[0][1] or ""))
+        }
+
+
+def observe_latency(stage: str, route: StageRoute, seconds: float):
+    MODEL_CALL_SECONDS.observe(seconds, stage=stage, model=route.model)
+
+
+def observe_tokens(stage: str, route: StageRoute, usage):
+    """
+    Count the provider-reported tokens of one call (no-op without usage).
+    """
+    if usage is None:
+        return
+    tokens = {
+        "prompt": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion": getattr(usage, "completion_tokens", 0) or 0,
+        "cached": getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0,
+        "reasoning": getattr(getattr(usage, "completion_tokens_details", None), "reasoning_tokens", 0) or 0,
+    }
+    for kind, count in tokens.items():
+        if count:
+            MODEL_TOKENS.inc(count, stage=stage, model=route.model, kind=kind)
@@ -0,0 +1,100 @@
+"""
+Bilingual templates for answers that only restate DB facts in a fixed layout.
+Used instead of the final LLM call when a flow's render mode is "template".
+"""
+
+STATUS_HE = {
+    "active": "פעיל",
+    "expired": "פג תוקף",
+}
+
+
+def render_stock_answer(med: dict, inv: list, hebrew: bool, limit: int = None) -> str:
+    """
+    Summary line, then branches sorted by quantity (branch_name, city, hours, quantity);
+    with `limit`, only the first `limit` branches are listed.
+    """
+    rows = sorted(inv, key=lambda r: r["quantity"], reverse=True)
+    in_stock = [r for r in rows if r["quantity"] > 0]
+    total_units = sum(r["quantity"] for r in in_stock)
+    listed = rows[:limit] if limit else rows
+    more = len(rows) - len(listed)
+
+    if hebrew:
+        name = med["name_he"]
+        if not in_stock:
+            return f"{name} אזל/ה כרגע מהמלאי בכל הסניפים. האם תרצה/י שאבדוק סניפים נוספים?"
+        lines = [f"{name} זמין/ה ב-{len(in_stock)} מתוך {len(rows)} סניפים (סה״כ {total_units} יחידות):"]
+        lines += [
+            f"- {r['branch_name']}, {r['city']} – {r['quantity']} יחידות (שעות פתיחה: {r['hours']})"
+            for r in listed
+        ]
+        if more:
+            lines.append(f"ועוד {more} סניפים. אפשר לציין עיר כדי שאמצא את הסניפים הקרובים.")
+        return "\n".join(lines)
+
+    name = med["name_en"]
+    if not in_stock:
+        return f"{name} is currently out of stock at all branches. Would you like me to check other branches?"
+    lines = [f"{name} is available at {len(in_stock)} of {len(rows)} branches ({total_units} units in total):"]
+    lines += [
+        f"- {r['branch_name']}, {r['city']} – {r['quantity']} units (hours: {r['hours']})"
+        for r in listed
+    ]
+    if more:
+        lines.append(f"...and {more} more branches. Tell me your city and I'll find the nearest ones.")
+    return "\n".join(lines)
+
+
+def render_nearest_stock_answer(med: dict, nearest, city: str, hebrew: bool) -> str:
+    """
+    Summary line, then the nearest branches with stock (branch_name, city, hours, quantity, distance).
+    """
+    if hebrew:
+        name = med["name_he"]
+        if not nearest or isinstance(nearest, dict):
+            return f"{name} לא נמצא/ה במלאי בסניפים באזור {city}. האם תרצה/י שאבדוק בכל הסניפים?"
+        lines = [f"{name} זמין/ה בסניפים הקרובים ל{city}:"]
+        lines += [
+            f"- {r['branch_name']}, {r['city']} ({r['distance_km']} ק״מ) – {r['quantity']} יחידות (שעות פתיחה: {r['hours']})"
+            for r in nearest
+        ]
+        return "\n".join(lines)
+
+    name = med["name_en"]
+    if not nearest or isinstance(nearest, dict):
+        return f"{name} is not in stock at branches near {city}. Would you like me to check all branches?"
+    lines = [f"{name} is available at these branches near {city}:"]
+    lines += [
+        f"- {r['branch_name']}, {r['city']} ({r['distance_km']} km) – {r['quantity']} units (hours: {r['hours']})"
+        for r in nearest
+    ]
+    return "\n".join(lines)
+
+
+def render_prescriptions_answer(user: dict, presc: list, hebrew: bool) -> str:
+    """
+    User's name, one row per prescription (name, status, refills_left), then a refill question
+    when there is an active prescription to refill.
+    """
+    has_active = any((p.get("status") or "").lower() == "active" for p in presc)
+
+    if hebrew:
+        if not presc:
+            return f"{user['full_name']}: לא נמצאו מרשמים במערכת."
+        lines = [f"{user['full_name']}, אלה המרשמים שלך:"]
+        for p in presc:
+            status = STATUS_HE.get((p.get("status") or "").lower(), p.get("status"))
+            lines.append(f"- {p['med_name_he']} – סטטוס: {status}, חידושים שנותרו: {p['refills_left']}")
+        if has_active:
+            lines.append("האם תרצה/י להגיש בקשת חידוש למרשם פעיל?")
+        return "\n".join(lines)
+
+    if not presc:
+        return f"{user['full_name']}: no prescriptions found."
+    lines = [f"{user['full_name']}, here are your prescriptions:"]
+    for p in presc:
+        lines.append(f"- {p['med_name_en']} – status: {p['status']}, refills left: {p['refills_left']}")
+    if has_active:
+        lines.append("Would you like to request a refill for an active prescription?")
+    return "\n".join(lines)
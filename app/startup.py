@@ -0,0 +1,67 @@
+"""
+Startup warm-up and readiness for GET /healthz and GET /readyz.
+
+Migrations run before the server accepts connections. Everything else that would
+otherwise be paid by the first requests runs as a background warm-up right after:
+- importing the openai package and building the client
+- the FTS index check
+- opening every pooled DB connection
+- building the local matchers and the catalog snapshot
+- opening a few keep-alive connections to the model endpoint
+
+/readyz answers 503 until the warm-up has finished, so an autoscaled replica only
+gets traffic once it is warm. Requests that arrive earlier still work; they take
+the lazy paths. Step durations and import-to-ready time go to /stats and /metrics.
+"""
+import asyncio
+import time
+
+from app.telemetry import log
+
+
+class Startup:
+    __slots__ = ("started", "ready_at", "failed", "steps", "errors")
+
+    def __init__(self, started: float):
+        self.started = started
+        self.ready_at = None
+        self.failed = False
+        self.steps = {}
+        self.errors = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    async def run(self, name: str, fn, *args, required: bool = True):
+        """
+        Run one warm-up step and record how long it took. Blocking functions run on
+        a worker thread. A failed required step marks the replica as never ready
+        and re-raises; a failed optional step is only logged.
+        """
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                return await fn(*args)
+            return await asyncio.to_thread(fn, *args)
+        except Exception as e:
+            self.errors[name] = f"{type(e).__name__}: {e}"
+            log.warning("warm-up step %s failed: %r", name, e)
+            if required:
+                self.failed = True
+                raise
+        finally:
+            self.steps[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def finish(self):
+        if not self.failed:
+            self.ready_at = time.perf_counter()
+
+    def stats(self) -> dict:
+        return {
+            "ready": int(self.ready),
+            "failed": int(self.failed),
+            "import_to_ready_s": round(self.ready_at - self.started, 3) if self.ready else None,
+            "steps_ms": dict(self.steps),
+            "errors": dict(self.errors),
+        }
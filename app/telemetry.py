@@ -0,0 +1,244 @@
+"""
+Latency spans, Prometheus metrics and asynchronous, sampled logging.
+
+- `span(stage)` times a block into `pharmacy_stage_duration_seconds{stage, flow}`;
+  the flow label comes from the `current_flow` context variable.
+- `instrument_stream()` wraps an answer stream to record time to first token and
+  total stream duration.
+- `render_metrics()` produces the Prometheus text exposition served on GET /metrics.
+- Log records go through a QueueHandler (formatting/IO happen on a listener thread)
+  and records below WARNING are sampled at LOG_SAMPLE_RATE.
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.05"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+current_flow = contextvars.ContextVar("current_flow", default="none")
+
+
+def _label_value(value) -> str:
+    # Exposition-format escaping: backslash, double quote and newline.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_label_value(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_str(self.labels, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_label_str(self.labels + ('le',), key + ('+Inf',))} {count}"
+            yield f"{self.name}_sum{_label_str(self.labels, key)} {total}"
+            yield f"{self.name}_count{_label_str(self.labels, key)} {count}"
+
+
+REQUESTS = Counter("pharmacy_requests_total", "Chat requests by routed flow.", ("flow",))
+ERRORS = Counter("pharmacy_errors_total", "Errors by flow and stage.", ("flow", "stage"))
+STAGE_SECONDS = Histogram(
+    "pharmacy_stage_duration_seconds",
+    "Duration of request stages (routing, planning calls, tool calls).",
+    ("stage", "flow"),
+)
+TTFT_SECONDS = Histogram("pharmacy_time_to_first_token_seconds", "Request start to first streamed chunk.", ("flow",))
+STREAM_SECONDS = Histogram("pharmacy_stream_duration_seconds", "Request start to end of the answer stream.", ("flow",))
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "pharmacy_admission_wait_seconds",
+    "Time chat requests waited for admission, by outcome (admitted or the rejection reason).",
+    ("flow", "outcome"),
+)
+
+_metrics = [REQUESTS, ERRORS, STAGE_SECONDS, TTFT_SECONDS, STREAM_SECONDS, ADMISSION_WAIT_SECONDS]
+_collectors = []
+
+
+def register(metric):
+    """
+    Add a Counter/Histogram (anything with render()) to the /metrics output.
+    """
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(collect):
+    """
+    Add a callable yielding exposition lines computed at scrape time (e.g. from stats dicts).
+    """
+    _collectors.append(collect)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def stats_lines(prefix: str, stats: dict, label: str = None):
+    """
+    Expose a stats dict (as served on /stats) as untyped samples named `{prefix}_{key}`.
+    With `label`, `stats` maps label values to per-item dicts (e.g. per-tool caches).
+    """
+    series = {}
+    items = stats.items() if label else [(None, stats)]
+    for item, values in items:
+        labels = _label_str((label,), (item,)) if label else ""
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                series.setdefault(key, []).append((labels, float(value)))
+    for key, samples in series.items():
+        name = f"{prefix}_{key}"
+        yield f"# HELP {name} {key} from GET /stats."
+        yield f"# TYPE {name} untyped"
+        for labels, value in samples:
+            yield f"{name}{labels} {value}"
+
+
+@contextmanager
+def span(stage: str, flow: str = None):
+    flow = flow or current_flow.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(flow=flow, stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, flow=flow)
+
+
+async def instrument_stream(stream, flow: str, started: float):
+    """
+    Pass an answer stream through, recording time to first chunk and total duration
+    (both measured from `started`, the request's perf_counter start).
+    """
+    first = True
+    try:
+        async for chunk in stream:
+            if first:
+                TTFT_SECONDS.observe(time.perf_counter() - started, flow=flow)
+                first = False
+            yield chunk
+    except Exception:
+        ERRORS.inc(flow=flow, stage="stream")
+        log.exception("answer stream failed (flow=%s)", flow)
+        raise
+    finally:
+        STREAM_SECONDS.observe(time.perf_counter() - started, flow=flow)
+
+
+class _SampleFilter(logging.Filter):
+    """
+    Keep every WARNING+ record; keep lower-level records with probability `rate`.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def _setup_logging():
+    logger = logging.getLogger("pharmacy")
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(_SampleFilter(LOG_SAMPLE_RATE))
+    logger.addHandler(handler)
+
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+
+log = _setup_logging()
+
+
+def summarize_result(result) -> str:
+    """
+    Short description of a tool result for logs (never the full payload).
+    """
+    if result is None:
+        return "None"
+    if isinstance(result, list):
+        return f"{len(result)} rows"
+    if isinstance(result, dict):
+        return f"id={result.get('id', '?')}"
+    return type(result).__name__
@@ -0,0 +1,230 @@
+"""
+Correctness check and overload simulation for the admission controller (services/admission.py).
+
+    python -m bench.admission --requests 2000
+
+Checks (in-process, no server):
+- global and per-flow limits are never exceeded under random load, and no permit leaks
+- queued requests are granted by priority, then by arrival
+- a full queue sheds its lowest-priority waiter for a cheaper arrival and turns away the rest
+- deadlines expire; a cancelled waiter leaves the queue, and a slot it was granted is returned
+
+Then simulates an upstream whose latency grows once more than `--capacity` calls are
+in flight (like a rate-limited API). It compares per-flow latency and rejections with
+no admission control and with the default limits scaled to that capacity.
+"""
+import argparse
+import asyncio
+import random
+import sys
+
+from services.admission import AdmissionController, AdmissionRejected
+
+FLOW_MIX = {"refill": 20, "rx": 20, "stock": 40, "default": 20}
+# Relative upstream work per flow: the default path plans and then streams an open-ended answer.
+FLOW_COST = {"refill": 1.0, "rx": 1.0, "stock": 1.5, "default": 3.0}
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+async def _check_limits(errors, requests, rng):
+    controller = AdmissionController(limit=8, flow_limits={"default": 3}, queue_max=10**6, timeout=60)
+    active = {"all": 0}
+    peak = {"all": 0}
+
+    async def one(flow):
+        permit = await controller.acquire(flow)
+        try:
+            for key in ("all", flow):
+                active[key] = active.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), active[key])
+            await asyncio.sleep(rng.uniform(0.001, 0.01))
+        finally:
+            active["all"] -= 1
+            active[flow] -= 1
+            permit.release()
+            permit.release()  # idempotent
+
+    flows = rng.choices(list(FLOW_MIX), list(FLOW_MIX.values()), k=requests)
+    await asyncio.gather(*(one(flow) for flow in flows))
+    if peak["all"] > 8:
+        errors.append(f"global limit exceeded: {peak['all']} > 8")
+    if peak.get("default", 0) > 3:
+        errors.append(f"default flow limit exceeded: {peak['default']} > 3")
+    stats = controller.stats()
+    if stats["in_flight"] or stats["queued"]:
+        errors.append(f"leaked permits or waiters: {stats}")
+    print(f"limits: {requests} requests, peak in flight {peak['all']}/8 (default {peak.get('default', 0)}/3), {stats}")
+
+
+async def _check_priority(errors):
+    controller = AdmissionController(limit=1, flow_limits={}, queue_max=10, timeout=5)
+    holder = await controller.acquire("stock")
+    order = []
+
+    async def one(flow):
+        permit = await controller.acquire(flow)
+        order.append(flow)
+        await asyncio.sleep(0)
+        permit.release()
+
+    tasks = [asyncio.create_task(one(flow)) for flow in ("default", "stock", "default", "rx", "refill")]
+    await asyncio.sleep(0.01)
+    holder.release()
+    await asyncio.gather(*tasks)
+    if order != ["refill", "rx", "stock", "default", "default"]:
+        errors.append(f"grant order {order}")
+    print(f"priority: granted {order}")
+
+
+async def _check_shedding(errors):
+    controller = AdmissionController(limit=1, flow_limits={}, queue_max=2, timeout=5)
+    holder = await controller.acquire("stock")
+    first = asyncio.create_task(controller.acquire("default"))
+    second = asyncio.create_task(controller.acquire("default"))
+    await asyncio.sleep(0.01)
+    cheap = asyncio.create_task(controller.acquire("refill"))
+    await asyncio.sleep(0.01)
+    try:
+        await controller.acquire("default")
+        errors.append("a full queue admitted another default request")
+    except AdmissionRejected as e:
+        if e.reason != "queue_full":
+            errors.append(f"expected queue_full, got {e.reason}")
+    try:
+        await second
+        errors.append("the newest default waiter was not shed")
+    except AdmissionRejected as e:
+        if e.reason != "shed":
+            errors.append(f"expected shed, got {e.reason}")
+    holder.release()
+    (await cheap).release()
+    (await first).release()
+    stats = controller.stats()
+    if stats["in_flight"] or stats["queued"]:
+        errors.append(f"leak after shedding: {stats}")
+    print(f"shedding: {stats}")
+
+
+async def _check_deadlines(errors):
+    controller = AdmissionController(limit=1, flow_limits={}, queue_max=10, timeout=0.05)
+    holder = await controller.acquire("stock")
+    try:
+        await controller.acquire("rx")
+        errors.append("waiter was admitted past its deadline")
+    except AdmissionRejected as e:
+        if e.reason != "timeout":
+            errors.append(f"expected timeout, got {e.reason}")
+
+    controller.timeout = 5
+    waiting = asyncio.create_task(controller.acquire("rx"))
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    if controller.stats()["queued"]:
+        errors.append("a cancelled waiter stayed in the queue")
+
+    # Granted, then cancelled before it resumed: the slot comes back either through the
+    # cancellation path or as a permit the caller holds (wait_for may still return it).
+    waiting = asyncio.create_task(controller.acquire("rx"))
+    await asyncio.sleep(0.01)
+    holder.release()
+    waiting.cancel()
+    (result,) = await asyncio.gather(waiting, return_exceptions=True)
+    if not isinstance(result, BaseException):
+        result.release()
+    stats = controller.stats()
+    if stats["in_flight"] or stats["queued"]:
+        errors.append(f"leak after cancellation: {stats}")
+    print(f"deadlines/cancellation: {stats}")
+
+
+async def _simulate(controller, requests, capacity, base, arrival_rate, rng):
+    in_flight = 0
+    results = {flow: [] for flow in FLOW_MIX}
+    rejected = {flow: 0 for flow in FLOW_MIX}
+
+    async def one(flow):
+        nonlocal in_flight
+        started = asyncio.get_running_loop().time()
+        permit = None
+        if controller is not None:
+            try:
+                permit = await controller.acquire(flow)
+            except AdmissionRejected:
+                rejected[flow] += 1
+                return
+        in_flight += 1
+        try:
+            # Past `capacity` concurrent calls the upstream slows down proportionally.
+            await asyncio.sleep(base * FLOW_COST[flow] * max(1.0, in_flight / capacity))
+        finally:
+            in_flight -= 1
+            if permit is not None:
+                permit.release()
+        results[flow].append(asyncio.get_running_loop().time() - started)
+
+    tasks = []
+    for flow in rng.choices(list(FLOW_MIX), list(FLOW_MIX.values()), k=requests):
+        tasks.append(asyncio.create_task(one(flow)))
+        await asyncio.sleep(rng.expovariate(arrival_rate))
+    await asyncio.gather(*tasks)
+    return results, rejected
+
+
+def _report(label, results, rejected):
+    print(f"\n{label}")
+    print(f"{'flow':<9}{'served':>8}{'busy':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for flow in FLOW_MIX:
+        values = [v * 1000 for v in results[flow]]
+        print(
+            f"{flow:<9}{len(values):>8}{rejected[flow]:>6}{_percentile(values, 50):>9.0f}"
+            f"{_percentile(values, 95):>9.0f}{_percentile(values, 99):>9.0f}"
+        )
+
+
+async def _main(args):
+    errors = []
+    rng = random.Random(args.seed)
+    await _check_limits(errors, args.requests, rng)
+    await _check_priority(errors)
+    await _check_shedding(errors)
+    await _check_deadlines(errors)
+
+    # Arrivals at ~1.5x what the upstream sustains at its comfortable concurrency.
+    mean_cost = sum(FLOW_COST[f] * w for f, w in FLOW_MIX.items()) / sum(FLOW_MIX.values())
+    rate = 1.5 * args.capacity / (args.base * mean_cost)
+    results, rejected = await _simulate(None, args.requests, args.capacity, args.base, rate, random.Random(args.seed))
+    _report("no admission control", results, rejected)
+    controller = AdmissionController(
+        limit=args.capacity, flow_limits={"default": args.capacity // 2}, queue_max=args.capacity * 4, timeout=args.base * 10
+    )
+    results, rejected = await _simulate(
+        controller, args.requests, args.capacity, args.base, rate, random.Random(args.seed)
+    )
+    _report(f"admission: limit {args.capacity}, default {args.capacity // 2}, queue {args.capacity * 4}", results, rejected)
+    print(f"  {controller.stats()}")
+
+    for error in errors:
+        print(f"  FAIL {error}")
+    print("admission: " + ("OK" if not errors else f"{len(errors)} failures"))
+    return 0 if not errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admission controller check and overload simulation.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--capacity", type=int, default=32, help="upstream calls in flight before it slows down")
+    parser.add_argument("--base", type=float, default=0.05, help="upstream seconds per unit of flow cost")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
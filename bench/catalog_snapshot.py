@@ -0,0 +1,146 @@
+"""
+Correctness check and microbenchmark for the in-memory catalog snapshot (services/catalog.py).
+
+Run from the repo root (works on a temporary copy of the DB; use PHARMACY_DB_PATH
+to point at a generated one, e.g. `python data/generate_db.py --scale large`):
+    python -m bench.catalog_snapshot --lookups 20000
+
+Compares every medication lookup (English, Hebrew, odd casing) and every inventory
+list served from the snapshot with the SQL path, times both with the tool cache
+off. Then applies inventory deltas (including a new stock row) and checks that the
+next snapshot is made copy-on-write without a reload and matches SQL, and that a
+write from another connection is picked up by a background rebuild.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.dbcopy import copy_db
+
+SOURCE_DB = Path(os.getenv("PHARMACY_DB_PATH", Path(__file__).resolve().parent.parent / "data" / "pharmacy.db"))
+
+
+def _inventory_key(rows):
+    return sorted((-r["quantity"], r["branch_id"], r["branch_name"], r["city"], r["hours"]) for r in rows)
+
+
+def _time(fn, items):
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - started) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog snapshot check and benchmark.")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="catalog-snapshot-"))
+    db_path = workdir / "pharmacy.db"
+    copy_db(SOURCE_DB, db_path)
+    os.environ["PHARMACY_DB_PATH"] = str(db_path)
+    os.environ["TOOL_CACHE"] = "0"
+
+    from services.db import apply_inventory_deltas, catalog_store, check_inventory, get_medication_by_name
+
+    catalog_store.enabled = True
+    snapshot = catalog_store.build()
+    stats = catalog_store.stats()
+    print(
+        f"snapshot: {stats['medications']} medications, {stats['branches']} branches, "
+        f"{stats['stock_rows']} stock rows, built in {stats['build_ms']} ms"
+    )
+
+    def sql(fn, *a):
+        catalog_store.enabled = False
+        try:
+            return fn(*a)
+        finally:
+            catalog_store.enabled = True
+
+    errors = []
+    names = []
+    for med in snapshot.medications:
+        names.extend([med.name_en, med.name_he, med.name_en.upper(), med.name_en.lower()])
+    names.append("no such medication")
+    for name in names:
+        if get_medication_by_name(name) != sql(get_medication_by_name, name):
+            errors.append(f"get_medication_by_name({name!r}) differs")
+    ids = [med.id for med in snapshot.medications] + [10**9]
+    for medication_id in ids:
+        if _inventory_key(check_inventory(medication_id)) != _inventory_key(sql(check_inventory, medication_id)):
+            errors.append(f"check_inventory({medication_id}) differs")
+    print(f"compared {len(names)} name lookups and {len(ids)} inventory lists: {len(errors)} mismatches")
+
+    rng = random.Random(args.seed)
+    sample_names = [rng.choice(names) for _ in range(args.lookups)]
+    sample_ids = [rng.choice(ids) for _ in range(args.lookups)]
+    for label, fn, items in (
+        ("get_medication_by_name", get_medication_by_name, sample_names),
+        ("check_inventory", check_inventory, sample_ids),
+    ):
+        fast = _time(fn, items)
+        slow = _time(lambda item: sql(fn, item), items)
+        print(f"{label:<24} snapshot {fast:8.1f} µs   sql {slow:8.1f} µs   ({slow / fast:.0f}x)")
+
+    # Inventory deltas: the next snapshot is made copy-on-write, right away and without a reload.
+    med = snapshot.medications[0]
+    rows = snapshot.inventory(med.id)
+    stocked = {r["branch_id"] for r in rows}
+    branch_id = rows[0]["branch_id"] if rows else snapshot.branches[0].id
+    deltas = [(branch_id, med.id, 7), (snapshot.branches[0].id, snapshot.medications[-1].id, -3)]
+    # A branch without a row for the middle medication: the delta inserts one and shifts later offsets.
+    middle = snapshot.medications[len(snapshot.medications) // 2]
+    unstocked = {r["branch_id"] for r in snapshot.inventory(middle.id)}
+    fresh = next((b.id for b in snapshot.branches if b.id not in unstocked), None)
+    if fresh is not None:
+        deltas.append((fresh, middle.id, 5))
+    builds = catalog_store.builds
+    started = time.perf_counter()
+    changes = apply_inventory_deltas(deltas)
+    patch_ms = (time.perf_counter() - started) * 1000
+    patched = catalog_store.current()
+    if patched is None or patched is snapshot:
+        errors.append("the snapshot was not moved past the inventory delta")
+    if catalog_store.builds != builds:
+        errors.append("an inventory delta triggered a full reload")
+    for medication_id in ids:
+        if _inventory_key(check_inventory(medication_id)) != _inventory_key(sql(check_inventory, medication_id)):
+            errors.append(f"check_inventory({medication_id}) differs after the delta")
+    print(f"inventory delta ({len(changes)} rows, {len(stocked)} branches stocked): applied in {patch_ms:.1f} ms, "
+          f"copy-on-write {catalog_store.stats()['build_ms']} ms")
+
+    # Anything else (here another connection writing the DB) rebuilds it in the background.
+    import sqlite3
+
+    external = sqlite3.connect(db_path)
+    with external:
+        external.execute("UPDATE inventory SET quantity = quantity + 1 WHERE medication_id = ?", (med.id,))
+    external.close()
+    time.sleep(float(os.getenv("CACHE_VERSION_CHECK_INTERVAL", "0.5")) + 0.05)
+    deadline = time.monotonic() + 10
+    while catalog_store.current() is None or catalog_store.builds == builds:
+        if time.monotonic() > deadline:
+            errors.append("snapshot was not reloaded within 10s")
+            break
+        time.sleep(0.01)
+    if _inventory_key(catalog_store.current().inventory(med.id)) != _inventory_key(sql(check_inventory, med.id)):
+        errors.append("reloaded snapshot differs from SQL")
+    print(f"hot reload: {catalog_store.stats()}")
+
+    for error in errors[:20]:
+        print(f"  FAIL {error}")
+    print("snapshot: " + ("OK" if not errors else f"{len(errors)} failures"))
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
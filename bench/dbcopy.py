@@ -0,0 +1,18 @@
+"""
+Shared by the benches that work on a temporary copy of the DB.
+"""
+import sqlite3
+
+
+def copy_db(source, dest):
+    """
+    Copy the SQLite DB at `source` to `dest` through the backup API, so writes still
+    in source's WAL file are included (copying the main file alone drops them).
+    """
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
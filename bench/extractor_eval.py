@@ -0,0 +1,82 @@
+"""
+Accuracy and latency check for the local entity extractor (services/extractor.py).
+
+Run from the repo root after seeding the DB:
+    python -m bench.extractor_eval
+
+Each case is (message, expected medication name_en or None, expected contact or None).
+None means the extractor should stay unsure and let the LLM planning call decide.
+"""
+import sys
+import time
+
+from services.extractor import extract_contact, extract_medication_name, get_matcher
+
+CASES = [
+    # Stock (English)
+    ("Do you have Ibuprofen in stock?", "Ibuprofen", None),
+    ("is paracetamol available?", "Paracetamol", None),
+    ("Check stock for CETIRIZINE please", "Cetirizine", None),
+    ("Atorvastatin availability in Tel Aviv", "Atorvastatin", None),
+    ("do you have something for a headache in stock?", None, None),
+    ("Do you have Ibuprofen and Paracetamol in stock?", None, None),
+    # Stock (Hebrew)
+    ("יש נורופן במלאי?", "Ibuprofen", None),
+    ("יש לכם אקמול?", "Paracetamol", None),
+    ("האם זירטק זמין בסניף?", "Cetirizine", None),
+    ("מה הזמינות של ליפיטור", "Atorvastatin", None),
+    ("יש לכם משהו נגד כאב ראש?", None, None),
+    # Hebrew prefixes attached to the name
+    ("אני רוצה חידוש לאמוקסיצילין עבור 0501234567", "Amoxicillin", "0501234567"),
+    ("ובנורופן יש מלאי?", "Ibuprofen", None),
+    ("מה עם האקמול?", "Paracetamol", None),
+    # Prescriptions
+    ("Check prescriptions for 0507654321", None, "0507654321"),
+    ("תבדוק מרשמים עבור 0501234567", None, "0501234567"),
+    ("my prescriptions, email david@gmail.com", None, "david@gmail.com"),
+    ("prescriptions for 050-765-4321", None, "0507654321"),
+    ("prescriptions for +972 50 123 4567", None, "0501234567"),
+    ("prescriptions for +972-50-1234567.", None, "0501234567"),
+    ("מרשמים עבור yael@gmail.com", None, "yael@gmail.com"),
+    ("check my prescriptions", None, None),
+    ("prescriptions for 0501234567 or dana@gmail.com", None, None),
+    # Refills
+    ("Refill Atorvastatin for 0507654321", "Atorvastatin", "0507654321"),
+    ("refill amoxicillin, my phone is 050 123 4567", "Amoxicillin", "0501234567"),
+    ("Please renew my Lipitor prescription, itai@gmail.com", None, "itai@gmail.com"),
+    ("בקשת חידוש ליפיטור 0507654321", "Atorvastatin", "0507654321"),
+    # Numbers that are not phone numbers
+    ("Is Paracetamol 500mg in stock? I need 20 tablets", "Paracetamol", None),
+    ("order 12345678901 status", None, None),
+]
+
+LATENCY_ROUNDS = 200
+
+
+def main():
+    get_matcher()  # load the catalog outside the timed section
+
+    failures = []
+    for text, want_med, want_contact in CASES:
+        got_med = extract_medication_name(text)
+        got_contact = extract_contact(text)
+        if (got_med, got_contact) != (want_med, want_contact):
+            failures.append((text, (want_med, want_contact), (got_med, got_contact)))
+
+    started = time.perf_counter()
+    for _ in range(LATENCY_ROUNDS):
+        for text, _, _ in CASES:
+            extract_medication_name(text)
+            extract_contact(text)
+    per_message_us = (time.perf_counter() - started) * 1e6 / (LATENCY_ROUNDS * len(CASES))
+
+    accuracy = 1 - len(failures) / len(CASES)
+    print(f"cases: {len(CASES)}  accuracy: {accuracy:.1%}  latency: {per_message_us:.1f} us/message")
+    for text, want, got in failures:
+        print(f"  MISS {text!r}: expected {want}, got {got}")
+
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
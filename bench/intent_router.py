@@ -0,0 +1,76 @@
+"""
+Labelled corpus and microbenchmark for the intent router (app/intents.py).
+
+Run from the repo root:
+    python -m bench.intent_router
+
+Each case is (message, expected set of intents); an empty set means the default Q&A path.
+"""
+import sys
+import time
+
+from app.intents import route_intents
+
+CASES = [
+    # Stock
+    ("Do you have Ibuprofen in stock?", {"stock"}),
+    ("Is Paracetamol available?", {"stock"}),
+    ("check stock for cetirizine", {"stock"}),
+    ("What's the availability of Atorvastatin?", {"stock"}),
+    ("Is it stocked at the mall branch?", {"stock"}),
+    ("יש נורופן במלאי?", {"stock"}),
+    ("האם זירטק זמינה?", {"stock"}),
+    ("מה הזמינות של אקמול", {"stock"}),
+    ("יש לכם אקמול?", {"stock"}),
+    # Prescriptions
+    ("Check prescriptions for 0507654321", {"rx"}),
+    ("What prescriptions do I have? david@gmail.com", {"rx"}),
+    ("my rx list please, 0501234567", {"rx"}),
+    ("תבדוק מרשמים עבור 0501234567", {"rx"}),
+    ("מה עם המרשמים שלי?", {"rx"}),
+    # Refills
+    ("Refill Atorvastatin for 0507654321", {"refill"}),
+    ("I want to renew my Amoxicillin", {"refill"}),
+    ("please request refill", {"refill"}),
+    ("refill my prescription for Atorvastatin", {"refill"}),
+    ("אני רוצה חידוש לאמוקסיצילין עבור 0501234567", {"refill"}),
+    ("אפשר לחדש את המרשם?", {"refill"}),
+    # Compound requests
+    ("is Amoxicillin in stock and can I refill it", {"stock", "refill"}),
+    ("Check my prescriptions and whether Ibuprofen is available", {"stock", "rx"}),
+    ("יש במלאי אמוקסיצילין? ואני רוצה חידוש", {"stock", "refill"}),
+    # Default path (no flow) and former substring false positives
+    ("What is Paracetamol?", set()),
+    ("What are the side effects of Ibuprofen?", set()),
+    ("Can I use a proxy to pick it up?", set()),
+    ("Is this the extra strength version?", set()),
+    ("Do you sell thermometers?", set()),
+    ("מה המינון של אקמול?", set()),
+]
+
+BENCH_ROUNDS = 2000
+
+
+def main():
+    failures = []
+    for text, expected in CASES:
+        got = {intent for intent, _ in route_intents(text)}
+        if got != expected:
+            failures.append((text, expected, route_intents(text)))
+
+    started = time.perf_counter()
+    for _ in range(BENCH_ROUNDS):
+        for text, _ in CASES:
+            route_intents(text)
+    per_message_us = (time.perf_counter() - started) * 1e6 / (BENCH_ROUNDS * len(CASES))
+
+    accuracy = 1 - len(failures) / len(CASES)
+    print(f"cases: {len(CASES)}  accuracy: {accuracy:.1%}  latency: {per_message_us:.1f} us/message")
+    for text, expected, got in failures:
+        print(f"  MISS {text!r}: expected {sorted(expected)}, got {got}")
+
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
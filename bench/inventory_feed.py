@@ -0,0 +1,69 @@
+"""
+Fan-out benchmark for the inventory change feed (services/inventory_feed.py).
+
+Run from the repo root:
+    python -m bench.inventory_feed --watchers 5000 --bursts 50
+
+Subscribes N in-process watchers to one medication, publishes bursts of changes
+from a worker thread (as the /inventory/deltas endpoint does), and reports how long
+one publish takes to reach every watcher and how many updates were coalesced.
+No DB writes are involved.
+"""
+import argparse
+import asyncio
+import time
+
+import services.inventory_feed as feed_module
+from services.inventory_feed import InventoryFeed
+
+
+async def _run(watchers: int, bursts: int, burst_size: int):
+    feed_module.FEED_COALESCE_SECONDS = 0
+    feed = InventoryFeed()
+    subs = [feed.subscribe(1) for _ in range(watchers)]
+    received = [0] * watchers
+    done = asyncio.Event()
+
+    async def consume(i, sub):
+        async for batch in feed.updates(sub):
+            if batch:
+                received[i] += 1
+                if i == watchers - 1:
+                    done.set()
+
+    tasks = [asyncio.create_task(consume(i, sub)) for i, sub in enumerate(subs)]
+    await asyncio.sleep(0)
+
+    latencies = []
+    for burst in range(bursts):
+        done.clear()
+        changes = [(1, branch_id, burst) for branch_id in range(1, burst_size + 1)]
+        started = time.perf_counter()
+        await asyncio.to_thread(feed.publish, changes)
+        await done.wait()
+        latencies.append(time.perf_counter() - started)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return feed.stats(), latencies, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory feed fan-out benchmark.")
+    parser.add_argument("--watchers", type=int, default=5000)
+    parser.add_argument("--bursts", type=int, default=50)
+    parser.add_argument("--burst-size", type=int, default=10, help="branch changes per publish")
+    args = parser.parse_args()
+
+    stats, latencies, received = asyncio.run(_run(args.watchers, args.bursts, args.burst_size))
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"watchers: {args.watchers}  bursts: {args.bursts} x {args.burst_size} changes")
+    print(f"publish -> last watcher: p50 {p50:.1f} ms  p95 {p95:.1f} ms  ({p50 * 1000 / args.watchers:.2f} us/watcher)")
+    print(f"events delivered: {sum(received)}  feed stats: {stats}")
+
+
+if __name__ == "__main__":
+    main()
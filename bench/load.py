@@ -0,0 +1,242 @@
+"""
+End-to-end load driver for POST /chat/stream.
+
+    # everything local: starts the mock model server and the app, then drives load
+    python -m bench.load --spawn --concurrency 50 --requests 2000
+
+    # against an already running app (pointed at bench.mock_openai via OPENAI_BASE_URL)
+    python -m bench.load --url http://127.0.0.1:8000 --mock-url http://127.0.0.1:9100
+
+Reports requests/sec, p50/p95/p99 time-to-first-byte and total latency per flow,
+and how many upstream model calls each flow makes (measured on the mock). With
+--spawn the app works on a temporary copy of the DB (PHARMACY_DB_PATH or
+data/pharmacy.db), since refill requests are real writes.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench.dbcopy import copy_db
+
+SOURCE_DB = Path(os.getenv("PHARMACY_DB_PATH", Path(__file__).resolve().parent.parent / "data" / "pharmacy.db"))
+
+CONVERSATIONS = {
+    "stock": [
+        "Do you have Ibuprofen in stock?",
+        "Is Paracetamol available?",
+        "יש נורופן במלאי?",
+        "check stock for Cetirizine",
+    ],
+    "rx": [
+        "Check prescriptions for 0507654321",
+        "תבדוק מרשמים עבור 0501234567",
+        "What prescriptions do I have? david@gmail.com",
+    ],
+    "refill": [
+        "Refill Atorvastatin for 0507654321",
+        "אני רוצה חידוש לאמוקסיצילין עבור 0501234567",
+        "Refill Amoxicillin for 0503333333",
+    ],
+    "default": [
+        "What is Paracetamol?",
+        "What are the warnings for Ibuprofen?",
+        "Hello, what can you do?",
+    ],
+}
+
+DEFAULT_MIX = "stock=40,rx=20,refill=20,default=20"
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def _one(client, url, flow, text, results):
+    payload = {"messages": [{"role": "user", "content": text}]}
+    started = time.perf_counter()
+    ttfb = None
+    ok = True
+    busy = False
+    try:
+        async with client.stream("POST", f"{url}/chat/stream", json=payload) as resp:
+            ok = resp.status_code == 200
+            busy = resp.status_code == 503
+            async for _ in resp.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+    except httpx.HTTPError:
+        ok = False
+    total = time.perf_counter() - started
+    results.append((flow, ok, ttfb if ttfb is not None else total, total, busy))
+
+
+async def _drive(url, flows, weights, total_requests, concurrency, seed):
+    rng = random.Random(seed)
+    queue = asyncio.Queue()
+    for _ in range(total_requests):
+        flow = rng.choices(flows, weights)[0]
+        queue.put_nowait((flow, rng.choice(CONVERSATIONS[flow])))
+
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker():
+            while not queue.empty():
+                flow, text = queue.get_nowait()
+                await _one(client, url, flow, text, results)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+async def _upstream_calls_per_flow(url, mock_url, per_flow=5):
+    """
+    Replay a few conversations per flow sequentially and count the mock's calls.
+    """
+    calls = {}
+    async with httpx.AsyncClient(timeout=120) as client:
+        for flow, texts in CONVERSATIONS.items():
+            await client.post(f"{mock_url}/mock/reset")
+            results = []
+            for i in range(per_flow):
+                await _one(client, url, flow, texts[i % len(texts)], results)
+            stats = (await client.get(f"{mock_url}/mock/stats")).json()
+            calls[flow] = (stats["calls"] / per_flow, stats["planning"] / per_flow, stats["streaming"] / per_flow)
+    return calls
+
+
+def _report(results, elapsed, calls):
+    print(f"\n{len(results)} requests in {elapsed:.2f}s  ->  {len(results) / elapsed:.1f} req/s")
+    header = f"{'flow':<9}{'n':>6}{'err':>5}{'busy':>6}{'ttfb p50':>10}{'p95':>8}{'p99':>8}{'total p50':>11}{'p95':>8}{'p99':>8}{'upstream/req':>18}"
+    print(header)
+    print("-" * len(header))
+    for flow in ["all"] + list(CONVERSATIONS):
+        rows = results if flow == "all" else [r for r in results if r[0] == flow]
+        if not rows:
+            continue
+        ttfb = [r[2] * 1000 for r in rows]
+        total = [r[3] * 1000 for r in rows]
+        errors = sum(1 for r in rows if not r[1] and not r[4])
+        busy = sum(1 for r in rows if r[4])
+        upstream = ""
+        if flow in calls:
+            c, p, s = calls[flow]
+            upstream = f"{c:.1f} ({p:.1f}p+{s:.1f}s)"
+        print(
+            f"{flow:<9}{len(rows):>6}{errors:>5}{busy:>6}"
+            f"{_percentile(ttfb, 50):>10.0f}{_percentile(ttfb, 95):>8.0f}{_percentile(ttfb, 99):>8.0f}"
+            f"{_percentile(total, 50):>11.0f}{_percentile(total, 95):>8.0f}{_percentile(total, 99):>8.0f}"
+            f"{upstream:>18}"
+        )
+    print("(latencies in ms; busy = 503 from admission control; upstream = model calls per request: planning + streaming)")
+
+
+def _spawn(args, workdir: Path):
+    db_path = workdir / "pharmacy.db"
+    copy_db(SOURCE_DB, db_path)
+    env = dict(os.environ)
+    env["PHARMACY_DB_PATH"] = str(db_path)
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env["OPENAI_BASE_URL"] = f"{args.mock_url}/v1"
+    mock_port = args.mock_url.rsplit(":", 1)[1]
+    app_port = args.url.rsplit(":", 1)[1]
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "bench.mock_openai", "--port", mock_port,
+             "--ttft", str(args.ttft), "--token-delay", str(args.token_delay), "--jitter", str(args.jitter)],
+            env=env,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", app_port, "--log-level", "warning"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        ),
+    ]
+    return procs
+
+
+async def _wait_ready(urls, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        for url in urls:
+            while True:
+                try:
+                    if (await client.get(url)).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not come up")
+                await asyncio.sleep(0.2)
+
+
+async def _main(args):
+    mix = dict(part.split("=") for part in args.mix.split(","))
+    flows = list(mix)
+    weights = [float(mix[f]) for f in flows]
+
+    await _wait_ready([f"{args.mock_url}/mock/stats", f"{args.url}/readyz"])
+    calls = await _upstream_calls_per_flow(args.url, args.mock_url)
+    await _drive(args.url, flows, weights, min(args.requests, args.concurrency), args.concurrency, args.seed)  # warm-up
+    results, elapsed = await _drive(args.url, flows, weights, args.requests, args.concurrency, args.seed)
+    _report(results, elapsed, calls)
+    async with httpx.AsyncClient(timeout=10) as client:
+        stats = (await client.get(f"{args.url}/stats")).json()
+    shared = stats.get("singleflight", {})
+    if shared:
+        print("singleflight dedup: " + "  ".join(
+            f"{group}={s['shared']}/{s['calls']} ({s['dedup_ratio']:.0%})" for group, s in shared.items()
+        ))
+    admission = stats.get("admission")
+    if admission:
+        print(
+            f"admission: peak queue {admission['peak_queued']}, {admission['admitted_after_wait']} waited "
+            f"(avg {admission['avg_wait_ms']} ms), rejected full/shed/timeout "
+            f"{admission['rejected_queue_full']}/{admission['rejected_shed']}/{admission['rejected_timeout']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /chat/stream against the local mock model server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mock-url", default="http://127.0.0.1:9100")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="flow weights, e.g. stock=40,rx=20,refill=20,default=20")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spawn", action="store_true", help="start the mock server and the app locally")
+    parser.add_argument("--ttft", type=float, default=0.3, help="mock time-to-first-token (with --spawn)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="mock inter-token delay (with --spawn)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="mock delay jitter fraction (with --spawn)")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="load-")) if args.spawn else None
+    procs = _spawn(args, workdir) if args.spawn else []
+    try:
+        asyncio.run(_main(args))
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Recall and latency of the fuzzy medication search (services/search.py).
+
+Run from the repo root (works on a temporary copy of the DB; use PHARMACY_DB_PATH
+to point at a generated one, e.g. `python data/generate_db.py --scale large`):
+    python -m bench.medication_search --queries 2000
+
+Builds medications_fts, then queries it with corrupted names: one-edit typos,
+partial names (prefixes), Hebrew with niqqud or swapped final-letter forms, and
+active-ingredient names. Reports top-1 / top-5 recall, how often the confident
+auto-match fires (and how often it is wrong), and per-query latency.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.dbcopy import copy_db
+
+SOURCE_DB = Path(os.getenv("PHARMACY_DB_PATH", Path(__file__).resolve().parent.parent / "data" / "pharmacy.db"))
+
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+HEBREW = "אבגדהוזחטיכלמנסעפצקרשת"
+NIQQUD = "ְִֵֶַָֹּ"
+TO_FINAL = str.maketrans("כמנפצ", "ךםןףץ")
+
+
+def _typo(rng, word):
+    letters = HEBREW if any("֐" <= ch <= "׿" for ch in word) else LATIN
+    i = rng.randrange(len(word))
+    op = rng.choice(("delete", "swap", "substitute", "insert"))
+    if op == "delete" and len(word) > 4:
+        return word[:i] + word[i + 1:]
+    if op == "swap" and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if op == "insert":
+        return word[:i] + rng.choice(letters) + word[i:]
+    return word[:i] + rng.choice(letters) + word[i + 1:]
+
+
+def _variants(rng, med):
+    med_id, name_en, name_he, ingredients = med
+    yield "typo (en)", _typo(rng, name_en.lower())
+    yield "typo (he)", _typo(rng, name_he)
+    yield "prefix", name_en[:max(4, int(len(name_en) * 0.6))]
+    yield "niqqud", "".join(ch + (rng.choice(NIQQUD) if rng.random() < 0.5 else "") for ch in name_he)
+    yield "final forms", "".join(ch.translate(TO_FINAL) for ch in name_he)
+    ingredient = " ".join(w for w in ingredients.split() if not any(c.isdigit() for c in w))
+    if ingredient and ingredient.lower() != name_en.lower():
+        yield "ingredient", ingredient
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzzy medication search recall and latency.")
+    parser.add_argument("--queries", type=int, default=2000, help="medications sampled (several variants each)")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="medication-search-"))
+    db_path = workdir / "pharmacy.db"
+    copy_db(SOURCE_DB, db_path)
+    os.environ["PHARMACY_DB_PATH"] = str(db_path)
+    os.environ["TOOL_CACHE"] = "0"
+
+    from services.db import read_connection
+    from services.search import (
+        best_medication_match,
+        rebuild_medication_search,
+        refresh_medication_search,
+        search_medications,
+    )
+
+    started = time.perf_counter()
+    rebuild_medication_search()
+    print(f"built medications_fts in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    with read_connection() as conn:
+        meds = conn.execute("SELECT id, name_en, name_he, active_ingredients FROM medications").fetchall()
+    rng = random.Random(args.seed)
+    sample = meds if len(meds) <= args.queries else rng.sample(meds, args.queries)
+
+    results = {}
+    timings = []
+    for med in sample:
+        # Names that several medications share can't be resolved to one id; skip them.
+        for kind, query in _variants(rng, med):
+            t0 = time.perf_counter()
+            hits = search_medications(query, 5)
+            timings.append(time.perf_counter() - t0)
+            auto = best_medication_match(query)
+            ids = [h["id"] for h in hits]
+            row = results.setdefault(kind, [0, 0, 0, 0, 0])
+            row[0] += 1
+            row[1] += bool(ids) and ids[0] == med[0]
+            row[2] += med[0] in ids
+            row[3] += auto is not None
+            row[4] += auto is not None and auto["id"] != med[0]
+
+    print(f"\n{'variant':<14}{'n':>7}{'top-1':>9}{'top-5':>9}{'auto':>9}{'auto wrong':>12}")
+    for kind, (n, top1, top5, auto, wrong) in results.items():
+        print(f"{kind:<14}{n:>7}{top1 / n:>9.1%}{top5 / n:>9.1%}{auto / n:>9.1%}{wrong / n:>12.1%}")
+    timings.sort()
+    print(
+        f"\n{len(meds)} medications; search latency p50 {timings[len(timings) // 2] * 1000:.2f} ms, "
+        f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms"
+    )
+
+    # A rename by another writer reaches the index through a row-level refresh.
+    renamed = meds[0][0]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE medications SET name_en = 'Zorblaxin' WHERE id = ?", (renamed,))
+    started = time.perf_counter()
+    refresh_medication_search()
+    hits = search_medications("zorblaxin", 1)
+    print(f"refreshed medications_fts after a rename in {(time.perf_counter() - started) * 1000:.0f} ms")
+    shutil.rmtree(workdir, ignore_errors=True)
+    if not hits or hits[0]["id"] != renamed:
+        print(f"FAIL: renamed medication {renamed} not found: {hits}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
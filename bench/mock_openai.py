@@ -0,0 +1,257 @@
+"""
+Local OpenAI-compatible stand-in for load testing (POST /v1/chat/completions).
+
+    python -m bench.mock_openai --port 9100 --ttft 0.4 --token-delay 0.02 --jitter 0.25
+
+- Forced tool_choice requests get a tool call whose arguments are pulled from the
+  last user message (medication via the catalog matcher, phone/email via regex).
+- tool_choice="auto" requests call get_medication_by_name once per catalog name mentioned
+  (several names -> several parallel tool calls in one message).
+- stream=True requests stream a canned answer as SSE deltas.
+- GET /v1/models/{model} answers immediately (the app's warm-up requests).
+Latency: time-to-first-token (or to the full response when not streaming), a
+per-token delay, and +/- jitter (fraction) applied to both. `--model-speed`
+("gpt-5-nano=0.25,gpt-5-mini=0.5") scales both per requested model, to try out
+per-stage model routing; calls are counted per model under `by_model`.
+
+Fault injection (per chat completion, independently drawn):
+- `--error-rate`: an immediate 500
+- `--rate-limit-rate`: a 429 with `retry-after-ms`
+- `--slow-rate`: time-to-first-token multiplied by `--slow-factor`, a tail-latency straggler
+
+They can also be changed at runtime with POST /mock/faults {"error_rate": 0.1, ...}.
+
+GET /mock/stats returns call and fault counters; POST /mock/reset clears them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+from app.model_routing import parse_routes
+from services.extractor import extract_contact, extract_medication_name, get_matcher
+
+CONFIG = {
+    "ttft": float(os.getenv("MOCK_TTFT", "0.3")),
+    "token_delay": float(os.getenv("MOCK_TOKEN_DELAY", "0.02")),
+    "jitter": float(os.getenv("MOCK_JITTER", "0.2")),
+    "answer_tokens": int(os.getenv("MOCK_ANSWER_TOKENS", "60")),
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "rate_limit_rate": float(os.getenv("MOCK_RATE_LIMIT_RATE", "0")),
+    "slow_rate": float(os.getenv("MOCK_SLOW_RATE", "0")),
+    "slow_factor": float(os.getenv("MOCK_SLOW_FACTOR", "10")),
+}
+MODEL_SPEED = parse_routes(os.getenv("MOCK_MODEL_SPEED", ""), float)
+
+FAULTS = ("error_rate", "rate_limit_rate", "slow_rate", "slow_factor")
+
+STATS = {"calls": 0, "planning": 0, "streaming": 0, "by_kind": {}, "by_model": {}, "faults": {}}
+
+app = FastAPI()
+
+
+def _delay(base: float) -> float:
+    jitter = CONFIG["jitter"]
+    return max(0.0, base * (1 + random.uniform(-jitter, jitter)))
+
+
+def _fault():
+    """
+    Pick the injected fault for one call: "error", "rate_limit", "slow" or None.
+    """
+    for fault, rate in (("error", "error_rate"), ("rate_limit", "rate_limit_rate"), ("slow", "slow_rate")):
+        if random.random() < CONFIG[rate]:
+            STATS["faults"][fault] = STATS["faults"].get(fault, 0) + 1
+            return fault
+    return None
+
+
+def _last_user(messages) -> str:
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            return m.get("content") or ""
+    return ""
+
+
+def _count(kind: str):
+    STATS["calls"] += 1
+    STATS["by_kind"][kind] = STATS["by_kind"].get(kind, 0) + 1
+
+
+def _usage(messages, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _forced_args(name: str, text: str):
+    if name == "get_medication_by_name":
+        return {"name": extract_medication_name(text) or text.split()[-1].strip("?!.")}
+    if name == "get_user_by_contact":
+        return {"contact": extract_contact(text) or ""}
+    return None
+
+
+def _tool_call(name: str, args: dict):
+    return {
+        "id": f"call_{uuid.uuid4().hex[:12]}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)},
+    }
+
+
+def _completion(body: dict) -> dict:
+    messages = body.get("messages", [])
+    text = _last_user(messages)
+    tool_choice = body.get("tool_choice")
+
+    name = None
+    calls = []
+    if isinstance(tool_choice, dict):
+        name = tool_choice["function"]["name"]
+        args = _forced_args(name, text)
+        if args is not None:
+            calls = [_tool_call(name, args)]
+    elif tool_choice == "auto" and body.get("tools"):
+        mentioned = get_matcher().find(text)
+        if mentioned:
+            name = "get_medication_by_name"
+            calls = [_tool_call(name, {"name": med}) for med in mentioned.values()]
+
+    message = {"role": "assistant", "content": None if calls else "How can I help you with your pharmacy question?"}
+    if calls:
+        message["tool_calls"] = calls
+    _count(f"plan:{name or 'none'}")
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if calls else "stop"}],
+        "usage": _usage(messages, 20),
+    }
+
+
+async def _stream(body: dict, ttft: float, speed: float):
+    messages = body.get("messages", [])
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    def chunk(delta, finish_reason=None, usage=None):
+        payload = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    await asyncio.sleep(_delay(ttft))
+    yield chunk({"role": "assistant", "content": ""})
+    for i in range(CONFIG["answer_tokens"]):
+        yield chunk({"content": f"tok{i} "})
+        await asyncio.sleep(_delay(CONFIG["token_delay"] * speed))
+    yield chunk({}, finish_reason="stop")
+    if include_usage:
+        yield chunk(None, usage=_usage(messages, CONFIG["answer_tokens"]))
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    try:
+        body = await request.json()
+    except ClientDisconnect:
+        # A cancelled request (e.g. the losing half of a hedge) went away mid-upload.
+        return Response(status_code=499)
+    fault = _fault()
+    if fault in ("error", "rate_limit"):
+        _count(f"fault:{fault}")
+    if fault == "error":
+        return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+    if fault == "rate_limit":
+        return JSONResponse(
+            {"error": {"message": "injected rate limit", "type": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after-ms": "100"},
+        )
+    model = body.get("model", "mock")
+    STATS["by_model"][model] = STATS["by_model"].get(model, 0) + 1
+    speed = MODEL_SPEED.get(model, 1.0)
+    ttft = CONFIG["ttft"] * speed * (CONFIG["slow_factor"] if fault == "slow" else 1)
+
+    if body.get("stream"):
+        STATS["streaming"] += 1
+        _count("stream")
+        return StreamingResponse(_stream(body, ttft, speed), media_type="text/event-stream")
+
+    STATS["planning"] += 1
+    await asyncio.sleep(_delay(ttft))
+    return _completion(body)
+
+
+@app.get("/v1/models/{model}")
+def retrieve_model(model: str):
+    # The app's startup warm-up opens its keep-alive connections with this call.
+    _count("models")
+    return {"id": model, "object": "model", "created": 0, "owned_by": "mock"}
+
+
+@app.get("/mock/stats")
+def mock_stats():
+    return STATS
+
+
+@app.post("/mock/reset")
+def mock_reset():
+    STATS.update({"calls": 0, "planning": 0, "streaming": 0, "by_kind": {}, "by_model": {}, "faults": {}})
+    return STATS
+
+
+@app.post("/mock/faults")
+def mock_faults(faults: dict):
+    CONFIG.update({key: float(value) for key, value in faults.items() if key in FAULTS})
+    return {key: CONFIG[key] for key in FAULTS}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=CONFIG["ttft"], help="seconds to first token / full response")
+    parser.add_argument("--token-delay", type=float, default=CONFIG["token_delay"], help="seconds between streamed tokens")
+    parser.add_argument("--jitter", type=float, default=CONFIG["jitter"], help="+/- fraction applied to delays")
+    parser.add_argument("--answer-tokens", type=int, default=CONFIG["answer_tokens"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"], help="share of calls failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=CONFIG["rate_limit_rate"], help="share of calls failing with 429")
+    parser.add_argument("--slow-rate", type=float, default=CONFIG["slow_rate"], help="share of calls with a slow first token")
+    parser.add_argument("--slow-factor", type=float, default=CONFIG["slow_factor"], help="ttft multiplier for slow calls")
+    parser.add_argument("--model-speed", default="", help='latency multipliers per model, e.g. "gpt-5-nano=0.25"')
+    args = parser.parse_args()
+
+    CONFIG.update(
+        ttft=args.ttft, token_delay=args.token_delay, jitter=args.jitter, answer_tokens=args.answer_tokens,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        slow_rate=args.slow_rate, slow_factor=args.slow_factor,
+    )
+    MODEL_SPEED.update(parse_routes(args.model_speed, float))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Correctness check and microbenchmark for the branch k-d tree (services/geo.py).
+
+Run from the repo root:
+    python -m bench.nearest_branches --branches 2000 --k 3
+
+Builds an index over synthetic branches scattered around the generator's cities,
+checks nearest-k results against a brute-force scan, and times queries at a
+high and a low share of branches holding enough stock (tree walk vs. direct scan).
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+from services.geo import BRUTE_FORCE_SHARE, BranchIndex, project
+
+CENTERS = [
+    (32.0853, 34.7818), (31.7683, 35.2137), (32.7940, 34.9896), (31.2520, 34.7915),
+    (32.3215, 34.8532), (31.8044, 34.6553), (29.5577, 34.9519), (32.7922, 35.5312),
+]
+
+
+def _branches(rng, count):
+    for branch_id in range(1, count + 1):
+        lat, lon = rng.choice(CENTERS)
+        yield (
+            branch_id, f"Branch #{branch_id}", "City", "08:00–22:00",
+            lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05),
+        )
+
+
+def _brute(points, qx, qy, k, stock):
+    dists = sorted(
+        (math.hypot(x - qx, y - qy), branch_id) for branch_id, (x, y) in points.items() if branch_id in stock
+    )
+    return [branch_id for _, branch_id in dists[:k]]
+
+
+def _query(index, lat, lon, k, stock):
+    if len(stock) < BRUTE_FORCE_SHARE * len(index.branches):
+        return index.nearest_among(lat, lon, k, stock)
+    return index.nearest(lat, lon, k, stock.__contains__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest-branch index check and benchmark.")
+    parser.add_argument("--branches", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = list(_branches(rng, args.branches))
+    started = time.perf_counter()
+    index = BranchIndex(rows)
+    build_ms = (time.perf_counter() - started) * 1000
+    points = {r[0]: project(r[4], r[5]) for r in rows}
+    print(f"branches: {args.branches}  build: {build_ms:.1f} ms")
+
+    failures = 0
+    for share in (0.9, 0.5, 0.1, 0.01):
+        stock = {r[0]: 10 for r in rows if rng.random() < share}
+        # Queries come from city centroids or a customer's position, i.e. near branches.
+        queries = []
+        for _ in range(args.queries):
+            lat, lon = rng.choice(CENTERS)
+            queries.append((lat + rng.uniform(-0.1, 0.1), lon + rng.uniform(-0.1, 0.1)))
+
+        for lat, lon in queries[:200]:
+            got = [branch_id for _, branch_id in _query(index, lat, lon, args.k, stock)]
+            if got != _brute(points, *project(lat, lon), args.k, stock):
+                failures += 1
+
+        started = time.perf_counter()
+        for lat, lon in queries:
+            _query(index, lat, lon, args.k, stock)
+        per_query_us = (time.perf_counter() - started) * 1e6 / len(queries)
+        path = "scan" if len(stock) < BRUTE_FORCE_SHARE * len(index.branches) else "tree"
+        print(f"  stocked {share:>5.0%} ({len(stock):>5} branches, {path}): {per_query_us:7.1f} us/query")
+
+    print(f"mismatches vs brute force: {failures}")
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+EXPLAIN QUERY PLAN assertions for the tool queries, plus contact-normalization checks.
+
+Run from the repo root (works on a temporary copy of the DB; use PHARMACY_DB_PATH
+to check a generated one):
+    python -m bench.query_plans
+
+Applies the schema migrations, then asserts that every lookup the tools run is an
+index search (no full table scan, no temp B-tree for the ORDER BY), and that
+differently formatted phones/emails resolve to the same user. Exits non-zero on failure.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.dbcopy import copy_db
+
+SOURCE_DB = Path(os.getenv("PHARMACY_DB_PATH", Path(__file__).resolve().parent.parent / "data" / "pharmacy.db"))
+
+
+def _plan(conn, sql, params):
+    return " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def main():
+    workdir = Path(tempfile.mkdtemp(prefix="query-plans-"))
+    db_path = workdir / "pharmacy.db"
+    copy_db(SOURCE_DB, db_path)
+    os.environ["PHARMACY_DB_PATH"] = str(db_path)
+    os.environ["TOOL_CACHE"] = "0"
+
+    from services import db
+    from services.migrations import migrate
+    from services.refills import _REFILL_BY_KEY_SQL
+
+    started = time.perf_counter()
+    version = migrate()
+    print(f"migrated to schema version {version} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    # (label, sql, params, substrings the plan must contain, substrings it must not)
+    checks = [
+        ("get_medication_by_name", db._MEDICATION_BY_NAME_SQL, ("x", "x"),
+         ["medications_name_en_lower", "medications_name_he_lower"], ["SCAN medications"]),
+        ("get_medications_by_names", db._MEDICATIONS_BY_NAMES_SQL.format(marks="?,?"), ("x", "y", "x", "y"),
+         ["medications_name_en_lower", "medications_name_he_lower"], ["SCAN medications"]),
+        ("check_inventory", db._INVENTORY_SQL, (1,),
+         ["SEARCH i USING COVERING INDEX inventory_medication_quantity"], ["SCAN i", "TEMP B-TREE"]),
+        ("check_inventory_many", db._INVENTORY_MANY_SQL.format(marks="?,?"), (1, 2),
+         ["inventory_medication_quantity"], ["SCAN i"]),
+        ("get_user_by_contact", db._USER_BY_CONTACT_SQL, ("0501234567",),
+         ["SEARCH users USING INDEX users_contact_normalized"], ["SCAN users"]),
+        ("list_user_prescriptions", db._USER_PRESCRIPTIONS_SQL, (1,),
+         ["SEARCH p USING INDEX prescriptions_user_id", "SEARCH m USING INTEGER PRIMARY KEY"], ["SCAN"]),
+        ("refill idempotency key", _REFILL_BY_KEY_SQL, ("k",),
+         ["USING INDEX sqlite_autoindex_refill_requests"], ["SCAN"]),
+    ]
+
+    failures = []
+    with db.read_connection() as conn:
+        for label, sql, params, required, forbidden in checks:
+            plan = _plan(conn, sql, params)
+            bad = [r for r in required if r not in plan] + [f"!{f}" for f in forbidden if f in plan]
+            print(f"{'OK  ' if not bad else 'FAIL'} {label:<26} {plan}")
+            if bad:
+                failures.append(f"{label}: {bad}")
+
+    # Contact formats: all spellings of the same phone/email must find the same user.
+    spellings = {
+        "0501234567": ["050-123-4567", "+972 50 123 4567", "+972-50-1234567", "00972501234567", " 0501234567 "],
+        "david@gmail.com": ["David@Gmail.com", " DAVID@GMAIL.COM "],
+    }
+    for canonical, variants in spellings.items():
+        expected = db.get_user_by_contact(canonical)
+        if expected is None:
+            failures.append(f"{canonical}: not in this DB")
+            continue
+        for variant in variants:
+            if db.get_user_by_contact(variant) != expected:
+                failures.append(f"{variant!r} did not resolve to user {expected['id']}")
+    print(f"contact spellings checked: {sum(len(v) for v in spellings.values())}")
+
+    for failure in failures:
+        print(f"  FAIL {failure}")
+    print("query plans: " + ("OK" if not failures else f"{len(failures)} failures"))
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Concurrency stress test for the refill write path (services/refills.py).
+
+Run from the repo root (works on a temporary copy of the DB):
+    python -m bench.refill_stress --threads 64 --per-thread 200
+    python -m bench.refill_stress --batch-max 1      # no group commit, for comparison
+
+Many threads submit refills against a few prescriptions, some retrying with the
+same idempotency key. Afterwards it checks that refills_left never went negative,
+that every successful submission decremented exactly once and wrote exactly one
+refill_requests row, and that retries got their original result back.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench.dbcopy import copy_db
+
+SOURCE_DB = Path(os.getenv("PHARMACY_DB_PATH", Path(__file__).resolve().parent.parent / "data" / "pharmacy.db"))
+
+
+def _prepare(path: Path, prescriptions: int, refills: int):
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM refill_requests")
+    start = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM prescriptions").fetchone()[0]
+    ids = list(range(start, start + prescriptions))
+    conn.executemany(
+        "INSERT INTO prescriptions VALUES (?, 1, 1, 'active', ?)",
+        [(pid, refills) for pid in ids],
+    )
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refill write-path concurrency stress test.")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--per-thread", type=int, default=200)
+    parser.add_argument("--prescriptions", type=int, default=20)
+    parser.add_argument("--refills", type=int, default=300, help="refills_left per prescription")
+    parser.add_argument("--retry-rate", type=float, default=0.2, help="share of submissions re-sent with the same key")
+    parser.add_argument("--batch-max", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="refill-stress-"))
+    db_path = workdir / "pharmacy.db"
+    copy_db(SOURCE_DB, db_path)
+    prescription_ids = _prepare(db_path, args.prescriptions, args.refills)
+    os.environ["PHARMACY_DB_PATH"] = str(db_path)
+
+    from services.refills import refill_writer, submit_refill
+
+    refill_writer.batch_max = args.batch_max
+    outcomes = []
+    lock = threading.Lock()
+
+    def worker(thread_no):
+        rng = random.Random(args.seed * 1000 + thread_no)
+        local = []
+        for i in range(args.per_thread):
+            key = f"t{thread_no}-{i}"
+            pid = rng.choice(prescription_ids)
+            first = submit_refill(1, pid, key)
+            local.append((key, pid, first))
+            if rng.random() < args.retry_rate:
+                local.append((key, pid, submit_refill(1, pid, key)))
+        with lock:
+            outcomes.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(db_path)
+    marks = ",".join("?" * len(prescription_ids))
+    left = dict(conn.execute(f"SELECT id, refills_left FROM prescriptions WHERE id IN ({marks})", prescription_ids))
+    rows = dict(conn.execute("SELECT idempotency_key, id FROM refill_requests"))
+    per_prescription = dict(
+        conn.execute("SELECT prescription_id, COUNT(*) FROM refill_requests GROUP BY prescription_id")
+    )
+    conn.close()
+
+    errors = []
+    first_result = {}
+    for key, pid, result in outcomes:
+        if key in first_result:
+            if result != {**first_result[key], "replayed": True} and result != first_result[key]:
+                errors.append(f"retry of {key} returned {result}, first was {first_result[key]}")
+        else:
+            first_result[key] = result
+    submitted = {key: r for key, r in first_result.items() if r["status"] == "submitted"}
+    attempts = {}
+    for key, pid, _ in outcomes:
+        attempts.setdefault(pid, set()).add(key)
+
+    for pid in prescription_ids:
+        done = per_prescription.get(pid, 0)
+        if left[pid] < 0:
+            errors.append(f"prescription {pid}: refills_left went negative ({left[pid]})")
+        if args.refills - left[pid] != done:
+            errors.append(f"prescription {pid}: {args.refills - left[pid]} decrements but {done} refill rows")
+        if done != min(args.refills, len(attempts.get(pid, ()))):
+            errors.append(f"prescription {pid}: {done} submitted of {len(attempts.get(pid, ()))} attempts")
+    if len(rows) != len(submitted):
+        errors.append(f"{len(rows)} refill rows for {len(submitted)} submitted keys")
+    for key, result in submitted.items():
+        if rows.get(key) != result["refill_request_id"]:
+            errors.append(f"{key}: row {rows.get(key)} != returned id {result['refill_request_id']}")
+
+    stats = refill_writer.stats()
+    print(
+        f"{len(outcomes)} submissions ({len(first_result)} keys, {len(outcomes) - len(first_result)} retries) "
+        f"from {args.threads} threads in {elapsed:.2f}s -> {len(outcomes) / elapsed:.0f}/s"
+    )
+    print(f"submitted: {len(submitted)}  rejected: {len(first_result) - len(submitted)}  writer: {stats}")
+    for error in errors[:20]:
+        print(f"  FAIL {error}")
+    print("invariants: " + ("OK" if not errors else f"{len(errors)} violations"))
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
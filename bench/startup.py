@@ -0,0 +1,91 @@
+"""
+Cold start of the app: process spawn to serving, to ready, and the first chat after that.
+
+    python -m bench.startup --runs 5
+
+Starts the mock model server once, then launches the app (uvicorn) `--runs` times.
+For each run it reports the time from spawn until /healthz answers (lifespan done,
+socket bound) and until /readyz is 200 (warm-up finished), the app's own
+import-to-ready time with its slowest warm-up steps, and the time to the first
+byte of a stock question sent right after readiness.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+QUESTION = {"messages": [{"role": "user", "content": "Do you have Ibuprofen in stock?"}]}
+
+
+def _wait(client, url, status=200, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if client.get(url).status_code == status:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer {status} within {timeout}s")
+
+
+def _first_byte(client, url):
+    started = time.perf_counter()
+    with client.stream("POST", f"{url}/chat/stream", json=QUESTION) as response:
+        for _ in response.iter_bytes():
+            return (time.perf_counter() - started) * 1000
+    return float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="App cold-start timings.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument("--mock-port", type=int, default=9200)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.mock_port}/v1"
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_openai", "--port", str(args.mock_port), "--ttft", "0.05", "--jitter", "0"],
+        env=env,
+    )
+    client = httpx.Client(timeout=10)
+    try:
+        _wait(client, f"http://127.0.0.1:{args.mock_port}/mock/stats")
+        print(f"{'run':>3}{'serving ms':>12}{'ready ms':>10}{'import->ready':>15}{'first chat ms':>15}  slowest steps")
+        for run in range(1, args.runs + 1):
+            started = time.perf_counter()
+            app = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+            try:
+                serving = _wait(client, f"{url}/healthz")
+                ready = _wait(client, f"{url}/readyz")
+                stats = client.get(f"{url}/readyz").json()
+                ttfb = _first_byte(client, url)
+            finally:
+                app.terminate()
+                app.wait()
+            steps = sorted(stats["steps_ms"].items(), key=lambda kv: kv[1], reverse=True)[:3]
+            print(
+                f"{run:>3}{(serving - started) * 1000:>12.0f}{(ready - started) * 1000:>10.0f}"
+                f"{stats['import_to_ready_s'] * 1000:>13.0f}ms{ttfb:>15.1f}  "
+                + ", ".join(f"{name} {ms:.0f}" for name, ms in steps)
+            )
+    finally:
+        client.close()
+        mock.terminate()
+        mock.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
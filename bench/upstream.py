@@ -0,0 +1,171 @@
+"""
+Deadlines, retries and hedging (services/upstream.py) against the fault-injecting mock.
+
+    python -m bench.upstream --calls 400 --concurrency 8
+
+Starts bench/mock_openai.py and drives planning-style calls (and answer streams)
+through `call_upstream` / `stream_upstream`, each call with its own request budget.
+Scenarios are switched with POST /mock/faults:
+- tail: 3% of calls 10x slower (a tail beyond p95), without and with hedging (latency percentiles and
+  the extra upstream calls hedging cost)
+- errors: 10% 500s + 5% 429s, without and with retries (success rate)
+- streams: the same errors on streaming calls (retried before the first chunk)
+- outage: every call fails; upstream calls per logical call must stay within 1 + retries
+  without hedging and within 1 + budget (UPSTREAM_EXTRA_CALLS) with it
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from services import upstream
+
+MESSAGES = [{"role": "user", "content": "Do you have Ibuprofen in stock?"}]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+async def _mock(mock, path, payload=None):
+    if payload is None:
+        return (await mock.get(path)).json()
+    return (await mock.post(path, json=payload)).json()
+
+
+async def _run(client, mock, model, calls, concurrency, budget, streaming=False):
+    await _mock(mock, "/mock/reset", {})
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            upstream.start_request_budget(budget)
+            started = time.perf_counter()
+            try:
+                if streaming:
+                    stream = upstream.stream_upstream(
+                        "bench:stream",
+                        lambda: client.chat.completions.create(model=model, messages=MESSAGES, stream=True),
+                    )
+                    async for _ in stream:
+                        pass
+                else:
+                    await upstream.call_upstream(
+                        "bench:plan",
+                        lambda: client.chat.completions.create(model=model, messages=MESSAGES),
+                        timeout=5,
+                        hedge=True,
+                    )
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(asyncio.create_task(one()) for _ in range(calls)))
+    upstream_calls = (await _mock(mock, "/mock/stats"))["calls"]
+    return latencies, failures, upstream_calls
+
+
+def _row(label, calls, latencies, failures, upstream_calls):
+    ms = [v * 1000 for v in latencies]
+    print(
+        f"{label:<28}{(calls - failures) / calls:>9.1%}{_percentile(ms, 50):>8.0f}{_percentile(ms, 95):>8.0f}"
+        f"{_percentile(ms, 99):>8.0f}{upstream_calls / calls:>12.2f}"
+    )
+
+
+async def _main(args):
+    from openai import AsyncOpenAI
+
+    base = f"http://127.0.0.1:{args.mock_port}"
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_openai", "--port", str(args.mock_port),
+         "--ttft", str(args.ttft), "--jitter", "0.2", "--token-delay", "0.002", "--answer-tokens", "10"],
+        env=dict(os.environ),
+    )
+    errors = []
+    client = AsyncOpenAI(api_key="bench", base_url=f"{base}/v1", max_retries=0)
+    try:
+        async with httpx.AsyncClient(base_url=base, timeout=10) as mock:
+            for _ in range(100):
+                try:
+                    await mock.get("/mock/stats")
+                    break
+                except httpx.HTTPError:
+                    await asyncio.sleep(0.1)
+
+            print(f"{'scenario':<28}{'success':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'calls/call':>12}")
+            run = lambda streaming=False: _run(client, mock, "mock", args.calls, args.concurrency, args.budget, streaming)
+
+            await _mock(mock, "/mock/faults", {"error_rate": 0, "rate_limit_rate": 0, "slow_rate": 0.03, "slow_factor": 10})
+            upstream.UPSTREAM_HEDGE = False
+            plain = await run()
+            _row("tail, no hedging", args.calls, *plain)
+            upstream.UPSTREAM_HEDGE = True
+            hedged = await run()
+            _row("tail, hedged after p95", args.calls, *hedged)
+            if _percentile(hedged[0], 99) >= _percentile(plain[0], 99):
+                errors.append("hedging did not lower p99")
+            if hedged[2] / args.calls > 1 + args.budget:
+                errors.append("hedging exceeded the per-call budget")
+
+            await _mock(mock, "/mock/faults", {"error_rate": 0.1, "rate_limit_rate": 0.05, "slow_rate": 0})
+            upstream.UPSTREAM_RETRIES = 0
+            _row("errors, no retries", args.calls, *(await run()))
+            upstream.UPSTREAM_RETRIES = 2
+            retried = await run()
+            _row("errors, 2 jittered retries", args.calls, *retried)
+            if retried[1] / args.calls > 0.03:
+                errors.append(f"{retried[1]} of {args.calls} calls failed despite retries")
+            streams = await run(streaming=True)
+            _row("errors, streams retried", args.calls, *streams)
+            if streams[1] / args.calls > 0.03:
+                errors.append(f"{streams[1]} of {args.calls} streams failed despite retries")
+
+            await _mock(mock, "/mock/faults", {"error_rate": 1.0, "rate_limit_rate": 0})
+            # Without hedging only retries spend the budget; with it, hedges may too, up to the budget.
+            upstream.UPSTREAM_HEDGE = False
+            outage = await run()
+            _row("outage", args.calls, *outage)
+            if outage[2] > args.calls * (1 + min(args.budget, upstream.UPSTREAM_RETRIES)):
+                errors.append(f"outage amplification {outage[2] / args.calls:.2f} exceeds 1 + retries")
+            upstream.UPSTREAM_HEDGE = True
+            outage = await run()
+            _row("outage, hedged", args.calls, *outage)
+            if outage[2] > args.calls * (1 + args.budget):
+                errors.append(f"hedged outage amplification {outage[2] / args.calls:.2f} exceeds 1 + budget")
+            await _mock(mock, "/mock/faults", {"error_rate": 0})
+            print(f"\nper stage: {upstream.upstream_stats()}")
+    finally:
+        await client.close()
+        proc.terminate()
+        proc.wait()
+
+    for error in errors:
+        print(f"  FAIL {error}")
+    print("upstream: " + ("OK" if not errors else f"{len(errors)} failures"))
+    return 0 if not errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upstream retries/hedging against the fault-injecting mock.")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--budget", type=int, default=upstream.UPSTREAM_EXTRA_CALLS, help="extra calls per logical call")
+    parser.add_argument("--ttft", type=float, default=0.05, help="mock latency per call")
+    parser.add_argument("--mock-port", type=int, default=9300)
+    args = parser.parse_args()
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
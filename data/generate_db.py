@@ -0,0 +1,261 @@
+"""
+Synthetic data generator for production-size pharmacy databases.
+
+    python data/generate_db.py --scale large --seed 42 --out data/pharmacy_large.db
+    python data/generate_db.py --users 200000 --medications 3000 --branches 120
+    python -m data.generate_db --scale small --out /tmp/pharmacy_small.db
+
+The seed rows from seed_db.py (Ben Cohen, Paracetamol, ...) are always included first,
+so the README examples keep working; generated rows follow with Hebrew/English names.
+Rows are streamed from generators into executemany() inside a single transaction,
+with journaling and fsync turned off for the load.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+
+if not __package__:
+    # Run as a script (python data/generate_db.py): data/ is on the path, the repo root is not.
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from data.seed_db import DB_PATH, branches, create_schema, inventory, medications, prescriptions, users
+
+SCALES = {
+    "small": {"users": 10_000, "medications": 500, "branches": 20, "inventory": 10_000, "prescriptions": 20_000},
+    "medium": {"users": 100_000, "medications": 2_000, "branches": 100, "inventory": 200_000, "prescriptions": 200_000},
+    "large": {"users": 1_000_000, "medications": 10_000, "branches": 500, "inventory": 5_000_000, "prescriptions": 2_000_000},
+}
+
+FIRST_NAMES = [
+    ("Noa", "נועה"), ("Ariel", "אריאל"), ("Yosef", "יוסף"), ("Tamar", "תמר"), ("Eitan", "איתן"),
+    ("Shira", "שירה"), ("Omer", "עומר"), ("Michal", "מיכל"), ("Daniel", "דניאל"), ("Roni", "רוני"),
+    ("Yael", "יעל"), ("Amit", "עמית"), ("Lior", "ליאור"), ("Maya", "מאיה"), ("Itai", "איתי"),
+    ("Hila", "הילה"), ("Gal", "גל"), ("Noam", "נועם"), ("Adi", "עדי"), ("Yonatan", "יונתן"),
+]
+LAST_NAMES = [
+    ("Cohen", "כהן"), ("Levi", "לוי"), ("Mizrahi", "מזרחי"), ("Peretz", "פרץ"), ("Biton", "ביטון"),
+    ("Dahan", "דהן"), ("Avraham", "אברהם"), ("Friedman", "פרידמן"), ("Katz", "כץ"), ("Azoulay", "אזולאי"),
+    ("Shalom", "שלום"), ("Golan", "גולן"), ("Amar", "עמר"), ("Ben-David", "בן דוד"), ("Rosen", "רוזן"),
+]
+EMAIL_DOMAINS = ["gmail.com", "walla.co.il", "outlook.com", "yahoo.com"]
+
+# (English, Hebrew) syllables; medication names are 2-3 of them plus a suffix, in both scripts.
+SYLLABLES = [
+    ("ze", "זה"), ("no", "נו"), ("ra", "רה"), ("li", "לי"), ("ta", "טה"), ("mi", "מי"), ("ko", "קו"),
+    ("sa", "סה"), ("ve", "וה"), ("do", "דו"), ("pa", "פה"), ("lo", "לו"), ("ri", "רי"), ("ne", "נה"),
+    ("ka", "קה"), ("to", "טו"), ("mo", "מו"), ("fi", "פי"), ("ga", "גה"), ("bu", "בו"), ("xa", "קסה"),
+    ("vi", "וי"), ("de", "דה"), ("sto", "סטו"), ("pri", "פרי"), ("tra", "טרה"), ("zo", "זו"), ("la", "לה"),
+]
+SUFFIXES = [
+    ("lin", "לין"), ("tan", "טן"), ("mol", "מול"), ("pril", "פריל"), ("zol", "זול"),
+    ("statin", "סטטין"), ("cillin", "צילין"), ("fen", "פן"), ("xin", "קסין"), ("dol", "דול"),
+]
+HEBREW_FINAL = {"כ": "ך", "מ": "ם", "נ": "ן", "פ": "ף", "צ": "ץ"}
+
+# (city, latitude, longitude) of the city center; branches are scattered up to ~CITY_SPREAD degrees around it.
+CITIES = [
+    ("Tel Aviv", 32.0853, 34.7818), ("Jerusalem", 31.7683, 35.2137), ("Haifa", 32.7940, 34.9896),
+    ("Ramat Gan", 32.0684, 34.8248), ("Beer Sheva", 31.2520, 34.7915), ("Netanya", 32.3215, 34.8532),
+    ("Holon", 32.0158, 34.7874), ("Rishon LeZion", 31.9730, 34.7925), ("Petah Tikva", 32.0840, 34.8878),
+    ("Ashdod", 31.8044, 34.6553), ("Herzliya", 32.1624, 34.8447), ("Eilat", 29.5577, 34.9519),
+    ("Nazareth", 32.6996, 35.3035), ("Tiberias", 32.7922, 35.5312), ("Modiin", 31.8980, 35.0104),
+    ("Kfar Saba", 32.1782, 34.9076),
+]
+CITY_SPREAD = 0.03
+BRANCH_KINDS = ["Pharmacy", "Mall Pharmacy", "Center Pharmacy", "Express Pharmacy", "Superpharm"]
+HOURS = ["08:00–22:00", "09:00–21:00", "07:00–23:00", "00:00–24:00", "08:00–20:00"]
+STRENGTHS = ["5mg", "10mg", "20mg", "50mg", "100mg", "200mg", "250mg", "500mg"]
+DOSAGES = [
+    ("Once daily.", "פעם ביום."),
+    ("Twice daily with food.", "פעמיים ביום עם אוכל."),
+    ("Take 1 tablet every 8 hours.", "טבליה אחת כל 8 שעות."),
+    ("As prescribed by your doctor.", "בהתאם להנחיות הרופא."),
+]
+WARNINGS = [
+    ("May cause drowsiness.", "עלול לגרום לנמנום."),
+    ("Do not exceed the stated dose.", "אין לעבור את המינון המומלץ."),
+    ("Avoid alcohol.", "יש להימנע מאלכוהול."),
+    ("Complete the full course.", "יש להשלים את כל הטיפול."),
+]
+
+BATCH = 50_000
+
+
+def _hebrew_word(text: str) -> str:
+    return text[:-1] + HEBREW_FINAL.get(text[-1], text[-1])
+
+
+def gen_users(rng, count, start_id):
+    for user_id in range(start_id, start_id + count):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        lang = "he" if rng.random() < 0.5 else "en"
+        full_name = f"{first[1]} {last[1]}" if lang == "he" else f"{first[0]} {last[0]}"
+        if user_id % 2:
+            # (user_id % 10, user_id // 10) is unique, so phones never collide (up to 10M users).
+            contact = f"05{user_id % 10}{user_id // 10:07d}"
+        else:
+            contact = f"{first[0]}.{last[0]}{user_id}@{rng.choice(EMAIL_DOMAINS)}".lower()
+        yield (user_id, full_name, contact, lang)
+
+
+def gen_medications(rng, count, start_id):
+    seen = set()
+    med_id = start_id
+    while med_id < start_id + count:
+        parts = rng.sample(SYLLABLES, rng.choice((2, 3)))
+        suffix = rng.choice(SUFFIXES)
+        name_en = ("".join(p[0] for p in parts) + suffix[0]).capitalize()
+        if name_en in seen:
+            continue
+        seen.add(name_en)
+        name_he = _hebrew_word("".join(p[1] for p in parts) + suffix[1])
+        strength = rng.choice(STRENGTHS)
+        dosage = rng.choice(DOSAGES)
+        warning = rng.choice(WARNINGS)
+        yield (
+            med_id, name_en, name_he, f"{name_en} {strength}",
+            dosage[0], dosage[1], int(rng.random() < 0.4), warning[0], warning[1],
+        )
+        med_id += 1
+
+
+def gen_branches(rng, count, start_id):
+    for branch_id in range(start_id, start_id + count):
+        city, lat, lon = rng.choice(CITIES)
+        yield (
+            branch_id, f"{city} {rng.choice(BRANCH_KINDS)} #{branch_id}", city, rng.choice(HOURS),
+            round(lat + rng.uniform(-CITY_SPREAD, CITY_SPREAD), 5),
+            round(lon + rng.uniform(-CITY_SPREAD, CITY_SPREAD), 5),
+        )
+
+
+def gen_inventory(rng, rows, branch_ids, med_ids, skip):
+    """
+    Spread `rows` (branch, medication) pairs evenly over the branches; ~10% are out of stock.
+    `skip` maps branch_id -> medication ids that already have a row.
+    """
+    per_branch = min(len(med_ids), max(1, rows // max(1, len(branch_ids))))
+    produced = 0
+    random_ = rng.random
+    for branch_id in branch_ids:
+        # Sorted, so rows arrive in primary-key order and the B-tree is appended to, not split.
+        chosen = med_ids if per_branch == len(med_ids) else sorted(rng.sample(med_ids, per_branch))
+        excluded = skip.get(branch_id)
+        if excluded:
+            chosen = [m for m in chosen if m not in excluded]
+        chosen = chosen[: rows - produced]
+        for med_id in chosen:
+            r = random_()
+            yield (branch_id, med_id, 0 if r < 0.1 else int((r - 0.1) * 333) + 1)
+        produced += len(chosen)
+        if produced >= rows:
+            return
+
+
+def gen_prescriptions(rng, count, start_id, user_ids, rx_med_ids):
+    for rx_id in range(start_id, start_id + count):
+        status = "active" if rng.random() < 0.7 else "expired"
+        refills = rng.randint(0, 5) if status == "active" else 0
+        yield (rx_id, rng.randint(*user_ids), rng.choice(rx_med_ids), status, refills)
+
+
+def _load(conn, table, sql, rows):
+    started = time.perf_counter()
+    total = 0
+    while True:
+        batch = list(islice(rows, BATCH))
+        if not batch:
+            break
+        conn.executemany(sql, batch)
+        total += len(batch)
+    print(f"  {table:<14}{total:>10,} rows  {time.perf_counter() - started:6.2f}s")
+    return total
+
+
+def generate(out: Path, seed: int, sizes: dict):
+    rng = random.Random(seed)
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    if tmp.exists():
+        tmp.unlink()
+
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    # Bulk-load settings: no rollback journal, no fsync, big page cache. Safe because
+    # the file is only renamed into place after a successful load.
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")
+    create_schema(conn)
+
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+
+    n_users = _load(conn, "users", "INSERT INTO users VALUES (?, ?, ?, ?)", iter(users))
+    n_users += _load(conn, "users (gen)", "INSERT INTO users VALUES (?, ?, ?, ?)",
+                     gen_users(rng, sizes["users"], len(users) + 1))
+
+    _load(conn, "medications", "INSERT INTO medications VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", iter(medications))
+    generated_meds = list(gen_medications(rng, sizes["medications"], len(medications) + 1))
+    _load(conn, "medications (gen)", "INSERT INTO medications VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+          iter(generated_meds))
+    med_ids = [m[0] for m in medications] + [m[0] for m in generated_meds]
+    rx_med_ids = [m[0] for m in medications + generated_meds if m[6]]
+
+    _load(conn, "branches", "INSERT INTO branches VALUES (?, ?, ?, ?, ?, ?)", iter(branches))
+    _load(conn, "branches (gen)", "INSERT INTO branches VALUES (?, ?, ?, ?, ?, ?)",
+          gen_branches(rng, sizes["branches"], len(branches) + 1))
+    branch_ids = list(range(1, len(branches) + sizes["branches"] + 1))
+
+    _load(conn, "inventory", "INSERT INTO inventory VALUES (?, ?, ?)", iter(inventory))
+    seeded_pairs = {}
+    for branch_id, med_id, _ in inventory:
+        seeded_pairs.setdefault(branch_id, set()).add(med_id)
+    _load(conn, "inventory (gen)", "INSERT INTO inventory VALUES (?, ?, ?)",
+          gen_inventory(rng, sizes["inventory"], branch_ids, med_ids, seeded_pairs))
+
+    _load(conn, "prescriptions", "INSERT INTO prescriptions VALUES (?, ?, ?, ?, ?)", iter(prescriptions))
+    _load(conn, "prescriptions (gen)", "INSERT INTO prescriptions VALUES (?, ?, ?, ?, ?)",
+          gen_prescriptions(rng, sizes["prescriptions"], len(prescriptions) + 1, (1, n_users), rx_med_ids))
+
+    conn.execute("COMMIT")
+    conn.execute("PRAGMA locking_mode = NORMAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.close()
+
+    for leftover in (Path(f"{out}-wal"), Path(f"{out}-shm")):
+        if leftover.exists():
+            leftover.unlink()
+    os.replace(tmp, out)
+    print(f"✅ Generated {out} in {time.perf_counter() - started:.2f}s (seed={seed})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic pharmacy DB at a configurable scale.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--medications", type=int)
+    parser.add_argument("--branches", type=int)
+    parser.add_argument("--inventory", type=int, help="number of (branch, medication) stock rows")
+    parser.add_argument("--prescriptions", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=DB_PATH)
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    generate(args.out, args.seed, sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    full_name TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    preferred_language TEXT NOT NULL
+);
+
+CREATE TABLE medications (
+    id INTEGER PRIMARY KEY,
+    name_en TEXT NOT NULL,
+    name_he TEXT NOT NULL,
+    active_ingredients TEXT NOT NULL,
+    dosage_en TEXT NOT NULL,
+    dosage_he TEXT NOT NULL,
+    prescription_required INTEGER NOT NULL,
+    warnings_en TEXT NOT NULL,
+    warnings_he TEXT NOT NULL
+);
+
+CREATE TABLE branches (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT NOT NULL,
+    hours TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL
+);
+
+CREATE TABLE inventory (
+    branch_id INTEGER NOT NULL,
+    medication_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (branch_id, medication_id)
+);
+
+CREATE TABLE prescriptions (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    medication_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    refills_left INTEGER NOT NULL
+);
+
+CREATE TABLE refill_requests (
+    id INTEGER PRIMARY KEY,
+    prescription_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    status TEXT NOT NULL,
+    refills_left_after INTEGER NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
@@ -3,58 +3,27 @@ from pathlib import Path
 
 DB_PATH = Path(__file__).parent / "pharmacy.db"
 
-conn = sqlite3.connect(DB_PATH)
-c = conn.cursor()
+SCHEMA_PATH = Path(__file__).parent / "schema.sql"
 
-# Recreate tables (start clean every time)
-c.executescript("""
+DROP_TABLES = """
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS medications;
 DROP TABLE IF EXISTS branches;
 DROP TABLE IF EXISTS inventory;
 DROP TABLE IF EXISTS prescriptions;
+DROP TABLE IF EXISTS refill_requests;
+DROP TABLE IF EXISTS medications_fts;
+PRAGMA user_version = 0;
+"""
+
+
+def create_schema(conn):
+    """
+    Recreate tables (start clean every time). The app's startup migrations
+    (services/migrations.py) add indexes and derived columns on top of schema.sql.
+    """
+    conn.executescript(DROP_TABLES + SCHEMA_PATH.read_text(encoding="utf-8"))
 
-CREATE TABLE users (
-    id INTEGER PRIMARY KEY,
-    full_name TEXT NOT NULL,
-    contact TEXT NOT NULL,
-    preferred_language TEXT NOT NULL
-);
-
-CREATE TABLE medications (
-    id INTEGER PRIMARY KEY,
-    name_en TEXT NOT NULL,
-    name_he TEXT NOT NULL,
-    active_ingredients TEXT NOT NULL,
-    dosage_en TEXT NOT NULL,
-    dosage_he TEXT NOT NULL,
-    prescription_required INTEGER NOT NULL,
-    warnings_en TEXT NOT NULL,
-    warnings_he TEXT NOT NULL
-);
-
-CREATE TABLE branches (
-    id INTEGER PRIMARY KEY,
-    name TEXT NOT NULL,
-    city TEXT NOT NULL,
-    hours TEXT NOT NULL
-);
-
-CREATE TABLE inventory (
-    branch_id INTEGER NOT NULL,
-    medication_id INTEGER NOT NULL,
-    quantity INTEGER NOT NULL,
-    PRIMARY KEY (branch_id, medication_id)
-);
-
-CREATE TABLE prescriptions (
-    id INTEGER PRIMARY KEY,
-    user_id INTEGER NOT NULL,
-    medication_id INTEGER NOT NULL,
-    status TEXT NOT NULL,
-    refills_left INTEGER NOT NULL
-);
-""")
 
 # 10 synthetic users
 users = [
@@ -110,8 +79,8 @@ medications = [
 ]
 
 branches = [
-    (1, "Downtown Pharmacy", "Tel Aviv", "08:00–22:00"),
-    (2, "Mall Pharmacy", "Ramat Gan", "09:00–21:00"),
+    (1, "Downtown Pharmacy", "Tel Aviv", "08:00–22:00", 32.0809, 34.7806),
+    (2, "Mall Pharmacy", "Ramat Gan", "09:00–21:00", 32.0998, 34.8265),
 ]
 
 inventory = [
@@ -125,13 +94,26 @@ prescriptions = [
     (3, 3, 3, "expired", 0),  # David has expired Amoxicillin Rx
 ]
 
-c.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", users)
-c.executemany("INSERT INTO medications VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", medications)
-c.executemany("INSERT INTO branches VALUES (?, ?, ?, ?)", branches)
-c.executemany("INSERT INTO inventory VALUES (?, ?, ?)", inventory)
-c.executemany("INSERT INTO prescriptions VALUES (?, ?, ?, ?, ?)", prescriptions)
 
-conn.commit()
-conn.close()
+def main():
+    conn = sqlite3.connect(DB_PATH)
+    create_schema(conn)
+
+    c = conn.cursor()
+    c.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", users)
+    c.executemany("INSERT INTO medications VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", medications)
+    c.executemany("INSERT INTO branches VALUES (?, ?, ?, ?, ?, ?)", branches)
+    c.executemany("INSERT INTO inventory VALUES (?, ?, ?)", inventory)
+    c.executemany("INSERT INTO prescriptions VALUES (?, ?, ?, ?, ?)", prescriptions)
+
+    conn.commit()
+
+    # WAL lets the service's pooled read-only connections run alongside writers.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    print("✅ Database seeded successfully:", DB_PATH)
+
 
-print("✅ Database seeded successfully:", DB_PATH)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Admission control for chat requests: concurrency limits, a bounded priority queue, load shedding.
+
+Every chat request holds a permit until its answer stream ends, and so holds the
+model calls it makes. Limits apply globally (ADMISSION_MAX_CONCURRENT) and per flow
+(ADMISSION_FLOW_LIMITS, e.g. "default=32"). A request that cannot start right away
+waits in a queue of at most ADMISSION_QUEUE_MAX entries for up to
+ADMISSION_QUEUE_TIMEOUT_MS. When a permit frees up it goes to the best waiter its
+flow limit allows. Waiters are ranked by ADMISSION_PRIORITY (cheap, bounded flows
+first), then by arrival.
+
+A full queue sheds its lowest-priority, newest waiter to make room for a
+higher-priority arrival; otherwise the arrival is turned away. Turned-away and
+timed-out requests raise AdmissionRejected, which the caller answers with a fast
+503 instead of a slow timeout. Runs on the event loop only (no locking).
+"""
+import asyncio
+import os
+import time
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "256"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "5000")) / 1000
+ADMISSION_FLOW_LIMITS = os.getenv("ADMISSION_FLOW_LIMITS", "default=32")
+ADMISSION_PRIORITY = os.getenv("ADMISSION_PRIORITY", "refill,rx,stock,default")
+
+
+def parse_flow_limits(spec: str) -> dict:
+    """
+    "default=32,stock=48" -> {"default": 32, "stock": 48}
+    """
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            flow, limit = part.split("=", 1)
+            limits[flow.strip()] = int(limit)
+    return limits
+
+
+class AdmissionRejected(Exception):
+    """
+    The request was not admitted; `reason` is "queue_full", "shed" or "timeout".
+    """
+
+    def __init__(self, reason: str, flow: str):
+        super().__init__(f"{flow} request rejected: {reason}")
+        self.reason = reason
+        self.flow = flow
+
+
+class Permit:
+    __slots__ = ("_controller", "flow", "waited", "_released")
+
+    def __init__(self, controller, flow: str, waited: float):
+        self._controller = controller
+        self.flow = flow
+        self.waited = waited
+        self._released = False
+
+    def release(self):
+        """
+        Give the slot back (idempotent).
+        """
+        if not self._released:
+            self._released = True
+            self._controller._release(self.flow)
+
+
+class _Waiter:
+    __slots__ = ("flow", "rank", "future", "granted")
+
+    def __init__(self, flow: str, rank, future):
+        self.flow = flow
+        self.rank = rank
+        self.future = future
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        limit: int = ADMISSION_MAX_CONCURRENT,
+        flow_limits: dict = None,
+        priority=None,
+        queue_max: int = ADMISSION_QUEUE_MAX,
+        timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.limit = limit
+        self.flow_limits = parse_flow_limits(ADMISSION_FLOW_LIMITS) if flow_limits is None else flow_limits
+        order = [f.strip() for f in (ADMISSION_PRIORITY.split(",") if priority is None else priority)]
+        self.priority = {flow: i for i, flow in enumerate(order)}
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self._queue = []
+        self._seq = 0
+        self._active = 0
+        self._active_by_flow = {}
+        self._peak_queued = 0
+        self._admitted = 0
+        self._enqueued = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._rejected = {"queue_full": 0, "shed": 0, "timeout": 0}
+
+    def _fits(self, flow: str) -> bool:
+        if self.limit > 0 and self._active >= self.limit:
+            return False
+        flow_limit = self.flow_limits.get(flow, 0)
+        return flow_limit <= 0 or self._active_by_flow.get(flow, 0) < flow_limit
+
+    def _take(self, flow: str):
+        self._active += 1
+        self._active_by_flow[flow] = self._active_by_flow.get(flow, 0) + 1
+        self._admitted += 1
+
+    def _release(self, flow: str):
+        self._active -= 1
+        self._active_by_flow[flow] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand freed slots to the best-ranked waiters whose flow limit allows it.
+        while self._queue:
+            eligible = [w for w in self._queue if self._fits(w.flow)]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: w.rank)
+            self._queue.remove(waiter)
+            self._take(waiter.flow)
+            waiter.granted = True
+            waiter.future.set_result(None)
+
+    def _rank(self, flow: str):
+        self._seq += 1
+        return (self.priority.get(flow, len(self.priority)), self._seq)
+
+    async def acquire(self, flow: str) -> Permit:
+        """
+        Wait for a slot for a `flow` request; raises AdmissionRejected.
+        """
+        if self._fits(flow):
+            self._take(flow)
+            return Permit(self, flow, 0.0)
+
+        rank = self._rank(flow)
+        if len(self._queue) >= self.queue_max:
+            worst = max(self._queue, key=lambda w: w.rank, default=None)
+            if worst is None or worst.rank[0] <= rank[0]:
+                self._rejected["queue_full"] += 1
+                raise AdmissionRejected("queue_full", flow)
+            self._queue.remove(worst)
+            self._rejected["shed"] += 1
+            worst.future.set_exception(AdmissionRejected("shed", worst.flow))
+
+        waiter = _Waiter(flow, rank, asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        self._enqueued += 1
+        self._peak_queued = max(self._peak_queued, len(self._queue))
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+        except asyncio.TimeoutError:
+            if not waiter.granted:
+                self._queue.remove(waiter)
+                self._rejected["timeout"] += 1
+                raise AdmissionRejected("timeout", flow) from None
+        except BaseException:
+            # Shed, or the client went away: a slot granted in the meantime goes back.
+            if waiter.granted:
+                self._release(flow)
+            elif waiter in self._queue:
+                self._queue.remove(waiter)
+            raise
+        waited = time.perf_counter() - started
+        self._waits += 1
+        self._wait_time += waited
+        return Permit(self, flow, waited)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self._active,
+            "queued": len(self._queue),
+            "peak_queued": self._peak_queued,
+            "admitted": self._admitted,
+            "enqueued": self._enqueued,
+            "admitted_after_wait": self._waits,
+            "avg_wait_ms": round(1000 * self._wait_time / self._waits, 1) if self._waits else 0.0,
+            **{f"rejected_{reason}": count for reason, count in self._rejected.items()},
+        }
+
+    def flow_stats(self) -> dict:
+        flows = set(self._active_by_flow) | set(self.flow_limits) | {w.flow for w in self._queue}
+        return {
+            flow: {
+                "limit": self.flow_limits.get(flow, 0),
+                "in_flight": self._active_by_flow.get(flow, 0),
+                "queued": sum(1 for w in self._queue if w.flow == flow),
+            }
+            for flow in sorted(flows)
+        }
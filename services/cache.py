@@ -0,0 +1,358 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE", "1") == "1"
+
+# How often (seconds) to ask SQLite whether another connection/process changed the DB.
+VERSION_CHECK_INTERVAL = float(os.getenv("CACHE_VERSION_CHECK_INTERVAL", "0.5"))
+
+# After a failed background rebuild of a DerivedIndex, wait this long (seconds) before trying again.
+DERIVED_INDEX_RETRY_S = float(os.getenv("DERIVED_INDEX_RETRY_S", "30"))
+
+log = logging.getLogger("pharmacy")
+
+
+class CachePolicy:
+    __slots__ = ("ttl", "maxsize")
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+
+def _policy(table: str, ttl: float, maxsize: int) -> CachePolicy:
+    return CachePolicy(
+        ttl=float(os.getenv(f"CACHE_TTL_{table.upper()}", ttl)),
+        maxsize=int(os.getenv(f"CACHE_SIZE_{table.upper()}", maxsize)),
+    )
+
+
+# Catalog and branch data rarely change; stock moves constantly.
+POLICIES = {
+    "medications": _policy("medications", 3600, 10_000),
+    "branches": _policy("branches", 3600, 1_000),
+    "inventory": _policy("inventory", 5, 10_000),
+    "users": _policy("users", 300, 50_000),
+    "prescriptions": _policy("prescriptions", 30, 50_000),
+}
+
+
+class _Versions:
+    """
+    Per-table change counters.
+
+    In-process writers bump the tables they touch via `invalidate()`. Changes made
+    by other connections/processes are picked up from SQLite's `PRAGMA data_version`
+    (polled at most every VERSION_CHECK_INTERVAL) and bump every table, since the
+    pragma can't tell which table changed. The service's own commits move the pragma
+    too, so the write connection polls right before a write and records the value
+    right after it (`poll_external_writes` / `skip_own_write`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {table: 0 for table in POLICIES}
+        self._probe = None
+        self._last_seen = None
+        self._last_check = 0.0
+
+    def set_probe(self, probe):
+        self._probe = probe
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._counters[table] = self._counters.get(table, 0) + 1
+
+    def _poll(self, now: float):
+        self._last_check = now
+        seen = self._probe()
+        if self._last_seen is not None and seen != self._last_seen:
+            for table in self._counters:
+                self._counters[table] += 1
+        self._last_seen = seen
+
+    def _check_external(self, force: bool = False):
+        now = time.monotonic()
+        if self._probe is None or (not force and now - self._last_check < VERSION_CHECK_INTERVAL):
+            return
+        with self._lock:
+            if force or now - self._last_check >= VERSION_CHECK_INTERVAL:
+                self._poll(now)
+
+    def skip_own_write(self):
+        if self._probe is None:
+            return
+        with self._lock:
+            self._last_seen = self._probe()
+
+    def get(self, tables) -> tuple:
+        self._check_external()
+        return self.peek(tables)
+
+    def peek(self, tables) -> tuple:
+        return tuple(self._counters.get(table, 0) for table in tables)
+
+
+_versions = _Versions()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after `ttl` seconds and are dropped
+    when the versions of the tables they were read from have moved on.
+    """
+
+    def __init__(self, name: str, policy: CachePolicy):
+        self.name = name
+        self.policy = policy
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        """
+        Return (True, value) on a fresh hit, (False, None) otherwise.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, entry_version, value = entry
+            if entry_version != version:
+                del self._data[key]
+                self.invalidations += 1
+                self.misses += 1
+                return False, None
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.policy.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.policy.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.policy.maxsize,
+                "ttl": self.policy.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+_caches = {}
+
+
+def cached_tool(policy: str, tables, normalize):
+    """
+    Put a TTL/LRU cache in front of a DB tool function.
+
+    `policy` picks the TTL/size from POLICIES, `tables` lists every table the
+    result is read from (used for invalidation), and `normalize(*args)` returns
+    the canonical argument tuple: it is both the cache key and what the wrapped
+    function is called with, so equivalent spellings share one entry.
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+    tables = tuple(tables)
+
+    def decorator(fn):
+        if not TOOL_CACHE_ENABLED:
+            return fn
+
+        cache = TTLCache(fn.__name__, POLICIES[policy])
+        _caches[fn.__name__] = cache
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            key = normalize(*args)
+            version = _versions.get(tables)
+            hit, value = cache.get(key, version)
+            if hit:
+                return value
+            value = fn(*key)
+            cache.set(key, version, value)
+            return value
+
+        wrapper.cache = cache
+        wrapper.tables = tables
+        return wrapper
+
+    return decorator
+
+
+def cached_batch(single, normalize):
+    """
+    Put the cache of the single-item tool `single` in front of its batch variant.
+
+    The decorated function takes a list of canonical keys (`normalize(item)`, the
+    same value `single` is keyed by) and must return a dict with an entry for every
+    key it was given. The wrapper takes raw items and returns results in their
+    order; only keys missing from the cache reach the decorated function.
+    """
+
+    def decorator(fn):
+        cache = getattr(single, "cache", None)
+        tables = getattr(single, "tables", ())
+
+        @functools.wraps(fn)
+        def wrapper(items):
+            keys = [normalize(item) for item in items]
+            unique = list(dict.fromkeys(keys))
+            if cache is None:
+                found = fn(unique) if unique else {}
+                return [found[key] for key in keys]
+
+            version = _versions.get(tables)
+            found = {}
+            missing = []
+            for key in unique:
+                hit, value = cache.get((key,), version)
+                if hit:
+                    found[key] = value
+                else:
+                    missing.append(key)
+            if missing:
+                loaded = fn(missing)
+                for key in missing:
+                    found[key] = loaded[key]
+                    cache.set((key,), version, loaded[key])
+            return [found[key] for key in keys]
+
+        return wrapper
+
+    return decorator
+
+
+def set_version_probe(probe):
+    """
+    Register a zero-arg callable returning SQLite's `PRAGMA data_version`.
+    """
+    _versions.set_probe(probe)
+
+
+def table_versions(*tables, poll: bool = False) -> tuple:
+    """
+    Current change counters of `tables` (all cached tables when none are given).
+    Without `poll` it doesn't ask SQLite about other processes' writes, so it is
+    cheap enough to call on the event loop.
+    """
+    tables = tables or tuple(POLICIES)
+    return _versions.get(tables) if poll else _versions.peek(tables)
+
+
+def poll_external_writes():
+    """
+    Pick up other connections' writes now, before an in-process write moves the pragma.
+    """
+    _versions._check_external(force=True)
+
+
+def skip_own_write():
+    """
+    Record that the pragma moved because of an in-process commit (whose tables
+    `invalidate()` bumps), not because of another writer.
+    """
+    _versions.skip_own_write()
+
+
+def invalidate(*tables):
+    """
+    Record an in-process write to `tables`; cached results read from them become stale.
+    """
+    _versions.bump(tables)
+
+
+class DerivedIndex:
+    """
+    An in-memory structure built from DB tables (a matcher, a spatial index) that
+    follows their change counters. The first `get()` builds it; once a table it was
+    built from changes, the current one keeps being served while its replacement is
+    built on a background thread and swapped in. A failed rebuild is logged and the
+    current one stays in service; the next attempt waits DERIVED_INDEX_RETRY_S.
+    """
+
+    def __init__(self, name: str, build, tables):
+        self.name = name
+        self.tables = tuple(tables)
+        self._build = build
+        self._value = None
+        self._versions = None
+        self._reloading = False
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.failures = 0
+
+    def _load(self):
+        # Versions are read first: a write racing the build leaves it stale, never wrong.
+        versions = _versions.peek(self.tables)
+        self._value = self._build()
+        self._versions = versions
+        self.builds += 1
+
+    def get(self):
+        value = self._value
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    self._load()
+                return self._value
+        if self._versions != _versions.peek(self.tables) and time.monotonic() >= self._retry_at:
+            self.reload()
+        return value
+
+    def reload(self):
+        """
+        Start a background rebuild unless one is already running.
+        """
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, name=f"{self.name}-reload", daemon=True).start()
+
+    def _reload(self):
+        try:
+            self._load()
+        except Exception:
+            self.failures += 1
+            self._retry_at = time.monotonic() + DERIVED_INDEX_RETRY_S
+            log.exception("%s rebuild failed; serving the previous one, retrying in %.0fs", self.name, DERIVED_INDEX_RETRY_S)
+        finally:
+            with self._lock:
+                self._reloading = False
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
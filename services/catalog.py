@@ -0,0 +1,278 @@
+"""
+Optional in-memory snapshot of the catalog tables (medications, branches, inventory).
+
+With CATALOG_SNAPSHOT=1 the medication and inventory tools answer from RAM instead
+of SQL, and prescription listings take their medication fields from it (users and
+prescriptions themselves are not snapshotted): hash indexes by id and by lower-cased English/Hebrew name, and the
+medication -> inventory adjacency stored CSR-style in flat arrays (one offset per
+medication, branch index and quantity per stock row, each medication's rows
+sorted by quantity descending like the SQL).
+
+A snapshot is immutable. It records the table versions it was read at; once those
+move on it is no longer served. An in-process inventory delta produces the next
+snapshot copy-on-write: medications, branches and indexes are shared, only the
+stock arrays are copied with the changed rows applied. Any other change (another
+process writing the DB, catalog tables) rebuilds the snapshot from the DB on a
+background thread. Either way the new snapshot is swapped in with a single
+reference assignment; until then lookups fall back to SQL, so they never wait on a reload.
+"""
+import os
+import threading
+import time
+from array import array
+
+from services.cache import table_versions
+
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "0") == "1"
+
+SNAPSHOT_TABLES = ("medications", "branches", "inventory")
+
+
+class Medication:
+    __slots__ = (
+        "id", "name_en", "name_he", "active_ingredients", "dosage_en", "dosage_he",
+        "prescription_required", "warnings_en", "warnings_he",
+    )
+
+    def __init__(self, row):
+        (self.id, self.name_en, self.name_he, self.active_ingredients, self.dosage_en,
+         self.dosage_he, self.prescription_required, self.warnings_en, self.warnings_he) = row
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name_en": self.name_en,
+            "name_he": self.name_he,
+            "active_ingredients": self.active_ingredients,
+            "dosage_en": self.dosage_en,
+            "dosage_he": self.dosage_he,
+            "prescription_required": bool(self.prescription_required),
+            "warnings_en": self.warnings_en,
+            "warnings_he": self.warnings_he,
+        }
+
+
+class Branch:
+    __slots__ = ("id", "name", "city", "hours")
+
+    def __init__(self, row):
+        self.id, self.name, self.city, self.hours = row[:4]
+
+
+class CatalogSnapshot:
+    __slots__ = (
+        "versions", "medications", "branches", "_by_id", "_by_name", "_branch_by_id",
+        "_offsets", "_stock_branch", "_stock_quantity", "built_at", "build_ms",
+    )
+
+    def __init__(self, medication_rows, branch_rows, inventory_rows, versions):
+        started = time.perf_counter()
+        self.versions = versions
+        self.medications = [Medication(r) for r in medication_rows]
+        self.branches = [Branch(r) for r in branch_rows]
+        self._by_id = {m.id: i for i, m in enumerate(self.medications)}
+        self._by_name = {}
+        # Rows come in id order; like the SQL's first match, the lowest id wins a name clash.
+        for i, m in enumerate(self.medications):
+            self._by_name.setdefault(m.name_en.strip().lower(), i)
+            self._by_name.setdefault(m.name_he.strip().lower(), i)
+
+        self._branch_by_id = {b.id: i for i, b in enumerate(self.branches)}
+        rows_per_med = [[] for _ in self.medications]
+        for branch_id, medication_id, quantity in inventory_rows:
+            med = self._by_id.get(medication_id)
+            branch = self._branch_by_id.get(branch_id)
+            if med is not None and branch is not None:
+                rows_per_med[med].append((quantity, branch))
+
+        self._offsets = array("q", [0])
+        self._stock_branch = array("q")
+        self._stock_quantity = array("q")
+        for rows in rows_per_med:
+            rows.sort(key=lambda r: r[0], reverse=True)
+            self._stock_branch.extend(branch for _, branch in rows)
+            self._stock_quantity.extend(quantity for quantity, _ in rows)
+            self._offsets.append(len(self._stock_branch))
+
+        self.built_at = time.time()
+        self.build_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def with_inventory(self, changes, versions):
+        """
+        The next snapshot after (medication_id, branch_id, quantity) changes, sharing
+        everything but the stock arrays. None if a change names an unknown id.
+        """
+        started = time.perf_counter()
+        updates = {}
+        for medication_id, branch_id, quantity in changes:
+            med = self._by_id.get(medication_id)
+            branch = self._branch_by_id.get(branch_id)
+            if med is None or branch is None:
+                return None
+            updates.setdefault(med, {})[branch] = quantity
+
+        stock_branch = array("q")
+        stock_quantity = array("q")
+        growth = {}
+        copied = 0
+        for med in sorted(updates):
+            start, end = self._offsets[med], self._offsets[med + 1]
+            # Untouched medications in between are copied as whole array slices.
+            stock_branch.extend(self._stock_branch[copied:start])
+            stock_quantity.extend(self._stock_quantity[copied:start])
+            rows = dict(zip(self._stock_branch[start:end], self._stock_quantity[start:end]))
+            rows.update(updates[med])
+            ordered = sorted(rows.items(), key=lambda r: r[1], reverse=True)
+            stock_branch.extend(branch for branch, _ in ordered)
+            stock_quantity.extend(quantity for _, quantity in ordered)
+            growth[med] = len(ordered) - (end - start)
+            copied = end
+        stock_branch.extend(self._stock_branch[copied:])
+        stock_quantity.extend(self._stock_quantity[copied:])
+
+        offsets = self._offsets
+        if any(growth.values()):
+            # New (branch, medication) rows shift the offsets of every later medication.
+            offsets = array("q", offsets)
+            shift = 0
+            for i in range(len(self.medications)):
+                shift += growth.get(i, 0)
+                offsets[i + 1] += shift
+
+        snapshot = CatalogSnapshot.__new__(CatalogSnapshot)
+        snapshot.versions = versions
+        snapshot.medications = self.medications
+        snapshot.branches = self.branches
+        snapshot._by_id = self._by_id
+        snapshot._by_name = self._by_name
+        snapshot._branch_by_id = self._branch_by_id
+        snapshot._offsets = offsets
+        snapshot._stock_branch = stock_branch
+        snapshot._stock_quantity = stock_quantity
+        snapshot.built_at = time.time()
+        snapshot.build_ms = round((time.perf_counter() - started) * 1000, 1)
+        return snapshot
+
+    def medication(self, medication_id: int):
+        i = self._by_id.get(int(medication_id))
+        return None if i is None else self.medications[i]
+
+    def medication_by_name(self, name: str):
+        i = self._by_name.get(name.strip().lower())
+        return None if i is None else self.medications[i].as_dict()
+
+    def inventory(self, medication_id: int):
+        i = self._by_id.get(int(medication_id))
+        if i is None:
+            return []
+        rows = []
+        for j in range(self._offsets[i], self._offsets[i + 1]):
+            b = self.branches[self._stock_branch[j]]
+            rows.append({
+                "branch_id": b.id,
+                "branch_name": b.name,
+                "city": b.city,
+                "hours": b.hours,
+                "quantity": self._stock_quantity[j],
+            })
+        return rows
+
+
+class CatalogStore:
+    """
+    Holds the current snapshot and rebuilds it in the background when it goes stale.
+    `load` returns (medication_rows, branch_rows, inventory_rows).
+    """
+
+    def __init__(self, load, enabled: bool = CATALOG_SNAPSHOT):
+        self.enabled = enabled
+        self._load = load
+        self._snapshot = None
+        self._reloading = False
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.patches = 0
+        self.served = 0
+        self.fallbacks = 0
+
+    def build(self) -> CatalogSnapshot:
+        """
+        Build a snapshot from the DB and swap it in (blocking; e.g. at startup).
+        """
+        # Versions are read first: a write racing the load leaves the snapshot stale, never wrong.
+        versions = table_versions(*SNAPSHOT_TABLES, poll=True)
+        snapshot = CatalogSnapshot(*self._load(), versions)
+        self._snapshot = snapshot
+        self.builds += 1
+        return snapshot
+
+    def apply_inventory(self, changes, versions_before, versions_after) -> bool:
+        """
+        Move the snapshot past an in-process inventory write without a reload: only
+        when it was current right before the write and the write moved nothing but
+        inventory. Returns False when a full reload is needed instead.
+        """
+        moved = [table for table, old, new in zip(SNAPSHOT_TABLES, versions_before, versions_after) if old != new]
+        if moved != ["inventory"]:
+            return False
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.versions != versions_before:
+                return False
+            patched = snapshot.with_inventory(changes, versions_after)
+            if patched is None:
+                return False
+            self._snapshot = patched
+            self.patches += 1
+        return True
+
+    def reload(self):
+        """
+        Start a background rebuild unless one is already running.
+        """
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, name="catalog-reload", daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.build()
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def current(self):
+        """
+        The snapshot if it is enabled and up to date, else None (the caller uses SQL).
+        """
+        if not self.enabled:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.versions != table_versions(*SNAPSHOT_TABLES, poll=True):
+            self.fallbacks += 1
+            self.reload()
+            return None
+        self.served += 1
+        return snapshot
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        stats = {
+            "enabled": int(self.enabled),
+            "builds": self.builds,
+            "patches": self.patches,
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "reloading": int(self._reloading),
+        }
+        if snapshot is not None:
+            stats.update(
+                medications=len(snapshot.medications),
+                branches=len(snapshot.branches),
+                stock_rows=len(snapshot._stock_branch),
+                build_ms=snapshot.build_ms,
+                age_s=round(time.time() - snapshot.built_at, 1),
+            )
+        return stats
@@ -1,40 +1,378 @@
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
-# points to: pharmacy-agent/data/pharmacy.db
-DB_PATH = Path(__file__).parent.parent / "data" / "pharmacy.db"
+from services.cache import (
+    cached_batch,
+    cached_tool,
+    invalidate,
+    poll_external_writes,
+    set_version_probe,
+    skip_own_write,
+    table_versions,
+)
+from services.catalog import SNAPSHOT_TABLES, CatalogStore
+
+# points to: pharmacy-agent/data/pharmacy.db (override with PHARMACY_DB_PATH, e.g. a generated DB)
+DB_PATH = Path(os.getenv("PHARMACY_DB_PATH", Path(__file__).parent.parent / "data" / "pharmacy.db")).resolve()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
 
 
 def get_connection():
     return sqlite3.connect(DB_PATH)
 
 
-def get_medication_by_name(name: str):
+def _open_read_connection():
     """
-    Search medication by English or Hebrew name (case-insensitive exact match).
-    Returns a dict or None.
+    Open a tuned, read-only connection to the pharmacy DB.
     """
-    conn = get_connection()
-    c = conn.cursor()
-
-    c.execute(
-        """
-        SELECT id, name_en, name_he, active_ingredients,
-               dosage_en, dosage_he, prescription_required,
-               warnings_en, warnings_he
-        FROM medications
-        WHERE LOWER(name_en) = LOWER(?)
-           OR LOWER(name_he) = LOWER(?)
-        """,
-        (name, name),
+    conn = sqlite3.connect(
+        f"{DB_PATH.as_uri()}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE,
     )
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
 
-    row = c.fetchone()
-    conn.close()
 
-    if not row:
-        return None
+def _enable_wal():
+    """
+    Switch the DB to WAL so pooled readers never block on (or block) a writer.
+    The journal mode is persistent, so this only does real work once.
+    """
+    try:
+        conn = get_connection()
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        # Read-only filesystem / image: keep whatever journal mode the file has.
+        pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only connections shared by all tool functions.
+
+    Connections are opened lazily up to `size`; when all of them are checked out,
+    callers wait up to `timeout` seconds for one to be returned.
+    Each connection keeps its own prepared-statement cache, so the tool queries
+    are parsed once per connection rather than once per call.
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = _open_read_connection()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No DB connection available after {self.timeout}s") from None
+                finally:
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_time += time.perf_counter() - started
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": self._opened - self._in_use,
+                "peak_in_use": self._peak_in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "avg_wait_ms": round(1000 * self._wait_time / self._waits, 3) if self._waits else 0.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _enable_wal()
+                _pool = ConnectionPool()
+    return _pool
+
+
+def read_connection():
+    """
+    Borrow a pooled read-only connection: `with read_connection() as conn: ...`
+    """
+    return get_pool().connection()
+
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+
+def warm_pool() -> int:
+    """
+    Startup warm-up: open every pooled connection, prepare the hot tool statements
+    on each, and read the catalog tables once so their pages are in the OS cache.
+    Returns the number of connections opened.
+    """
+    pool = get_pool()
+    conns = [pool._acquire() for _ in range(pool.size)]
+    try:
+        for conn in conns:
+            for sql, params in (
+                (_MEDICATION_BY_NAME_SQL, ("", "")),
+                (_INVENTORY_SQL, (0,)),
+                (_USER_BY_CONTACT_SQL, ("",)),
+                (_USER_PRESCRIPTIONS_SQL, (0,)),
+            ):
+                conn.execute(sql, params).fetchall()
+        for sql in (_CATALOG_MEDICATIONS_SQL, _BRANCHES_SQL, _CATALOG_INVENTORY_SQL):
+            conns[0].execute(sql).fetchall()
+    finally:
+        for conn in conns:
+            pool._release(conn)
+    return len(conns)
+
+
+_version_conn = None
+_version_lock = threading.Lock()
+
+
+def data_version() -> int:
+    """
+    SQLite's change counter for the DB file, as seen from a dedicated connection
+    that never writes: it moves whenever any other connection/process commits.
+    """
+    global _version_conn
+    with _version_lock:
+        if _version_conn is None:
+            _version_conn = _open_read_connection()
+        return _version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+set_version_probe(data_version)
+
+
+_write_conn = None
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def write_connection():
+    """
+    Serialized access to the service's single writable connection; the block runs
+    as one transaction (committed on success, rolled back on error). Callers bump
+    the tables they wrote with `invalidate()`; the commit itself is not mistaken for
+    an external write that would stale every cached table.
+    """
+    global _write_conn
+    with _write_lock:
+        if _write_conn is None:
+            _write_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _write_conn.execute("PRAGMA busy_timeout = 5000")
+        poll_external_writes()
+        with _write_conn:
+            yield _write_conn
+        skip_own_write()
+
+
+# Query text is kept constant so every pooled connection reuses its cached statement.
+_MEDICATION_BY_NAME_SQL = """
+    SELECT id, name_en, name_he, active_ingredients,
+           dosage_en, dosage_he, prescription_required,
+           warnings_en, warnings_he
+    FROM medications
+    WHERE LOWER(name_en) = LOWER(?)
+       OR LOWER(name_he) = LOWER(?)
+"""
+
+_MEDICATIONS_BY_NAMES_SQL = """
+    SELECT id, name_en, name_he, active_ingredients,
+           dosage_en, dosage_he, prescription_required,
+           warnings_en, warnings_he
+    FROM medications
+    WHERE LOWER(name_en) IN ({marks})
+       OR LOWER(name_he) IN ({marks})
+"""
+
+_MEDICATION_NAMES_SQL = """
+    SELECT id, name_en, name_he
+    FROM medications
+"""
+
+_BRANCHES_SQL = """
+    SELECT id, name, city, hours, latitude, longitude
+    FROM branches
+"""
+
+_INVENTORY_SQL = """
+    SELECT b.id, b.name, b.city, b.hours, i.quantity
+    FROM inventory i
+    JOIN branches b ON b.id = i.branch_id
+    WHERE i.medication_id = ?
+    ORDER BY i.quantity DESC
+"""
+
+_INVENTORY_MANY_SQL = """
+    SELECT i.medication_id, b.id, b.name, b.city, b.hours, i.quantity
+    FROM inventory i
+    JOIN branches b ON b.id = i.branch_id
+    WHERE i.medication_id IN ({marks})
+    ORDER BY i.medication_id, i.quantity DESC
+"""
+
+_APPLY_INVENTORY_DELTA_SQL = """
+    INSERT INTO inventory (branch_id, medication_id, quantity)
+    VALUES (?, ?, MAX(0, ?))
+    ON CONFLICT (branch_id, medication_id) DO UPDATE SET quantity = MAX(0, quantity + ?)
+    RETURNING quantity
+"""
+
+_CATALOG_MEDICATIONS_SQL = """
+    SELECT id, name_en, name_he, active_ingredients,
+           dosage_en, dosage_he, prescription_required,
+           warnings_en, warnings_he
+    FROM medications
+    ORDER BY id
+"""
+
+_CATALOG_INVENTORY_SQL = "SELECT branch_id, medication_id, quantity FROM inventory"
+
+_KNOWN_BRANCHES_SQL = "SELECT id FROM branches WHERE id IN ({marks})"
+_KNOWN_MEDICATIONS_SQL = "SELECT id FROM medications WHERE id IN ({marks})"
+
+# Stay well under SQLite's bound-parameter limit for IN (...) lists.
+MAX_IN_PARAMS = 500
+
+_USER_BY_CONTACT_SQL = """
+    SELECT id, full_name, contact, preferred_language
+    FROM users
+    WHERE contact_normalized = ?
+"""
+
+_UNNORMALIZED_CONTACTS_SQL = "SELECT id, contact FROM users WHERE contact_normalized IS NULL"
+# A contact that normalizes to an existing user's stays NULL rather than failing the lookup.
+_SET_CONTACT_NORMALIZED_SQL = "UPDATE OR IGNORE users SET contact_normalized = ? WHERE id = ?"
+
+_USER_PRESCRIPTIONS_SQL = """
+    SELECT p.id, p.status, p.refills_left,
+           m.id, m.name_en, m.name_he, m.prescription_required
+    FROM prescriptions p
+    JOIN medications m ON m.id = p.medication_id
+    WHERE p.user_id = ?
+"""
+
+_USER_PRESCRIPTION_ROWS_SQL = "SELECT id, status, refills_left, medication_id FROM prescriptions WHERE user_id = ?"
+
 
+def normalize_contact(raw: str) -> str:
+    """
+    Canonical form of a contact, as stored in users.contact_normalized: emails
+    trimmed and lower-cased; phones as local digits (050-123-4567, +972 50 123 4567
+    and 00972501234567 all become 0501234567).
+    """
+    raw = raw.strip()
+    if "@" in raw:
+        return raw.lower()
+    digits = re.sub(r"\D", "", raw)
+    if digits.startswith("00"):
+        digits = digits[2:]
+    if digits.startswith("972"):
+        digits = "0" + digits[3:]
+    return digits
+
+
+def backfill_contact_normalized(conn=None) -> int:
+    """
+    Fill users.contact_normalized for rows added or changed since the last
+    backfill (migration 5 makes SQL writers leave it NULL), with normalize_contact()
+    itself rather than a SQL approximation. Returns how many rows were filled.
+    """
+    if conn is not None:
+        rows = conn.execute(_UNNORMALIZED_CONTACTS_SQL).fetchall()
+        return conn.executemany(
+            _SET_CONTACT_NORMALIZED_SQL,
+            ((normalize_contact(contact), user_id) for user_id, contact in rows),
+        ).rowcount
+
+    with read_connection() as conn:
+        if not conn.execute(_UNNORMALIZED_CONTACTS_SQL).fetchone():
+            return 0
+    with write_connection() as conn:
+        filled = backfill_contact_normalized(conn)
+    if filled:
+        invalidate("users")
+    return filled
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _medication_row(row) -> dict:
     return {
         "id": row[0],
         "name_en": row[1],
@@ -48,57 +386,165 @@ def get_medication_by_name(name: str):
     }
 
 
+def _inventory_row(r) -> dict:
+    return {
+        "branch_id": r[0],
+        "branch_name": r[1],
+        "city": r[2],
+        "hours": r[3],
+        "quantity": r[4],
+    }
+
+
+def _load_catalog():
+    with read_connection() as conn:
+        return (
+            conn.execute(_CATALOG_MEDICATIONS_SQL).fetchall(),
+            conn.execute(_BRANCHES_SQL).fetchall(),
+            conn.execute(_CATALOG_INVENTORY_SQL).fetchall(),
+        )
+
+
+# In-memory catalog/inventory snapshot (CATALOG_SNAPSHOT=1); see services/catalog.py.
+catalog_store = CatalogStore(_load_catalog)
+
+
+@cached_tool("medications", tables=("medications",), normalize=lambda name: (name.strip().lower(),))
+def get_medication_by_name(name: str):
+    """
+    Search medication by English or Hebrew name (case-insensitive exact match).
+    Returns a dict or None.
+    """
+    snapshot = catalog_store.current()
+    if snapshot is not None:
+        return snapshot.medication_by_name(name)
+
+    with read_connection() as conn:
+        row = conn.execute(_MEDICATION_BY_NAME_SQL, (name, name)).fetchone()
+
+    if not row:
+        return None
+
+    return _medication_row(row)
+
+
+@cached_batch(get_medication_by_name, normalize=lambda name: name.strip().lower())
+def get_medications_by_names(names):
+    """
+    Batch variant of get_medication_by_name: one IN (...) query for all names.
+    Returns one dict or None per requested name, in request order.
+    """
+    snapshot = catalog_store.current()
+    if snapshot is not None:
+        return {name: snapshot.medication_by_name(name) for name in names}
+
+    found = dict.fromkeys(names)
+    with read_connection() as conn:
+        for chunk in _chunks(names, MAX_IN_PARAMS // 2):
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(_MEDICATIONS_BY_NAMES_SQL.format(marks=marks), chunk + chunk).fetchall()
+            for row in rows:
+                for name in (row[1].lower(), row[2].lower()):
+                    if name in found:
+                        found[name] = _medication_row(row)
+    return found
+
+
+def list_medication_names():
+    """
+    Return (id, name_en, name_he) for every medication in the catalog.
+    """
+    with read_connection() as conn:
+        return conn.execute(_MEDICATION_NAMES_SQL).fetchall()
+
+
+def list_branches():
+    """
+    Return (id, name, city, hours, latitude, longitude) for every branch.
+    """
+    with read_connection() as conn:
+        return conn.execute(_BRANCHES_SQL).fetchall()
+
+
+@cached_tool("inventory", tables=("inventory", "branches"), normalize=lambda medication_id: (int(medication_id),))
 def check_inventory(medication_id: int):
     """
     Returns inventory across all branches for a medication_id.
     """
-    conn = get_connection()
-    c = conn.cursor()
-
-    c.execute(
-        """
-        SELECT b.id, b.name, b.city, b.hours, i.quantity
-        FROM inventory i
-        JOIN branches b ON b.id = i.branch_id
-        WHERE i.medication_id = ?
-        ORDER BY i.quantity DESC
-        """,
-        (medication_id,),
-    )
+    snapshot = catalog_store.current()
+    if snapshot is not None:
+        return snapshot.inventory(medication_id)
 
-    rows = c.fetchall()
-    conn.close()
+    with read_connection() as conn:
+        rows = conn.execute(_INVENTORY_SQL, (medication_id,)).fetchall()
 
-    return [
-        {
-            "branch_id": r[0],
-            "branch_name": r[1],
-            "city": r[2],
-            "hours": r[3],
-            "quantity": r[4],
-        }
-        for r in rows
-    ]
+    return [_inventory_row(r) for r in rows]
 
 
-def get_user_by_contact(contact: str):
+@cached_batch(check_inventory, normalize=int)
+def check_inventory_many(medication_ids):
     """
-    Lookup a user by contact (phone or email). Returns dict or None.
+    Batch variant of check_inventory: one IN (...) query for all ids.
+    Returns one branch list per requested id, in request order.
     """
-    conn = get_connection()
-    c = conn.cursor()
+    snapshot = catalog_store.current()
+    if snapshot is not None:
+        return {medication_id: snapshot.inventory(medication_id) for medication_id in medication_ids}
 
-    c.execute(
-        """
-        SELECT id, full_name, contact, preferred_language
-        FROM users
-        WHERE contact = ?
-        """,
-        (contact,),
-    )
+    found = {medication_id: [] for medication_id in medication_ids}
+    with read_connection() as conn:
+        for chunk in _chunks(medication_ids, MAX_IN_PARAMS):
+            marks = ",".join("?" * len(chunk))
+            for r in conn.execute(_INVENTORY_MANY_SQL.format(marks=marks), chunk):
+                found[r[0]].append(_inventory_row(r[1:]))
+    return found
+
+
+def _missing_ids(conn, sql, ids):
+    ids = list(set(ids))
+    known = set()
+    for chunk in _chunks(ids, MAX_IN_PARAMS):
+        known.update(r[0] for r in conn.execute(sql.format(marks=",".join("?" * len(chunk))), chunk))
+    return sorted(set(ids) - known)
+
+
+def apply_inventory_deltas(deltas):
+    """
+    Apply (branch_id, medication_id, delta) stock changes in one transaction;
+    quantities never go below zero. Returns (medication_id, branch_id, new_quantity)
+    per delta, in order. Raises ValueError for unknown branches/medications.
+    """
+    with write_connection() as conn:
+        before = table_versions(*SNAPSHOT_TABLES)
+        for sql, ids, label in (
+            (_KNOWN_BRANCHES_SQL, [d[0] for d in deltas], "branch"),
+            (_KNOWN_MEDICATIONS_SQL, [d[1] for d in deltas], "medication"),
+        ):
+            missing = _missing_ids(conn, sql, ids)
+            if missing:
+                raise ValueError(f"Unknown {label} id(s): {missing}")
+        changes = [
+            (medication_id, branch_id, conn.execute(_APPLY_INVENTORY_DELTA_SQL, (branch_id, medication_id, delta, delta)).fetchone()[0])
+            for branch_id, medication_id, delta in deltas
+        ]
+    invalidate("inventory")
+    if catalog_store.enabled and not catalog_store.apply_inventory(changes, before, table_versions(*SNAPSHOT_TABLES)):
+        catalog_store.reload()
+    return changes
+
+
+@cached_tool("users", tables=("users",), normalize=lambda contact: (normalize_contact(contact),))
+def get_user_by_contact(contact: str):
+    """
+    Lookup a user by contact (phone or email, any common formatting). Returns dict or None.
+    """
+    with read_connection() as conn:
+        row = conn.execute(_USER_BY_CONTACT_SQL, (normalize_contact(contact),)).fetchone()
 
-    row = c.fetchone()
-    conn.close()
+    if not row and backfill_contact_normalized():
+        # The user may have been added by a writer that leaves contact_normalized NULL.
+        with read_connection() as conn:
+            row = conn.execute(_USER_BY_CONTACT_SQL, (normalize_contact(contact),)).fetchone()
 
     if not row:
         return None
@@ -111,26 +557,27 @@ def get_user_by_contact(contact: str):
     }
 
 
+@cached_tool("prescriptions", tables=("prescriptions", "medications"), normalize=lambda user_id: (int(user_id),))
 def list_user_prescriptions(user_id: int):
     """
     List prescriptions for a user, joined with medication details.
     """
-    conn = get_connection()
-    c = conn.cursor()
-
-    c.execute(
-        """
-        SELECT p.id, p.status, p.refills_left,
-               m.id, m.name_en, m.name_he, m.prescription_required
-        FROM prescriptions p
-        JOIN medications m ON m.id = p.medication_id
-        WHERE p.user_id = ?
-        """,
-        (user_id,),
-    )
-
-    rows = c.fetchall()
-    conn.close()
+    snapshot = catalog_store.current()
+    if snapshot is not None:
+        # Only the prescription rows come from SQL; the join is a snapshot lookup.
+        with read_connection() as conn:
+            prescriptions = conn.execute(_USER_PRESCRIPTION_ROWS_SQL, (user_id,)).fetchall()
+        rows = []
+        for prescription_id, status, refills_left, medication_id in prescriptions:
+            med = snapshot.medication(medication_id)
+            if med is not None:
+                rows.append((
+                    prescription_id, status, refills_left,
+                    med.id, med.name_en, med.name_he, med.prescription_required,
+                ))
+    else:
+        with read_connection() as conn:
+            rows = conn.execute(_USER_PRESCRIPTIONS_SQL, (user_id,)).fetchall()
 
     return [
         {
@@ -0,0 +1,111 @@
+import re
+
+from services.cache import DerivedIndex
+from services.db import list_medication_names, normalize_contact
+
+# Israeli phone numbers as users type them: 0501234567, 050-123-4567, +972 50 123 4567, 03-1234567
+PHONE_RE = re.compile(r"(?<![\d+])(?:\+?972[-\s]?|0)(?:5\d|[2-489]|7\d)(?:[-\s]?\d){7}(?!\d)")
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+# Words in either language (Latin letters/digits or Hebrew letters, incl. niqqud marks)
+WORD_RE = re.compile("[a-z0-9]+(?:[-'][a-z0-9]+)*|[\u0590-\u05FF]+")
+
+NIQQUD_RE = re.compile("[\u0591-\u05C7]")
+HEBREW_FINAL_FORMS = str.maketrans("ךםןףץ", "כמנפצ")
+
+# Hebrew one-letter prefixes (and, the, in, to, from, that, as) that attach to a name: "לאמוקסיצילין"
+HEBREW_PREFIXES = "והבלמשכ"
+MAX_HEBREW_PREFIX = 3
+
+
+def extract_contact(text: str):
+    """
+    Return the single phone/email mentioned in `text`, or None when there is none
+    or more than one (the caller should fall back to the LLM in that case).
+    """
+    found = {normalize_contact(m.group(0).rstrip(".")) for m in EMAIL_RE.finditer(text)}
+    found |= {normalize_contact(m.group(0)) for m in PHONE_RE.finditer(text)}
+    if len(found) != 1:
+        return None
+    return found.pop()
+
+
+def normalize_hebrew(text: str) -> str:
+    """
+    Strip niqqud and map final letter forms (ך ם ן ף ץ) to their regular forms.
+    """
+    return NIQQUD_RE.sub("", text).translate(HEBREW_FINAL_FORMS)
+
+
+def _is_hebrew(word: str) -> bool:
+    return "א" <= word[0] <= "ת"
+
+
+class MedicationMatcher:
+    """
+    Dictionary matcher over the medication catalog (English and Hebrew names).
+
+    Names are indexed as tuples of normalized words, so a lookup is a handful of
+    dict probes per word of the message regardless of catalog size.
+    """
+
+    def __init__(self, rows):
+        self._index = {}
+        self.max_words = 1
+        for med_id, name_en, name_he in rows:
+            for name in (name_en, name_he):
+                key = tuple(normalize_hebrew(w) for w in WORD_RE.findall(name.lower()))
+                if not key:
+                    continue
+                self._index.setdefault(key, set()).add((med_id, name_en))
+                self.max_words = max(self.max_words, len(key))
+
+    def _candidates(self, words, i, n):
+        key = tuple(words[i:i + n])
+        yield key
+        first = key[0]
+        if _is_hebrew(first):
+            for cut in range(1, min(MAX_HEBREW_PREFIX, len(first) - 1) + 1):
+                if first[cut - 1] not in HEBREW_PREFIXES:
+                    break
+                yield (first[cut:],) + key[1:]
+
+    def find(self, text: str):
+        """
+        Return {medication_id: name_en} for every catalog name mentioned in `text`.
+        """
+        words = [normalize_hebrew(w) for w in WORD_RE.findall(text.lower())]
+        found = {}
+        i = 0
+        while i < len(words):
+            matched = 0
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                for key in self._candidates(words, i, n):
+                    hits = self._index.get(key)
+                    if hits:
+                        found.update(hits)
+                        matched = n
+                        break
+                if matched:
+                    break
+            i += matched or 1
+        return found
+
+
+# Rebuilt in the background when the catalog changes, so new SKUs are matched locally too.
+_matcher = DerivedIndex("medication-matcher", lambda: MedicationMatcher(list_medication_names()), ("medications",))
+
+
+def get_matcher() -> MedicationMatcher:
+    return _matcher.get()
+
+
+def extract_medication_name(text: str):
+    """
+    Return the English catalog name of the single medication mentioned in `text`,
+    or None when there is none or it is ambiguous (the caller should fall back to the LLM).
+    """
+    found = get_matcher().find(text)
+    if len(found) != 1:
+        return None
+    return next(iter(found.values()))
@@ -0,0 +1,217 @@
+"""
+Branch locations: an in-memory k-d tree over branch coordinates and the
+"k nearest branches with at least N units" lookup used by the stock flow.
+
+Coordinates are projected onto a flat plane in kilometres (equirectangular
+around Israel's mid latitude); over the distances involved the error is well
+under 1%, and it keeps every distance check to a few multiplications.
+"""
+import heapq
+import math
+
+from services.cache import DerivedIndex
+from services.db import check_inventory, list_branches
+from services.extractor import MedicationMatcher
+
+KM_PER_DEGREE = 111.32
+REFERENCE_LATITUDE = 31.5
+_LON_SCALE = math.cos(math.radians(REFERENCE_LATITUDE))
+
+# Below this share of branches holding enough stock, scanning the stocked branches
+# directly beats walking the tree (which has to skip every branch without stock).
+BRUTE_FORCE_SHARE = 0.05
+
+CITY_NAMES_HE = {
+    "Tel Aviv": "תל אביב",
+    "Jerusalem": "ירושלים",
+    "Haifa": "חיפה",
+    "Ramat Gan": "רמת גן",
+    "Beer Sheva": "באר שבע",
+    "Netanya": "נתניה",
+    "Holon": "חולון",
+    "Rishon LeZion": "ראשון לציון",
+    "Petah Tikva": "פתח תקווה",
+    "Ashdod": "אשדוד",
+    "Herzliya": "הרצליה",
+    "Eilat": "אילת",
+    "Nazareth": "נצרת",
+    "Tiberias": "טבריה",
+    "Modiin": "מודיעין",
+    "Kfar Saba": "כפר סבא",
+}
+
+
+# City centers, used to place branches of DBs seeded before branches had coordinates.
+CITY_CENTERS = {
+    "Tel Aviv": (32.0853, 34.7818),
+    "Jerusalem": (31.7683, 35.2137),
+    "Haifa": (32.7940, 34.9896),
+    "Ramat Gan": (32.0684, 34.8248),
+    "Beer Sheva": (31.2520, 34.7915),
+    "Netanya": (32.3215, 34.8532),
+    "Holon": (32.0158, 34.7874),
+    "Rishon LeZion": (31.9730, 34.7925),
+    "Petah Tikva": (32.0840, 34.8878),
+    "Ashdod": (31.8044, 34.6553),
+    "Herzliya": (32.1624, 34.8447),
+    "Eilat": (29.5577, 34.9519),
+    "Nazareth": (32.6996, 35.3035),
+    "Tiberias": (32.7922, 35.5312),
+    "Modiin": (31.8980, 35.0104),
+    "Kfar Saba": (32.1782, 34.9076),
+}
+
+
+def project(lat: float, lon: float):
+    return lon * KM_PER_DEGREE * _LON_SCALE, lat * KM_PER_DEGREE
+
+
+def _build(points, depth):
+    if not points:
+        return None
+    axis = depth % 2
+    points.sort(key=lambda p: p[axis])
+    mid = len(points) // 2
+    x, y, branch_id = points[mid]
+    return (
+        x, y, branch_id, axis,
+        _build(points[:mid], depth + 1),
+        _build(points[mid + 1:], depth + 1),
+    )
+
+
+class BranchIndex:
+    """
+    2-d tree over branch positions plus per-city centroids (for "near Haifa" queries).
+
+    Nodes are plain tuples (x, y, branch_id, axis, left, right).
+    """
+
+    def __init__(self, rows):
+        self.branches = {}
+        self._points = {}
+        city_points = {}
+        points = []
+        for branch_id, name, city, hours, lat, lon in rows:
+            self.branches[branch_id] = {"branch_id": branch_id, "branch_name": name, "city": city, "hours": hours}
+            if lat is None or lon is None:
+                # Unknown location (a city the coordinates migration couldn't place): not searchable by distance.
+                continue
+            x, y = project(lat, lon)
+            self._points[branch_id] = (x, y)
+            points.append((x, y, branch_id))
+            city_points.setdefault(city, []).append((lat, lon))
+
+        self._root = _build(points, 0)
+        self.cities = {
+            city: (sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts))
+            for city, pts in city_points.items()
+        }
+        # Same word-tuple / Hebrew-prefix matching as the medication catalog.
+        names = sorted(self.cities)
+        self._city_names = names
+        self._city_matcher = MedicationMatcher(
+            (i, city, CITY_NAMES_HE.get(city, city)) for i, city in enumerate(names)
+        )
+
+    def find_city(self, text: str):
+        """
+        Return the branch city mentioned in `text` (English or Hebrew), or None if none/ambiguous.
+        """
+        found = self._city_matcher.find(text)
+        if len(found) != 1:
+            return None
+        return next(iter(found.values()))
+
+    def city_location(self, city: str):
+        """
+        (lat, lon) of a city's branches centroid, by English or Hebrew name; None if unknown.
+        """
+        return self.cities.get(self.find_city(city) or city)
+
+    def nearest(self, lat: float, lon: float, k: int, accept=None):
+        """
+        Return [(distance_km, branch_id)] for the k nearest branches passing `accept(branch_id)`.
+        """
+        qx, qy = project(lat, lon)
+        heap = []
+        self._search(self._root, qx, qy, k, accept, heap)
+        return sorted((math.sqrt(-d2), branch_id) for d2, branch_id in heap)
+
+    def nearest_among(self, lat: float, lon: float, k: int, branch_ids):
+        """
+        Same as nearest(), restricted to `branch_ids` by scanning them directly.
+        """
+        qx, qy = project(lat, lon)
+        points = self._points
+        dists = []
+        for branch_id in branch_ids:
+            p = points.get(branch_id)
+            if p is not None:
+                dists.append(((p[0] - qx) ** 2 + (p[1] - qy) ** 2, branch_id))
+        return [(math.sqrt(d2), branch_id) for d2, branch_id in heapq.nsmallest(k, dists)]
+
+    def _search(self, node, qx, qy, k, accept, heap):
+        if node is None:
+            return
+        x, y, branch_id, axis, left, right = node
+        diff = (qx - x) if axis == 0 else (qy - y)
+        near, far = (left, right) if diff < 0 else (right, left)
+
+        self._search(near, qx, qy, k, accept, heap)
+        if accept is None or accept(branch_id):
+            d2 = (qx - x) ** 2 + (qy - y) ** 2
+            if len(heap) < k:
+                heapq.heappush(heap, (-d2, branch_id))
+            elif d2 < -heap[0][0]:
+                heapq.heapreplace(heap, (-d2, branch_id))
+        # The far side can only hold a closer point if the splitting line is within the current k-th distance.
+        if len(heap) < k or diff * diff < -heap[0][0]:
+            self._search(far, qx, qy, k, accept, heap)
+
+
+# Rebuilt in the background when branches are added or moved.
+_index = DerivedIndex("branch-index", lambda: BranchIndex(list_branches()), ("branches",))
+
+
+def get_branch_index() -> BranchIndex:
+    return _index.get()
+
+
+def extract_city(text: str):
+    """
+    Return the branch city mentioned in `text`, or None.
+    """
+    return get_branch_index().find_city(text)
+
+
+def find_nearest_branches(medication_id: int, city: str = None, latitude: float = None,
+                          longitude: float = None, min_quantity: int = 1, k: int = 3):
+    """
+    The k branches nearest to a city or coordinates that hold at least `min_quantity`
+    units of the medication, nearest first, each with its quantity and distance_km.
+    """
+    # k and min_quantity come straight from model tool arguments.
+    k = max(1, int(k))
+    min_quantity = max(1, int(min_quantity))
+    index = get_branch_index()
+    if latitude is None or longitude is None:
+        location = index.city_location(city) if city else None
+        if location is None:
+            return {"error": f"Unknown location: {city or 'none given'}"}
+        latitude, longitude = location
+
+    stock = {
+        r["branch_id"]: r["quantity"]
+        for r in check_inventory(int(medication_id))
+        if r["quantity"] >= min_quantity
+    }
+    if len(stock) < BRUTE_FORCE_SHARE * len(index.branches):
+        hits = index.nearest_among(latitude, longitude, k, stock)
+    else:
+        hits = index.nearest(latitude, longitude, k, stock.__contains__)
+
+    return [
+        {**index.branches[branch_id], "quantity": stock[branch_id], "distance_km": round(distance, 1)}
+        for distance, branch_id in hits
+    ]
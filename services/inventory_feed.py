@@ -0,0 +1,130 @@
+"""
+In-process pub/sub for inventory changes, behind GET /inventory/{medication_id}/stream.
+
+Writers publish absolute quantities per (medication, branch). Each subscriber keeps
+only the latest pending quantity per branch, so a burst of updates coalesces into
+one event and a slow client costs at most one entry per branch instead of an
+unbounded queue. A publish is one hop onto the event loop plus a dict update per
+watcher of that medication; nobody polls the DB.
+"""
+import asyncio
+import os
+import threading
+
+from services.db import apply_inventory_deltas
+
+FEED_COALESCE_SECONDS = float(os.getenv("FEED_COALESCE_MS", "250")) / 1000
+FEED_HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", "15"))
+FEED_MAX_SUBSCRIBERS = int(os.getenv("FEED_MAX_SUBSCRIBERS", "10000"))
+
+
+class Subscription:
+    __slots__ = ("medication_id", "pending", "event")
+
+    def __init__(self, medication_id: int):
+        self.medication_id = medication_id
+        self.pending = {}
+        self.event = asyncio.Event()
+
+
+class InventoryFeed:
+    def __init__(self):
+        self._topics = {}
+        self._loop = None
+        self._lock = threading.Lock()
+        self.subscribers = 0
+        self.published = 0
+        self.deliveries = 0
+        self.coalesced = 0
+        self.events = 0
+
+    def full(self) -> bool:
+        return self.subscribers >= FEED_MAX_SUBSCRIBERS
+
+    def subscribe(self, medication_id: int) -> Subscription:
+        """
+        Register a watcher for one medication. Must be called on the event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        sub = Subscription(medication_id)
+        self._topics.setdefault(medication_id, set()).add(sub)
+        self.subscribers += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._topics.get(sub.medication_id)
+        if subs is not None and sub in subs:
+            subs.discard(sub)
+            self.subscribers -= 1
+            if not subs:
+                del self._topics[sub.medication_id]
+
+    def publish(self, changes):
+        """
+        Publish (medication_id, branch_id, quantity) changes. Safe to call from any thread.
+        """
+        grouped = {}
+        for medication_id, branch_id, quantity in changes:
+            grouped.setdefault(medication_id, {})[branch_id] = quantity
+        with self._lock:
+            self.published += len(changes)
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, grouped)
+
+    def _fan_out(self, grouped):
+        for medication_id, updates in grouped.items():
+            for sub in self._topics.get(medication_id, ()):
+                before = len(sub.pending)
+                sub.pending.update(updates)
+                self.coalesced += before + len(updates) - len(sub.pending)
+                self.deliveries += 1
+                sub.event.set()
+
+    async def updates(self, sub: Subscription):
+        """
+        Yield {branch_id: quantity} batches for `sub` (None on heartbeat ticks);
+        unsubscribes when the consumer goes away.
+        """
+        try:
+            while True:
+                if not sub.event.is_set():
+                    try:
+                        # asyncio.timeout, unlike wait_for, doesn't wrap the wait in a new task.
+                        async with asyncio.timeout(FEED_HEARTBEAT_SECONDS):
+                            await sub.event.wait()
+                    except TimeoutError:
+                        yield None
+                        continue
+                # Let a burst settle so it goes out as one event.
+                if FEED_COALESCE_SECONDS:
+                    await asyncio.sleep(FEED_COALESCE_SECONDS)
+                sub.event.clear()
+                pending, sub.pending = sub.pending, {}
+                self.events += 1
+                yield pending
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "topics": len(self._topics),
+            "published": self.published,
+            "deliveries": self.deliveries,
+            "coalesced": self.coalesced,
+            "events": self.events,
+        }
+
+
+inventory_feed = InventoryFeed()
+
+
+def update_inventory(deltas):
+    """
+    Apply (branch_id, medication_id, delta) stock changes and publish the new quantities.
+    Returns (medication_id, branch_id, quantity) per delta.
+    """
+    changes = apply_inventory_deltas(deltas)
+    inventory_feed.publish(changes)
+    return changes
@@ -0,0 +1,184 @@
+"""
+Schema migrations for the pharmacy DB, applied in order at startup.
+
+`PRAGMA user_version` records how many have run, so each step runs once per DB
+file (fresh DBs from data/seed_db.py or data/generate_db.py start at 0). Every
+pending step runs inside one BEGIN IMMEDIATE transaction together with the
+version bump, so a failed step leaves the file as it was.
+"""
+from services.db import backfill_contact_normalized, normalize_contact, write_connection
+
+
+def _indexes_and_normalized_contact(conn):
+    """
+    Index every tool lookup, and add users.contact_normalized (unique) so contact
+    lookups don't depend on how the phone/email was typed or stored.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "contact_normalized" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN contact_normalized TEXT")
+    conn.executemany(
+        "UPDATE users SET contact_normalized = ? WHERE id = ?",
+        ((normalize_contact(contact), user_id) for user_id, contact in conn.execute("SELECT id, contact FROM users").fetchall()),
+    )
+    duplicates = conn.execute(
+        """
+        SELECT contact_normalized, GROUP_CONCAT(id)
+        FROM users
+        GROUP BY contact_normalized
+        HAVING COUNT(*) > 1
+        LIMIT 10
+        """
+    ).fetchall()
+    if duplicates:
+        raise ValueError(f"Users share a contact after normalization: {duplicates}")
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_contact_normalized ON users (contact_normalized)")
+    conn.execute("CREATE INDEX IF NOT EXISTS prescriptions_user_id ON prescriptions (user_id)")
+    # The primary key leads with branch_id; this one serves "stock of X everywhere", already in quantity order.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS inventory_medication_quantity ON inventory (medication_id, quantity DESC, branch_id)"
+    )
+    # Expression indexes matching the LOWER(...) = LOWER(?) lookups.
+    conn.execute("CREATE INDEX IF NOT EXISTS medications_name_en_lower ON medications (LOWER(name_en))")
+    conn.execute("CREATE INDEX IF NOT EXISTS medications_name_he_lower ON medications (LOWER(name_he))")
+
+
+def _contact_normalized_sql(column: str) -> str:
+    """
+    normalize_contact() as a SQL expression, so triggers work for every writer (the
+    seed scripts, the sqlite3 shell), not only connections that registered a function.
+    Phones drop the usual separators rather than every non-digit.
+    """
+    digits = f"trim({column})"
+    for separator in (" ", "-", "+", "(", ")", ".", "/"):
+        digits = f"replace({digits}, '{separator}', '')"
+    local = f"(CASE WHEN {digits} LIKE '00%' THEN substr({digits}, 3) ELSE {digits} END)"
+    return (
+        f"CASE WHEN instr({column}, '@') > 0 THEN lower(trim({column})) "
+        f"WHEN {local} LIKE '972%' THEN '0' || substr({local}, 4) "
+        f"ELSE {local} END"
+    )
+
+
+def _normalize_contact_on_write(conn):
+    """
+    Keep users.contact_normalized filled for users added or changed after the
+    previous step, which only backfilled the rows present when it ran.
+    """
+    expression = _contact_normalized_sql("NEW.contact")
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS users_contact_normalized_insert
+        AFTER INSERT ON users WHEN NEW.contact_normalized IS NULL
+        BEGIN
+            UPDATE users SET contact_normalized = {expression} WHERE id = NEW.id;
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS users_contact_normalized_update
+        AFTER UPDATE OF contact ON users
+        BEGIN
+            UPDATE users SET contact_normalized = {expression} WHERE id = NEW.id;
+        END
+        """
+    )
+    conn.executemany(
+        "UPDATE users SET contact_normalized = ? WHERE id = ?",
+        (
+            (normalize_contact(contact), user_id)
+            for user_id, contact in conn.execute(
+                "SELECT id, contact FROM users WHERE contact_normalized IS NULL"
+            ).fetchall()
+        ),
+    )
+
+
+def _refill_requests(conn):
+    """
+    The refill_requests table (with its unique idempotency key) for DBs seeded
+    before refill submissions were recorded; fresh DBs get it from schema.sql.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS refill_requests (
+            id INTEGER PRIMARY KEY,
+            prescription_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            status TEXT NOT NULL,
+            refills_left_after INTEGER NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+
+
+def _branch_coordinates(conn):
+    """
+    branches.latitude/longitude for DBs seeded before nearest-branch search: each
+    branch is placed at its city's center (services/geo.py CITY_CENTERS, by English
+    or Hebrew city name). Branches in other cities keep NULL and are left out of
+    distance searches. Re-seeding gives every branch its real position.
+    """
+    from services.geo import CITY_CENTERS, CITY_NAMES_HE
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(branches)")}
+    for column in ("latitude", "longitude"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE branches ADD COLUMN {column} REAL")
+    for city, (lat, lon) in CITY_CENTERS.items():
+        conn.execute(
+            "UPDATE branches SET latitude = ?, longitude = ? WHERE latitude IS NULL AND city IN (?, ?)",
+            (lat, lon, city, CITY_NAMES_HE.get(city, city)),
+        )
+
+
+def _normalize_contact_in_python(conn):
+    """
+    Replace the previous step's SQL normalization, which only dropped common
+    separators and so disagreed with normalize_contact() on other characters.
+    Writers now leave contact_normalized NULL (a changed contact resets it) and
+    backfill_contact_normalized() fills it from Python: at startup, and when a
+    contact lookup misses.
+    """
+    conn.execute("DROP TRIGGER IF EXISTS users_contact_normalized_insert")
+    conn.execute("DROP TRIGGER IF EXISTS users_contact_normalized_update")
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS users_contact_normalized_reset
+        AFTER UPDATE OF contact ON users
+        BEGIN
+            UPDATE users SET contact_normalized = NULL WHERE id = NEW.id;
+        END
+        """
+    )
+    # Rows the SQL triggers filled are recomputed.
+    conn.execute("UPDATE users SET contact_normalized = NULL")
+    backfill_contact_normalized(conn)
+
+
+MIGRATIONS = [
+    _indexes_and_normalized_contact,
+    _normalize_contact_on_write,
+    _refill_requests,
+    _branch_coordinates,
+    _normalize_contact_in_python,
+]
+
+
+def migrate() -> int:
+    """
+    Apply pending migrations; returns the schema version the DB is at afterwards.
+    """
+    with write_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(conn)
+            version += 1
+        conn.execute(f"PRAGMA user_version = {version}")
+        backfill_contact_normalized(conn)
+    return version
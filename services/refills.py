@@ -0,0 +1,153 @@
+"""
+Refill submissions: an atomic conditional decrement of `prescriptions.refills_left`
+plus a `refill_requests` row, written by a single writer thread that group-commits.
+
+Callers enqueue a job and wait on a future. The writer drains whatever queued up
+while the previous commit was in flight and applies the whole batch in one
+transaction (one fsync), each job inside its own savepoint so one failure doesn't
+undo the others. Futures resolve only after the commit. A repeated idempotency key
+returns the stored result instead of decrementing again.
+"""
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from services.cache import invalidate
+from services.db import write_connection
+
+REFILL_BATCH_MAX = int(os.getenv("REFILL_BATCH_MAX", "128"))
+
+_REFILL_BY_KEY_SQL = """
+    SELECT id, prescription_id, refills_left_after
+    FROM refill_requests
+    WHERE idempotency_key = ?
+"""
+
+_DECREMENT_REFILLS_SQL = """
+    UPDATE prescriptions
+    SET refills_left = refills_left - 1
+    WHERE id = ? AND user_id = ? AND LOWER(status) = 'active' AND refills_left > 0
+    RETURNING refills_left
+"""
+
+_PRESCRIPTION_STATE_SQL = """
+    SELECT LOWER(status), refills_left
+    FROM prescriptions
+    WHERE id = ? AND user_id = ?
+"""
+
+_INSERT_REFILL_SQL = """
+    INSERT INTO refill_requests (prescription_id, user_id, idempotency_key, status, refills_left_after)
+    VALUES (?, ?, ?, 'submitted', ?)
+"""
+
+
+def _apply(conn, user_id: int, prescription_id: int, key):
+    if key:
+        row = conn.execute(_REFILL_BY_KEY_SQL, (key,)).fetchone()
+        if row:
+            if row[1] != prescription_id:
+                return {"status": "rejected", "reason": "key_reused"}
+            return {"status": "submitted", "refill_request_id": row[0], "refills_left": row[2], "replayed": True}
+
+    row = conn.execute(_DECREMENT_REFILLS_SQL, (prescription_id, user_id)).fetchone()
+    if row is None:
+        state = conn.execute(_PRESCRIPTION_STATE_SQL, (prescription_id, user_id)).fetchone()
+        if state is None:
+            return {"status": "rejected", "reason": "not_found"}
+        reason = "inactive" if state[0] != "active" else "no_refills"
+        return {"status": "rejected", "reason": reason, "refills_left": state[1]}
+
+    cur = conn.execute(_INSERT_REFILL_SQL, (prescription_id, user_id, key, row[0]))
+    return {"status": "submitted", "refill_request_id": cur.lastrowid, "refills_left": row[0], "replayed": False}
+
+
+class RefillWriter:
+    def __init__(self, batch_max: int = REFILL_BATCH_MAX):
+        self.batch_max = batch_max
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.jobs = 0
+        self.batches = 0
+        self.max_batch = 0
+
+    def submit(self, user_id: int, prescription_id: int, idempotency_key: str = None) -> Future:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="refill-writer", daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((int(user_id), int(prescription_id), idempotency_key or None, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with write_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for user_id, prescription_id, key, _ in batch:
+                    conn.execute("SAVEPOINT refill")
+                    try:
+                        results.append(_apply(conn, user_id, prescription_id, key))
+                        conn.execute("RELEASE refill")
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK TO refill")
+                        conn.execute("RELEASE refill")
+                        results.append(e)
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        invalidate("prescriptions")
+        self.jobs += len(batch)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+        for (*_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "jobs": self.jobs,
+            "batches": self.batches,
+            "avg_batch": round(self.jobs / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "queued": self._queue.qsize(),
+        }
+
+
+refill_writer = RefillWriter()
+
+
+def submit_refill(user_id: int, prescription_id: int, idempotency_key: str = None) -> dict:
+    """
+    Submit a refill and block until it is committed. Returns
+    {"status": "submitted", "refill_request_id", "refills_left", "replayed"} or
+    {"status": "rejected", "reason": "not_found" | "inactive" | "no_refills" | "key_reused", ...}.
+    """
+    return refill_writer.submit(user_id, prescription_id, idempotency_key).result()
+
+
+async def submit_refill_async(user_id: int, prescription_id: int, idempotency_key: str = None) -> dict:
+    """
+    submit_refill() for the event loop: waits on the commit without holding a worker thread.
+    """
+    return await asyncio.wrap_future(refill_writer.submit(user_id, prescription_id, idempotency_key))
@@ -0,0 +1,192 @@
+"""
+Fuzzy medication search over an FTS5 trigram index (`medications_fts`).
+
+The index holds a normalized copy of each medication's English name, Hebrew name
+and active ingredients (lower-cased, niqqud stripped, Hebrew final letters mapped
+to their regular forms), keyed by medication id. A query is normalized the same
+way and split into trigrams; the OR of its trigrams pulls the best bm25 candidates
+out of the index, which are then re-ranked by string similarity. Typos, partial
+names, niqqud/final-letter variants and ingredient names all land on the right
+row with one indexed query, whatever the catalog size. When the medications table
+changes, the index rows that differ are rewritten in the background.
+"""
+import os
+import re
+from difflib import SequenceMatcher
+
+from services.cache import DerivedIndex, cached_tool, invalidate
+from services.db import read_connection, write_connection
+from services.extractor import normalize_hebrew
+
+# A fuzzy hit is taken as the user's medication (no clarification round trip) only
+# when it scores at least this and clearly beats the runner-up.
+MEDICATION_SEARCH_MIN_SCORE = float(os.getenv("MEDICATION_SEARCH_MIN_SCORE", "0.8"))
+MEDICATION_SEARCH_MIN_MARGIN = float(os.getenv("MEDICATION_SEARCH_MIN_MARGIN", "0.05"))
+
+# bm25 candidates fetched per query before re-ranking.
+SEARCH_CANDIDATES = 50
+
+_DOSAGE_RE = re.compile(r"\d+(?:[.,]\d+)?\s*(?:mg|mcg|g|ml|iu|%)?", re.IGNORECASE)
+
+_CREATE_FTS_SQL = """
+    CREATE VIRTUAL TABLE medications_fts USING fts5(
+        name_en, name_he, active_ingredients, tokenize = 'trigram'
+    )
+"""
+
+_FTS_EXISTS_SQL = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'medications_fts'"
+
+_FTS_ROWS_SQL = "SELECT rowid, name_en, name_he, active_ingredients FROM medications_fts"
+
+_FTS_INSERT_SQL = "INSERT INTO medications_fts (rowid, name_en, name_he, active_ingredients) VALUES (?, ?, ?, ?)"
+
+_FTS_SOURCE_SQL = "SELECT id, name_en, name_he, active_ingredients FROM medications"
+
+_FTS_SEARCH_SQL = """
+    SELECT m.id, m.name_en, m.name_he, m.active_ingredients
+    FROM medications_fts f
+    JOIN medications m ON m.id = f.rowid
+    WHERE medications_fts MATCH ?
+    ORDER BY bm25(medications_fts)
+    LIMIT ?
+"""
+
+
+def normalize_search_text(text: str) -> str:
+    return " ".join(normalize_hebrew(text).lower().split())
+
+
+def _trigrams(text: str):
+    grams = []
+    for word in text.split():
+        grams.extend(word[i:i + 3] for i in range(len(word) - 2))
+    return list(dict.fromkeys(grams))
+
+
+def _fields(query: str, name_en: str, name_he: str, ingredients: str):
+    # Only fields in the query's script can be close to it.
+    if any("\u0590" <= ch <= "\u05FF" for ch in query):
+        return [normalize_search_text(name_he)]
+    fields = [normalize_search_text(name_en)]
+    for part in re.split(r"[,+/;]", ingredients):
+        part = normalize_search_text(_DOSAGE_RE.sub(" ", part))
+        if part:
+            fields.append(part)
+    return fields
+
+
+def _similarity(matcher: SequenceMatcher, query: str, field: str) -> float:
+    matcher.set_seq1(field)
+    score = matcher.ratio()
+    if len(query) >= 3 and field.startswith(query):
+        # Partial names ("amoxi") are prefixes of the real one.
+        score = max(score, 0.85 + 0.15 * len(query) / len(field))
+    return score
+
+
+def rebuild_medication_search(conn=None):
+    """
+    (Re)create medications_fts from the medications table (e.g. after the catalog changes).
+    """
+    if conn is None:
+        with write_connection() as conn:
+            return rebuild_medication_search(conn)
+    conn.execute("DROP TABLE IF EXISTS medications_fts")
+    conn.execute(_CREATE_FTS_SQL)
+    conn.executemany(
+        _FTS_INSERT_SQL,
+        ((med_id, *_fts_row(en, he, ingredients)) for med_id, en, he, ingredients in conn.execute(_FTS_SOURCE_SQL).fetchall()),
+    )
+
+
+def _fts_row(en: str, he: str, ingredients: str) -> tuple:
+    return normalize_search_text(en), normalize_search_text(he), normalize_search_text(ingredients)
+
+
+def refresh_medication_search() -> int:
+    """
+    Bring medications_fts in step with medications: built if missing, otherwise only
+    the rows whose medication was added, changed or removed are rewritten (nothing
+    is written when it already matches). Returns the number of indexed medications.
+    """
+    with read_connection() as conn:
+        if conn.execute(_FTS_EXISTS_SQL).fetchone() is None:
+            current = None
+        else:
+            current = {row[0]: tuple(row[1:]) for row in conn.execute(_FTS_ROWS_SQL)}
+        source = {med_id: _fts_row(en, he, ingredients) for med_id, en, he, ingredients in conn.execute(_FTS_SOURCE_SQL)}
+
+    if current is None:
+        rebuild_medication_search()
+        return len(source)
+    stale = [(med_id,) for med_id, row in current.items() if source.get(med_id) != row]
+    fresh = [(med_id, *row) for med_id, row in source.items() if current.get(med_id) != row]
+    if stale or fresh:
+        with write_connection() as conn:
+            conn.executemany("DELETE FROM medications_fts WHERE rowid = ?", stale)
+            conn.executemany(_FTS_INSERT_SQL, fresh)
+        # Searches cached while the index lagged are recomputed.
+        invalidate("medications")
+    return len(source)
+
+
+# Re-checked in the background whenever the medications table changes; a refresh
+# that finds nothing to rewrite writes nothing, so it can't retrigger itself (or
+# other workers) through the external-write probe.
+_search_index = DerivedIndex("medication-search", refresh_medication_search, ("medications",))
+
+
+def ensure_medication_search():
+    """
+    Make sure medications_fts exists and follows the medications table.
+    """
+    _search_index.get()
+
+
+@cached_tool(
+    "medications",
+    tables=("medications",),
+    normalize=lambda query, limit=5: (normalize_search_text(query), int(limit)),
+)
+def search_medications(query: str, limit: int = 5):
+    """
+    Ranked fuzzy search by English/Hebrew name or active ingredient.
+    Returns up to `limit` {id, name_en, name_he, active_ingredients, score}, best first.
+    """
+    # Already normalized when the tool cache is on; TOOL_CACHE=0 passes raw arguments.
+    query = normalize_search_text(query)
+    limit = max(1, min(int(limit), 20))
+    grams = _trigrams(query)
+    if not grams:
+        return []
+    ensure_medication_search()
+    match = " OR ".join('"' + g.replace('"', '""') + '"' for g in grams)
+    with read_connection() as conn:
+        rows = conn.execute(_FTS_SEARCH_SQL, (match, SEARCH_CANDIDATES)).fetchall()
+
+    # The query is seq2: SequenceMatcher indexes it once for every field compared.
+    matcher = SequenceMatcher(None, "", query, autojunk=False)
+    ranked = []
+    for med_id, en, he, ingredients in rows:
+        score = max(_similarity(matcher, query, field) for field in _fields(query, en, he, ingredients))
+        ranked.append({
+            "id": med_id,
+            "name_en": en,
+            "name_he": he,
+            "active_ingredients": ingredients,
+            "score": round(score, 3),
+        })
+    ranked.sort(key=lambda r: r["score"], reverse=True)
+    return ranked[:limit]
+
+
+def best_medication_match(query: str):
+    """
+    The search hit confident enough to stand in for an exact name match, or None.
+    """
+    hits = search_medications(query, 2)
+    if not hits or hits[0]["score"] < MEDICATION_SEARCH_MIN_SCORE:
+        return None
+    if len(hits) > 1 and hits[0]["score"] - hits[1]["score"] < MEDICATION_SEARCH_MIN_MARGIN:
+        return None
+    return hits[0]
@@ -0,0 +1,116 @@
+"""
+Request coalescing ("singleflight") for identical concurrent work on the event loop.
+
+While a call for a key is in flight, later callers with the same key join it
+instead of starting their own: `do()` shares one awaited result, `stream()` fans
+one async stream out to every reader (late joiners replay what was already
+produced, then follow live). Nothing is kept once the call finishes; this is not
+a cache, so keys only need to identify work that is interchangeable *right now*
+(e.g. include data versions).
+
+The shared call runs in its own task, started from the first caller's context,
+so side effects such as stream events and token usage are attributed to it.
+Shared results are the same objects for every caller and must be treated as read-only.
+"""
+import asyncio
+
+_groups = {}
+
+
+class _Stream:
+    __slots__ = ("chunks", "done", "error", "changed", "readers", "task")
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.readers = 0
+        self.task = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.shared = 0
+        _groups[name] = self
+
+    async def do(self, key, fn, *args):
+        """
+        Await `fn(*args)`, or the in-flight call with the same key.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(self._calls, key, f))
+        else:
+            self.shared += 1
+        # A caller that goes away must not cancel the call for the others.
+        return await asyncio.shield(future)
+
+    async def stream(self, key, fn, *args):
+        """
+        Iterate `fn(*args)` (an async iterator), or join the in-flight one with the same key.
+        The producer is cancelled once every reader has gone away.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = self._streams[key] = _Stream()
+            flight.task = asyncio.ensure_future(self._pump(key, flight, fn, args))
+        else:
+            self.shared += 1
+        flight.readers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    position += 1
+                    yield flight.chunks[position - 1]
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                flight.changed.clear()
+                await flight.changed.wait()
+        finally:
+            flight.readers -= 1
+            if flight.readers == 0 and not flight.done:
+                flight.task.cancel()
+
+    async def _pump(self, key, flight, fn, args):
+        try:
+            async for chunk in fn(*args):
+                flight.chunks.append(chunk)
+                flight.changed.set()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.changed.set()
+            self._forget(self._streams, key, flight)
+
+    @staticmethod
+    def _forget(table, key, value):
+        if table.get(key) is value:
+            del table[key]
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.shared
+        return {
+            "calls": calls,
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "dedup_ratio": round(self.shared / calls, 4) if calls else 0.0,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+
+def singleflight_stats() -> dict:
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,310 @@
+"""
+Deadlines, retries and hedged requests for upstream model calls.
+
+- `call_upstream(stage, make_call)` awaits one non-streaming call. The deadline is
+  UPSTREAM_PLAN_TIMEOUT_S. Retryable failures are timeouts, connection errors, 408,
+  409, 429 and 5xx. They are retried up to UPSTREAM_RETRIES times with full-jitter
+  exponential backoff (a server's retry-after wins when it is longer).
+- With `hedge=True` and UPSTREAM_HEDGE=1, a second identical request is sent once
+  the first has run longer than the stage's recent UPSTREAM_HEDGE_PERCENTILE latency.
+  Whichever answers first wins and the other is cancelled. No hedging happens before
+  a stage has latency samples.
+- `stream_upstream(stage, open_stream)` yields the items of a streaming call. Opening
+  the stream and receiving its first chunk must take at most
+  UPSTREAM_FIRST_TOKEN_TIMEOUT_S and are retried like a call. Once a chunk has been
+  passed on, a failure is final, and a gap of more than UPSTREAM_STREAM_IDLE_TIMEOUT_S
+  between chunks aborts the stream.
+
+Every retry and hedge spends one unit of the chat request's budget
+(UPSTREAM_EXTRA_CALLS, set per request with `start_request_budget()`). A request
+therefore never costs more than that many extra upstream calls, even during an
+outage or a latency spike. Calls outside a request are not budgeted.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import time
+from collections import deque
+
+UPSTREAM_PLAN_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_PLAN_TIMEOUT_S", "20"))
+UPSTREAM_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_FIRST_TOKEN_TIMEOUT_S", "20"))
+UPSTREAM_STREAM_IDLE_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_STREAM_IDLE_TIMEOUT_S", "15"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MS", "200")) / 1000
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MAX_MS", "2000")) / 1000
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0") == "1"
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+UPSTREAM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY_MS", "50")) / 1000
+UPSTREAM_EXTRA_CALLS = int(os.getenv("UPSTREAM_EXTRA_CALLS", "3"))
+
+# Latency samples kept per stage, and how many are needed before hedging starts.
+LATENCY_WINDOW = 256
+HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class RequestBudget:
+    """
+    Extra upstream calls (retries + hedges) one chat request may still make.
+    """
+
+    __slots__ = ("remaining", "spent")
+
+    def __init__(self, extra_calls: int):
+        self.remaining = extra_calls
+        self.spent = 0
+
+    def take(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        self.spent += 1
+        return True
+
+
+current_budget = contextvars.ContextVar("upstream_budget", default=None)
+
+
+def start_request_budget(extra_calls: int = UPSTREAM_EXTRA_CALLS) -> RequestBudget:
+    budget = RequestBudget(extra_calls)
+    current_budget.set(budget)
+    return budget
+
+
+class _Stage:
+    __slots__ = (
+        "latencies", "calls", "attempts", "retries", "hedges", "hedge_wins",
+        "timeouts", "failures", "budget_denied",
+    )
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.budget_denied = 0
+
+    def percentile(self, pct: float):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def stats(self) -> dict:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "budget_denied": self.budget_denied,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else 0.0,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else 0.0,
+        }
+
+
+_stages = {}
+
+
+def _stage(name: str) -> _Stage:
+    stage = _stages.get(name)
+    if stage is None:
+        stage = _stages[name] = _Stage()
+    return stage
+
+
+def upstream_stats() -> dict:
+    return {name: stage.stats() for name, stage in sorted(_stages.items())}
+
+
+def _spend(stage: _Stage) -> bool:
+    budget = current_budget.get()
+    if budget is None or budget.take():
+        return True
+    stage.budget_denied += 1
+    return False
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    from openai import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (
+        error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    )
+
+
+def _retry_after(error: BaseException):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff(attempt: int, error: BaseException = None) -> float:
+    """
+    Full-jitter exponential backoff before retry `attempt` (1-based).
+    """
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX_SECONDS, UPSTREAM_BACKOFF_SECONDS * 2 ** (attempt - 1)))
+    hinted = _retry_after(error) if error is not None else None
+    if hinted is not None:
+        delay = max(delay, min(hinted, UPSTREAM_BACKOFF_MAX_SECONDS))
+    return delay
+
+
+async def _attempt(stage: _Stage, make_call, timeout: float, sample_cancelled: bool = True):
+    stage.attempts += 1
+    started = time.perf_counter()
+    try:
+        # asyncio.timeout awaits the call in this task: no inner task whose error could go unretrieved.
+        async with asyncio.timeout(timeout):
+            result = await make_call()
+    except asyncio.TimeoutError:
+        stage.timeouts += 1
+        raise
+    except asyncio.CancelledError:
+        # A request that lost to its hedge was at least this slow; leaving it out
+        # would drag the percentile (and so the hedge delay) down.
+        if sample_cancelled:
+            stage.latencies.append(time.perf_counter() - started)
+        raise
+    stage.latencies.append(time.perf_counter() - started)
+    return result
+
+
+async def _hedged(stage: _Stage, make_call, timeout: float):
+    delay = stage.percentile(UPSTREAM_HEDGE_PERCENTILE)
+    if delay is None:
+        return await _attempt(stage, make_call, timeout)
+    delay = max(delay, UPSTREAM_HEDGE_MIN_DELAY_SECONDS)
+    if delay >= timeout:
+        return await _attempt(stage, make_call, timeout)
+
+    primary = asyncio.ensure_future(_attempt(stage, make_call, timeout))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and _spend(stage):
+            stage.hedges += 1
+            # The hedge gets what is left of the call's deadline.
+            tasks.add(asyncio.ensure_future(_attempt(stage, make_call, timeout - delay, sample_cancelled=False)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        stage.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_upstream(stage_name: str, make_call, timeout: float = UPSTREAM_PLAN_TIMEOUT_SECONDS, hedge: bool = False):
+    """
+    Await `make_call()` (which must start a fresh request each time) with a deadline,
+    retries and optional hedging.
+    """
+    stage = _stage(stage_name)
+    stage.calls += 1
+    attempt = 0
+    while True:
+        try:
+            if hedge and UPSTREAM_HEDGE:
+                return await _hedged(stage, make_call, timeout)
+            return await _attempt(stage, make_call, timeout)
+        except Exception as e:
+            if attempt >= UPSTREAM_RETRIES or not is_retryable(e) or not _spend(stage):
+                stage.failures += 1
+                raise
+            attempt += 1
+            stage.retries += 1
+            await asyncio.sleep(backoff(attempt, e))
+
+
+async def _close(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+async def stream_upstream(
+    stage_name: str,
+    open_stream,
+    first_token_timeout: float = UPSTREAM_FIRST_TOKEN_TIMEOUT_SECONDS,
+    idle_timeout: float = UPSTREAM_STREAM_IDLE_TIMEOUT_SECONDS,
+):
+    """
+    Yield the chunks of `await open_stream()`. Opening and the first chunk are retried;
+    after that a failure or an idle gap ends the stream with an error.
+    """
+    stage = _stage(stage_name)
+    stage.calls += 1
+    attempt = 0
+    while True:
+        stage.attempts += 1
+        started = time.perf_counter()
+        stream = None
+        try:
+            async with asyncio.timeout(first_token_timeout):
+                stream = await open_stream()
+                iterator = stream.__aiter__()
+                first = await iterator.__anext__()
+            break
+        except StopAsyncIteration:
+            await _close(stream)
+            return
+        except Exception as e:
+            await _close(stream)
+            if isinstance(e, asyncio.TimeoutError):
+                stage.timeouts += 1
+            if attempt >= UPSTREAM_RETRIES or not is_retryable(e) or not _spend(stage):
+                stage.failures += 1
+                raise
+            attempt += 1
+            stage.retries += 1
+            await asyncio.sleep(backoff(attempt, e))
+
+    # Time to first chunk is the latency that matters for a stream.
+    stage.latencies.append(time.perf_counter() - started)
+    try:
+        yield first
+        while True:
+            try:
+                async with asyncio.timeout(idle_timeout):
+                    chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                stage.timeouts += 1
+                stage.failures += 1
+                raise
+            yield chunk
+    finally:
+        await _close(stream)
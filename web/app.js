@@ -24,6 +24,13 @@ function addMessage(role, content) {
   return contentEl;
 }
 
+function newIdempotencyKey() {
+  // crypto.randomUUID only exists in secure contexts (HTTPS or localhost); plain-http hosts get random hex.
+  if (crypto.randomUUID) return crypto.randomUUID();
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  return Array.from(bytes, (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
 async function send() {
   const userText = inputEl.value.trim();
   if (!userText) return;
@@ -36,24 +43,55 @@ async function send() {
 
   const res = await fetch("/chat/stream", {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ messages })
+    headers: { "Content-Type": "application/json", "Accept": "application/x-ndjson" },
+    // One key per user message: a retried send can't submit the same refill twice.
+    body: JSON.stringify({ messages, idempotency_key: newIdempotencyKey() })
   });
 
   const reader = res.body.getReader();
   const decoder = new TextDecoder();
 
   let assistantText = "";
+  let pending = "";
+  assistantContentEl.textContent = "…";
+
+  // NDJSON events: ack / status / tool_start / tool_end / text / error / done
+  let ack = "…";
+  function handle(event) {
+    if (event.type === "ack" && event.text) {
+      // Shown until the answer starts; not kept in the conversation history.
+      ack = event.text;
+      if (!assistantText) assistantContentEl.textContent = ack;
+    } else if (event.type === "text") {
+      assistantText += event.text;
+      assistantContentEl.textContent = assistantText;
+    } else if (event.type === "tool_start" && !assistantText) {
+      assistantContentEl.textContent = `${ack} (${event.tool})`;
+    } else if (event.type === "error" && event.code === "busy") {
+      assistantContentEl.textContent = event.message;
+    } else if (event.type === "error") {
+      assistantText += `\n[${event.message}]`;
+      assistantContentEl.textContent = assistantText;
+    }
+    chatEl.scrollTop = chatEl.scrollHeight;
+  }
 
   while (true) {
     const { value, done } = await reader.read();
     if (done) break;
-    const chunk = decoder.decode(value, { stream: true });
-    assistantText += chunk;
-    assistantContentEl.textContent = assistantText;
-    chatEl.scrollTop = chatEl.scrollHeight;
+    pending += decoder.decode(value, { stream: true });
+    const lines = pending.split("\n");
+    pending = lines.pop();
+    for (const line of lines) {
+      if (line.trim()) handle(JSON.parse(line));
+    }
   }
 
+  if (res.status === 503) {
+    // Not admitted (server busy): the turn never happened, so it is left out of the history.
+    messages.pop();
+    return;
+  }
   messages.push({ role: "assistant", content: assistantText });
 }
 